@@ -6,12 +6,27 @@ import torch.nn.functional as F
 import torch.utils.data
 from simalign.simalign import *
 import argparse
+import functools
+import itertools
+import json
+import os
+import tempfile
+from typing import Callable, Dict, List, Optional, Set, Tuple
+from projection.alignment_store import talp2binary
+from projection.compression import open_file
+from projection.dataset import count_lines
+from projection.embedding_cache import DEFAULT_EMBEDDING_CACHE_SIZE_GB, EmbeddingCache
+from projection.sentence_alignment_cache import SentenceAlignmentCache
 
 
-def gather_null_aligns(sim_matrix: np.ndarray, inter_matrix: np.ndarray) -> List[float]:
+def null_align_entropies(sim_matrix: np.ndarray) -> np.ndarray:
+    """
+    Normalized entropy of the similarities of each cell of the similarity matrix: the minimum of the entropy of its
+    row and the entropy of its column. Zero for matrices with 2 or less rows or columns, they are not thresholded.
+    """
     shape = sim_matrix.shape
     if min(shape[0], shape[1]) <= 2:
-        return []
+        return np.zeros(shape)
     norm_x = normalize(sim_matrix, axis=1, norm="l1")
     norm_y = normalize(sim_matrix, axis=0, norm="l1")
 
@@ -25,30 +40,390 @@ def gather_null_aligns(sim_matrix: np.ndarray, inter_matrix: np.ndarray) -> List
     mask_x = np.tile(entropy_x[:, np.newaxis], (1, shape[1]))
     mask_y = np.tile(entropy_y, (shape[0], 1))
 
-    all_ents = np.multiply(inter_matrix, np.minimum(mask_x, mask_y))
-    return [x.item() for x in np.nditer(all_ents) if x.item() > 0]
+    return np.minimum(mask_x, mask_y)
+
+
+def gather_null_aligns(entropies: np.ndarray, inter_matrix: np.ndarray) -> np.ndarray:
+    all_ents = np.multiply(inter_matrix, entropies).ravel()
+    return all_ents[all_ents > 0]
 
 
 def apply_percentile_null_aligns(
-    sim_matrix: np.ndarray, ratio: float = 1.0
+    entropies: np.ndarray, ratio: float = 1.0
 ) -> np.ndarray:
-    shape = sim_matrix.shape
-    if min(shape[0], shape[1]) <= 2:
-        return np.ones(shape)
-    norm_x = normalize(sim_matrix, axis=1, norm="l1")
-    norm_y = normalize(sim_matrix, axis=0, norm="l1")
-    entropy_x = np.array(
-        [entropy(norm_x[i, :]) / np.log(shape[1]) for i in range(shape[0])]
+    return np.where(entropies > ratio, 0.0, 1.0)
+
+
+def batch_alignment_matrices(
+    sim_matrices: List[np.ndarray],
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Forward and reverse alignment matrices (SentenceAligner.get_alignment_matrix) of a batch of similarity matrices,
+    computed with a single argmax over the padded batch.
+    :param List[np.ndarray] sim_matrices: Similarity matrix of each sentence, (source subwords, target subwords).
+    :return: Two bool arrays (sentences, max source subwords, max target subwords), the padding cells are False.
+    """
+    src_lengths = np.array([sim.shape[0] for sim in sim_matrices])
+    trg_lengths = np.array([sim.shape[1] for sim in sim_matrices])
+    shape = (
+        len(sim_matrices),
+        max(src_lengths, default=0),
+        max(trg_lengths, default=0),
     )
-    entropy_y = np.array(
-        [entropy(norm_y[:, j]) / np.log(shape[0]) for j in range(shape[1])]
+    batch_sim = np.full(shape, -np.inf)
+    for i, sim in enumerate(sim_matrices):
+        batch_sim[i, : sim.shape[0], : sim.shape[1]] = sim
+    mask = (np.arange(shape[1])[None, :, None] < src_lengths[:, None, None]) & (
+        np.arange(shape[2])[None, None, :] < trg_lengths[:, None, None]
     )
-    mask_x = np.tile(entropy_x[:, np.newaxis], (1, shape[1]))
-    mask_y = np.tile(entropy_y, (shape[0], 1))
 
-    ents_mask = np.where(np.minimum(mask_x, mask_y) > ratio, 0.0, 1.0)
+    forward = np.zeros(shape, dtype=bool)
+    backward = np.zeros(shape, dtype=bool)
+    if shape[1] and shape[2]:
+        # argmax returns the first maximum, as in get_alignment_matrix
+        np.put_along_axis(forward, batch_sim.argmax(axis=2)[:, :, None], True, axis=2)
+        np.put_along_axis(backward, batch_sim.argmax(axis=1)[:, None, :], True, axis=1)
+    return forward & mask, backward & mask
+
+
+def alignment_matrices(
+    sim: np.ndarray,
+    forward: np.ndarray,
+    backward: np.ndarray,
+    matching_methods: List[str],
+) -> Dict[str, np.ndarray]:
+    """
+    Alignment matrices of a sentence pair for the matching methods (inter, mwmf, itermax).
+    :param np.ndarray sim: Similarity matrix, (source subwords, target subwords).
+    :param np.ndarray forward: Forward alignment matrix of the sentence pair (batch_alignment_matrices).
+    :param np.ndarray backward: Reverse alignment matrix of the sentence pair (batch_alignment_matrices).
+    """
+    all_mats = {"fwd": forward, "rev": backward, "inter": forward & backward}
+    if "mwmf" in matching_methods:
+        all_mats["mwmf"] = SentenceAligner.get_max_weight_match(sim)
+    if "itermax" in matching_methods:
+        all_mats["itermax"] = SentenceAligner.iter_max(sim)
+    return all_mats
+
+
+def word_alignments(
+    matrix: np.ndarray, b2w_map: List[np.ndarray]
+) -> Set[Tuple[int, int]]:
+    """
+    Aligned (source word, target word) pairs of a subword alignment matrix.
+    :param List[np.ndarray] b2w_map: Word of each source and target subword.
+    """
+    src_ids, trg_ids = np.nonzero(matrix)
+    return set(zip(b2w_map[0][src_ids].tolist(), b2w_map[1][trg_ids].tolist()))
+
+
+def embed_input_ids(
+    embed_loader, input_ids: List[np.ndarray], layer: int, device
+) -> torch.Tensor:
+    """
+    Subword embeddings (without the special tokens) of a batch of sentences, (sentences, subwords, hidden size).
+    Same as EmbeddingLoader.get_embed_list, but the inputs are the input ids of the sentences (SubwordTokenizer).
+    """
+    inputs = embed_loader.tokenizer.pad(
+        {"input_ids": [sentence_ids.tolist() for sentence_ids in input_ids]},
+        return_tensors="pt",
+    )
+    with torch.no_grad():
+        hidden = embed_loader.emb_model(**inputs.to(device))["hidden_states"]
+    if layer >= len(hidden):
+        raise ValueError(
+            f"Specified to take embeddings from layer {layer}, but model has only {len(hidden)} layers."
+        )
+    return hidden[layer][:, 1:-1, :]
+
+
+def batch_similarity_matrices(
+    vectors_src: torch.Tensor, vectors_trg: torch.Tensor
+) -> np.ndarray:
+    """
+    Cosine similarities, scaled to [0, 1], between the subword embeddings of a batch of sentence pairs.
+    :return: Array (sentences, max source subwords, max target subwords).
+    """
+    vectors_src = F.normalize(vectors_src, dim=2)
+    vectors_trg = F.normalize(vectors_trg, dim=2)
+    sim = torch.bmm(vectors_src, torch.transpose(vectors_trg, 1, 2))
+    return ((sim + 1.0) / 2.0).cpu().detach().numpy()
+
+
+# Sentence pairs read, tokenized and aligned together, the memory used depends on it and not on the corpus size
+DEFAULT_CHUNK_SIZE: int = 100000
+# Sentences tokenized per call to the tokenizer
+TOKENIZATION_BATCH_SIZE: int = 1000
+# Words whose subwords are kept in the LRU cache of the slow tokenizers
+WORD_CACHE_SIZE: int = 1 << 16
+
 
-    return ents_mask
+class SubwordTokenizer:
+    """
+    Subwords of each word of whitespace-tokenized sentences and the model inputs of the sentences, from a single
+    tokenization pass. Fast tokenizers tokenize a batch of sentences with a single call (is_split_into_words), the
+    subwords are mapped to their words with word_ids. Slow tokenizers tokenize each word, the subwords of the last
+    word_cache_size words are kept in an LRU cache. The sentences are truncated to the maximum length of the model,
+    the words after it have no subwords.
+
+    Byte-level BPE fast tokenizers (RoBERTa, GPT-2) loaded without add_prefix_space=True cannot tokenize
+    pre-tokenized sentences (or tokenize them differently from single words), they use the per-word path as slow
+    tokenizers do.
+    """
+
+    def __init__(self, tokenizer, word_cache_size: int = WORD_CACHE_SIZE):
+        self.tokenizer = tokenizer
+        self.split_into_words = getattr(
+            tokenizer, "is_fast", False
+        ) and not self.byte_level_without_prefix_space(tokenizer)
+        self.tokenize_word = functools.lru_cache(maxsize=word_cache_size)(
+            lambda word: tuple(self.tokenizer.tokenize(word))
+        )
+
+    def __call__(
+        self, sentences: List[str]
+    ) -> Tuple[List[List[List[str]]], List[np.ndarray]]:
+        """
+        :param List[str] sentences: Whitespace-tokenized sentences.
+        :return: The subwords of each word of each sentence and the input ids of each sentence (with the special
+        tokens of the model).
+        """
+        sentences_words = [sentence.split() for sentence in sentences]
+        words_tokens: List[List[List[str]]] = []
+        input_ids: List[np.ndarray] = []
+
+        if self.split_into_words:
+            encodings = self.tokenizer(
+                sentences_words, is_split_into_words=True, truncation=True
+            )
+            for i, words in enumerate(sentences_words):
+                sentence_tokens: List[List[str]] = [[] for _ in words]
+                for token, word_id in zip(encodings.tokens(i), encodings.word_ids(i)):
+                    # Special tokens do not belong to any word
+                    if word_id is not None:
+                        sentence_tokens[word_id].append(token)
+                words_tokens.append(sentence_tokens)
+                input_ids.append(np.array(encodings["input_ids"][i], dtype=np.int64))
+            return words_tokens, input_ids
+
+        max_length: int = (
+            self.tokenizer.model_max_length - self.tokenizer.num_special_tokens_to_add()
+        )
+        for words in sentences_words:
+            sentence_tokens = []
+            num_tokens: int = 0
+            for word in words:
+                tokens = list(
+                    self.tokenize_word(word)[: max(max_length - num_tokens, 0)]
+                )
+                sentence_tokens.append(tokens)
+                num_tokens += len(tokens)
+            words_tokens.append(sentence_tokens)
+            input_ids.append(
+                np.array(
+                    self.tokenizer.build_inputs_with_special_tokens(
+                        self.tokenizer.convert_tokens_to_ids(
+                            [token for tokens in sentence_tokens for token in tokens]
+                        )
+                    ),
+                    dtype=np.int64,
+                )
+            )
+        return words_tokens, input_ids
+
+    @staticmethod
+    def byte_level_without_prefix_space(tokenizer) -> bool:
+        """
+        Whether the fast tokenizer has a byte-level pre-tokenizer that does not add a space before the first word.
+        """
+        if getattr(tokenizer, "add_prefix_space", False):
+            return False
+        backend_tokenizer = getattr(tokenizer, "backend_tokenizer", None)
+        if backend_tokenizer is None:
+            return False
+        pre_tokenizer = json.loads(backend_tokenizer.to_str()).get("pre_tokenizer")
+        pre_tokenizers = [pre_tokenizer] if pre_tokenizer else []
+        while pre_tokenizers:
+            pre_tokenizer = pre_tokenizers.pop()
+            if pre_tokenizer.get("type") == "ByteLevel":
+                return not pre_tokenizer.get("add_prefix_space", False)
+            pre_tokenizers.extend(pre_tokenizer.get("pretokenizers", []))
+        return False
+
+
+# Sentences are sorted by length within windows of BUCKET_WINDOW_BATCHES * batch_size consecutive sentences
+BUCKET_WINDOW_BATCHES: int = 100
+
+
+class LengthBucketSampler:
+    """
+    Batch sampler (torch DataLoader batch_sampler) that groups sentence pairs with a similar number of subwords, so
+    a long sentence does not pad a whole batch. The sentences are sorted by length within windows of consecutive
+    sentences: the alignments of a window are written in the original order once the window is aligned, so only a
+    window of alignments is kept in memory.
+    """
+
+    def __init__(
+        self,
+        lengths: List[Tuple[int, int]],
+        batch_size: int,
+        max_tokens: Optional[int] = None,
+        window_size: Optional[int] = None,
+    ):
+        """
+        :param List[Tuple[int, int]] lengths: Number of source and target subwords of each sentence pair.
+        :param int batch_size: Maximum number of sentence pairs per batch.
+        :param int max_tokens: Maximum number of padded subwords per batch, sentences * (longest source + longest
+        target). A longer sentence pair is aligned in a batch of its own. None to only use batch_size.
+        :param int window_size: Number of consecutive sentences sorted together. Defaults to
+        BUCKET_WINDOW_BATCHES * batch_size.
+        """
+        self.lengths = lengths
+        self.batch_size = batch_size
+        self.max_tokens = max_tokens
+        self.window_size = (
+            window_size if window_size else BUCKET_WINDOW_BATCHES * batch_size
+        )
+
+    def __iter__(self):
+        for window_start in range(0, len(self.lengths), self.window_size):
+            window = sorted(
+                range(
+                    window_start,
+                    min(window_start + self.window_size, len(self.lengths)),
+                ),
+                key=lambda i: self.lengths[i][0] + self.lengths[i][1],
+            )
+            batch: List[int] = []
+            max_src_length: int = 0
+            max_trg_length: int = 0
+            for i in window:
+                src_length = max(max_src_length, self.lengths[i][0])
+                trg_length = max(max_trg_length, self.lengths[i][1])
+                if batch and (
+                    len(batch) == self.batch_size
+                    or (
+                        self.max_tokens
+                        and (len(batch) + 1) * (src_length + trg_length)
+                        > self.max_tokens
+                    )
+                ):
+                    yield batch
+                    batch = []
+                    src_length, trg_length = self.lengths[i]
+                batch.append(i)
+                max_src_length, max_trg_length = src_length, trg_length
+            if batch:
+                yield batch
+
+
+class StreamingQuantile:
+    """
+    Bounded-memory quantile of a stream of values in [0, 1] (the null alignment entropies). The values are counted
+    in a histogram with num_bins bins. quantile returns the exact value sorted(values)[int(q * len(values))]: the
+    histogram gives the bin of that value and its rank in the bin, a second pass over the values only keeps the
+    values of that bin.
+    """
+
+    def __init__(self, num_bins: int = 1 << 16):
+        self.num_bins = num_bins
+        self.counts = np.zeros(num_bins, dtype=np.int64)
+
+    def bins(self, values: np.ndarray) -> np.ndarray:
+        return np.clip((values * self.num_bins).astype(np.int64), 0, self.num_bins - 1)
+
+    def add(self, values: np.ndarray) -> None:
+        self.counts += np.bincount(self.bins(values), minlength=self.num_bins)
+
+    def __len__(self) -> int:
+        return int(self.counts.sum())
+
+    def quantile(self, q: float, values_iterator: Callable) -> float:
+        """
+        :param float q: Quantile in [0, 1).
+        :param Callable values_iterator: Function that returns an iterator over the values added to the sketch, in
+        arrays.
+        """
+        rank: int = int(q * len(self))
+        assert 0 <= rank < len(self), f"Quantile {q} of {len(self)} values"
+        cumulative_counts = np.cumsum(self.counts)
+        quantile_bin: int = int(np.searchsorted(cumulative_counts, rank, side="right"))
+        if quantile_bin:
+            rank -= int(cumulative_counts[quantile_bin - 1])
+        bin_values = np.concatenate(
+            [np.zeros(0)]
+            + [
+                values[self.bins(values) == quantile_bin]
+                for values in values_iterator()
+            ]
+        )
+        return float(np.partition(bin_values, rank)[rank])
+
+
+class SentenceMatrixStore:
+    """
+    Matrices of every sentence with the shape of its similarity matrix (a file per matrix name) and a JSON metadata
+    object per sentence, appended to files in directory and read back in the same order, with memory-mapping, once
+    finish is called. The index of the sentences (sentence id and shape) is a file too, so the memory used does not
+    depend on the number of sentences.
+    """
+
+    def __init__(self, directory: str, dtypes: Dict[str, type]):
+        self.dtypes = dtypes
+        self.paths = {name: os.path.join(directory, f"{name}.bin") for name in dtypes}
+        self.index_path = os.path.join(directory, "index.bin")
+        self.metadata_path = os.path.join(directory, "metadata.jsonl")
+        self.files = {name: open(path, "wb") for name, path in self.paths.items()}
+        self.index_file = open(self.index_path, "wb")
+        self.metadata_file = open(self.metadata_path, "wb")
+        self.num_sentences: int = 0
+
+    def append(
+        self,
+        sent_id: int,
+        shape: Tuple[int, int],
+        matrices: Dict[str, np.ndarray],
+        metadata=None,
+    ) -> None:
+        for name, file in self.files.items():
+            file.write(
+                np.ascontiguousarray(matrices[name], dtype=self.dtypes[name]).tobytes()
+            )
+        self.index_file.write(
+            np.array([sent_id, shape[0], shape[1]], dtype=np.int64).tobytes()
+        )
+        self.metadata_file.write((json.dumps(metadata) + "\n").encode("utf8"))
+        self.num_sentences += 1
+
+    def finish(self) -> None:
+        for file in [*self.files.values(), self.index_file, self.metadata_file]:
+            file.close()
+
+    def __iter__(self):
+        """
+        (sentence id, matrices, metadata) of each sentence, in the order they were appended.
+        """
+        if not self.num_sentences:
+            return
+        index = np.memmap(self.index_path, dtype=np.int64, mode="r").reshape(-1, 3)
+        # Empty files cannot be memory-mapped
+        matrices = {
+            name: (
+                np.memmap(path, dtype=self.dtypes[name], mode="r")
+                if os.path.getsize(path)
+                else np.zeros(0, dtype=self.dtypes[name])
+            )
+            for name, path in self.paths.items()
+        }
+        offset: int = 0
+        with open(self.metadata_path, "rb") as metadata_file:
+            for sent_id, rows, cols in index:
+                size = int(rows * cols)
+                yield int(sent_id), {
+                    name: matrix[offset : offset + size].reshape(rows, cols)
+                    for name, matrix in matrices.items()
+                }, json.loads(metadata_file.readline())
+                offset += size
 
 
 # --------------------------------------------------------
@@ -65,7 +440,21 @@ def generate_word_alignments_simalign(
     batch_size: int = 100,
     num_test_sents: int = None,
     log: bool = False,
+    binary_alignments: bool = False,
+    sentence_cache_path: str = None,
+    layer: int = 8,
+    embedding_cache_dir: str = None,
+    embedding_cache_size: float = DEFAULT_EMBEDDING_CACHE_SIZE_GB,
+    bucket_by_length: bool = False,
+    max_tokens: Optional[int] = None,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
 ):
+    """
+    Align the sentences of two parallel files with SimAlign. The files are streamed: chunk_size sentence pairs are
+    read, tokenized, embedded and written at a time, so the memory used does not depend on the size of the corpus.
+    With null_align < 1.0 the alignment matrices are stored in a temporary directory next to the output until the
+    null alignment threshold of the whole corpus is known.
+    """
 
     if model == "bert":
         model = "bert-base-multilingual-cased"
@@ -83,13 +472,31 @@ def generate_word_alignments_simalign(
         f"token_type: {token_type}\n"
         f"matching_methods: {matching_methods}\n"
         f"batch_size: {batch_size}\n"
-        f"num_test_sents: {num_test_sents}"
+        f"num_test_sents: {num_test_sents}\n"
+        f"sentence_cache_path: {sentence_cache_path}\n"
+        f"layer: {layer}\n"
+        f"embedding_cache_dir: {embedding_cache_dir}\n"
+        f"bucket_by_length: {bucket_by_length}\n"
+        f"max_tokens: {max_tokens}\n"
+        f"chunk_size: {chunk_size}"
     )
 
-    langs = [source_file, target_file]
-    max_sent_id = num_test_sents
     convert_to_words = token_type == "word"
 
+    # The corpora are checked before any output is written, the number of lines is given by the sentence index of
+    # the files (a single pass, cached next to the file)
+    corpora_lengths = [
+        (
+            count_lines(path)
+            if num_test_sents is None
+            else min(count_lines(path), num_test_sents)
+        )
+        for path in [source_file, target_file]
+    ]
+    if corpora_lengths[0] != corpora_lengths[1]:
+        LOG.warning("Mismatch in corpus lengths: " + str(corpora_lengths))
+        raise ValueError("Cannot load parallel corpus.")
+
     if torch.cuda.is_available():
         device = torch.device("cuda:0")
     else:
@@ -97,47 +504,14 @@ def generate_word_alignments_simalign(
         logging.warning("GPU not found, using CPU (slower)...")
 
     # --------------------------------------------------------
-    embed_loader = EmbeddingLoader(model=model, device=device)
-
-    original_paths = [lang for lang in langs]
-    original_corpora = []
-    for path in original_paths:
-        corpus = [
-            line.rstrip().strip()
-            for line in open(path, "r", encoding="utf8").readlines()
-        ]
-        corpus = [
-            regex.sub("\\p{C}+", "", regex.sub("\\p{Separator}+", " ", line)).strip()
-            for line in corpus
-        ]
-        original_corpora.append(corpus[:max_sent_id])
-
-    words_tokens = []
-    for sent_id in range(len(original_corpora[0])):
-        l1_tokens = [
-            embed_loader.tokenizer.tokenize(word)
-            for word in original_corpora[0][sent_id].split()
-        ]
-        l2_tokens = [
-            embed_loader.tokenizer.tokenize(word)
-            for word in original_corpora[1][sent_id].split()
-        ]
-        words_tokens.append([l1_tokens, l2_tokens])
-
-    sentences_bpe_lists = []
-    sentences_b2w_map = []
-    for sent_id in range(len(words_tokens)):
-        sent_pair = [[bpe for w in sent for bpe in w] for sent in words_tokens[sent_id]]
-        b2w_map_pair = [
-            [i for i, w in enumerate(sent) for _ in w] for sent in words_tokens[sent_id]
-        ]
-        sentences_bpe_lists.append(sent_pair)
-        sentences_b2w_map.append(b2w_map_pair)
+    # The model is only loaded if we need it, with the embedding cache a run may not need it at all
+    embed_loader = None
 
-    corpora_lengths = [len(corpus) for corpus in original_corpora]
-    if min(corpora_lengths) != max(corpora_lengths):
-        LOG.warning("Mismatch in corpus lengths: " + str(corpora_lengths))
-        raise ValueError("Cannot load parallel corpus.")
+    def get_embed_loader():
+        nonlocal embed_loader
+        if embed_loader is None:
+            embed_loader = EmbeddingLoader(model=model, device=device, layer=layer)
+        return embed_loader
 
     # --------------------------------------------------------
     all_matching_methods = {
@@ -149,165 +523,465 @@ def generate_word_alignments_simalign(
     }
     matching_methods = [all_matching_methods[m] for m in matching_methods]
 
+    # The subword embeddings (and the subword tokens) of the sentences found in the embedding cache are not
+    # computed again, only the sentences that are not in the cache go through the model.
+    embedding_cache = None
+    if embedding_cache_dir:
+        embedding_cache = EmbeddingCache(
+            cache_dir=embedding_cache_dir,
+            model_name_or_path=model,
+            layer=layer,
+            max_size_gb=embedding_cache_size,
+        )
+
+    # Sentence pairs already aligned in a previous run are taken from the sentence alignment cache, only the
+    # remaining pairs are aligned. With null_align < 1.0 the alignments depend on the whole corpus (the null
+    # alignment threshold), so the cache is not used.
+    sentence_cache = None
+    if sentence_cache_path and null_align < 1.0:
+        print(
+            f"The sentence alignment cache cannot be used with null_align < 1.0. Ignoring {sentence_cache_path}"
+        )
+    elif sentence_cache_path:
+        sentence_cache = SentenceAlignmentCache(
+            path=sentence_cache_path,
+            alignment_method="simalign",
+            model_name_or_path=model,
+            parameters={
+                "distortion": distortion,
+                "token_type": token_type,
+                "layer": layer,
+            },
+        )
+
+    # State of the chunk being aligned. The sentences of the chunk are indexed by their position in the chunk,
+    # the cached alignments and the cache keys by their sentence id in the corpus.
+    original_corpora = [[], []]
+    cached_embeddings = {}
+    words_tokens = []
+    sentences_input_ids = [[], []]
+    sentences_bpe_lists = []
+    sentences_b2w_map = []
+    cached_alignments = {}
+    cache_keys = {}
+
+    # Sentences are tokenized once, the subwords give the alignments of the words and the input ids are the inputs
+    # of the model. The sentences in the embedding cache are not tokenized, their subwords are in the cache.
+    subword_tokenizer = None
+
+    def tokenize(sentences):
+        nonlocal subword_tokenizer
+        if subword_tokenizer is None:
+            subword_tokenizer = SubwordTokenizer(get_embed_loader().tokenizer)
+        return subword_tokenizer(sentences)
+
+    def embed(input_ids):
+        return embed_input_ids(get_embed_loader(), input_ids, layer, device)
+
+    def get_embed_list(sent_ids, side):
+        """
+        Subword embeddings of a batch of sentences of a side of the chunk, (sentences, subwords, hidden size). The
+        sentences in the embedding cache are read from the cache and the new ones are added to it.
+        """
+        if embedding_cache is None:
+            return embed([sentences_input_ids[side][sent_id] for sent_id in sent_ids])
+
+        sentences = [original_corpora[side][sent_id] for sent_id in sent_ids]
+        vectors = {}
+        for sentence in sentences:
+            if sentence in cached_embeddings and sentence not in vectors:
+                try:
+                    vectors[sentence] = np.array(
+                        embedding_cache.vectors(cached_embeddings[sentence])
+                    )
+                except OSError:
+                    # The segment was evicted by another process
+                    del cached_embeddings[sentence]
+
+        new_sent_ids = {}
+        for sent_id, sentence in zip(sent_ids, sentences):
+            if sentence not in vectors:
+                new_sent_ids.setdefault(sentence, sent_id)
+        if new_sent_ids:
+            new_sentences = list(new_sent_ids)
+            new_tokens = [
+                words_tokens[sent_id][side] for sent_id in new_sent_ids.values()
+            ]
+            new_input_ids = [
+                sentences_input_ids[side][sent_id] for sent_id in new_sent_ids.values()
+            ]
+            if any(input_ids is None for input_ids in new_input_ids):
+                # Sentences evicted from the cache were not tokenized
+                new_input_ids = tokenize(new_sentences)[1]
+            new_vectors = embed(new_input_ids).cpu().detach().numpy()
+            new_vectors = [
+                new_vectors[i, : sum(len(word) for word in new_tokens[i])]
+                for i in range(len(new_sentences))
+            ]
+            embedding_cache.put_many(new_sentences, new_tokens, new_vectors)
+            vectors.update(zip(new_sentences, new_vectors))
+
+        batch_vectors = np.zeros(
+            (
+                len(sentences),
+                max(len(vectors[sentence]) for sentence in sentences),
+                vectors[sentences[0]].shape[1],
+            ),
+            dtype=np.float32,
+        )
+        for i, sentence in enumerate(sentences):
+            batch_vectors[i, : len(vectors[sentence])] = vectors[sentence]
+        return torch.from_numpy(batch_vectors).to(device)
+
     out_f = {
         ext: open("{}.{}.talp".format(output, ext), "w") for ext in matching_methods
     }
+    # Next sentence to write, the output is written in the original order. With length bucketing the sentences
+    # are aligned out of order, their alignments (and log lines) wait in pending_alignments until the alignments
+    # of every previous sentence are written.
+    next_sent_id = 0
+    pending_alignments = {}
+    new_alignments = []
+
+    def write_alignments(sent_id, alignment_lines, log_line=None):
+        """
+        Write the alignments of a sentence, after the alignments of the previous sentences.
+        """
+        pending_alignments[sent_id] = (alignment_lines, log_line)
+        flush_alignments()
+
+    def flush_alignments():
+        nonlocal next_sent_id
+        while True:
+            if next_sent_id in cached_alignments:
+                for ext in out_f:
+                    out_f[ext].write(cached_alignments[next_sent_id][ext] + "\n")
+            elif next_sent_id in pending_alignments:
+                alignment_lines, log_line = pending_alignments.pop(next_sent_id)
+                for ext in out_f:
+                    out_f[ext].write(alignment_lines[ext] + "\n")
+                    if sentence_cache is not None:
+                        new_alignments.append(
+                            (cache_keys[next_sent_id][ext], alignment_lines[ext])
+                        )
+                if log_line is not None:
+                    out_log.write(log_line)
+            else:
+                break
+            next_sent_id += 1
+
     if log:
         out_log = open("{}.log".format(output), "w")
     else:
         out_log = None
 
-    null_thresh = None
-    mask_nulls = None
+    def write_sentence_alignments(sent_id, all_mats, b2w_map, sent_pair):
+        alignment_lines = {}
+        for ext in matching_methods:
+            if token_type == "bpe":
+                # Alignments between subwords are collapsed to alignments between their words
+                aligned_pairs = word_alignments(all_mats[ext], b2w_map)
+            else:
+                aligned_pairs = zip(
+                    *(ids.tolist() for ids in np.nonzero(all_mats[ext]))
+                )
+            alignment_lines[ext] = " ".join(
+                sorted(f"{src_id}-{trg_id}" for src_id, trg_id in aligned_pairs)
+            )
+
+        log_line = None
+        if log:
+            log_aligns = []
+            if token_type == "bpe":
+                log_aligns = [
+                    f"{i}-{j}:({sent_pair[0][i]}, {sent_pair[1][j]})"
+                    for i, j in zip(*np.nonzero(all_mats["inter"]))
+                ]
+            log_line = str(sent_id) + "\t" + " ".join(sorted(log_aligns)) + "\n"
+        write_alignments(sent_id, alignment_lines, log_line)
 
+    # With null_align < 1.0, the alignments of each sentence are thresholded with a percentile of the null alignment
+    # entropies of the whole corpus. The corpus is embedded only once: the alignment matrices and the entropies of
+    # each sentence are stored in a temporary directory (with the subword to word maps and the subwords needed to
+    # write them) while the entropies are counted in a bounded-memory quantile sketch, the thresholded alignments
+    # are written after the last chunk.
+    null_align_methods = [
+        m for m in ["inter", "mwmf", "itermax"] if m in matching_methods
+    ]
+    null_align_dir = None
+    null_align_store = None
+    null_align_quantiles = None
     if null_align < 1.0:
-        entropies = {x: [] for x in matching_methods}
-        for sent_id in range(len(original_corpora[0])):
-            sent_pair = [original_corpora[i][sent_id] for i in [0, 1]]
-            vectors = embed_loader.get_embed_list(sent_pair).cpu().detach().numpy()
-            vectors = [
-                vectors[i][: len(sentences_bpe_lists[sent_id][i])] for i in [0, 1]
-            ]
+        null_align_dir = tempfile.TemporaryDirectory(
+            dir=os.path.dirname(os.path.abspath(output))
+        )
+        null_align_store = SentenceMatrixStore(
+            null_align_dir.name,
+            {"entropies": np.float64, **{m: np.bool_ for m in matching_methods}},
+        )
+        null_align_quantiles = {m: StreamingQuantile() for m in null_align_methods}
 
-            if convert_to_words:
-                vectors = SentenceAligner.average_embeds_over_words(
-                    np.asarray(vectors), words_tokens[sent_id]
-                )
+    def read_corpus(path):
+        with open_file(path) as file:
+            for line in itertools.islice(file, num_test_sents):
+                line = line.rstrip().strip()
+                yield regex.sub(
+                    "\\p{C}+", "", regex.sub("\\p{Separator}+", " ", line)
+                ).strip()
 
-            sim = SentenceAligner.get_similarity(vectors[0], vectors[1])
-            sim = SentenceAligner.apply_distortion(sim, distortion)
+    corpus_pairs = zip(read_corpus(source_file), read_corpus(target_file))
+    num_sentences: int = 0
+    while True:
+        chunk = list(itertools.islice(corpus_pairs, chunk_size))
+        if not chunk:
+            break
+        chunk_start = num_sentences
+        num_sentences += len(chunk)
+        original_corpora = [list(side) for side in zip(*chunk)]
+        del chunk
 
-            methods_matrix = {}
-            (
-                methods_matrix["forward"],
-                methods_matrix["backward"],
-            ) = SentenceAligner.get_alignment_matrix(sim)
-            methods_matrix["inter"] = (
-                methods_matrix["forward"] * methods_matrix["backward"]
+        cached_embeddings = {}
+        if embedding_cache is not None:
+            cached_embeddings = embedding_cache.lookup(
+                original_corpora[0] + original_corpora[1]
             )
-            if "mwmf" in matching_methods:
-                methods_matrix["mwmf"] = SentenceAligner.get_max_weight_match(sim)
-            if "itermax" in matching_methods:
-                methods_matrix["itermax"] = SentenceAligner.iter_max(sim)
-
-            for m in entropies:
-                entropies[m] += gather_null_aligns(sim, methods_matrix[m])
-        null_thresh = {
-            m: sorted(entropies[m])[int(null_align * len(entropies[m]))]
-            for m in entropies
-        }
-
-    ds = [
-        (idx, original_corpora[0][idx], original_corpora[1][idx])
-        for idx in range(len(original_corpora[0]))
-    ]
-    data_loader = torch.utils.data.DataLoader(ds, batch_size=batch_size, shuffle=False)
-    for batch_id, batch_sentences in enumerate(data_loader):
-        batch_vectors_src = embed_loader.get_embed_list(batch_sentences[1])
-        batch_vectors_trg = embed_loader.get_embed_list(batch_sentences[2])
-        btach_sim = None
-        if not convert_to_words:
-            batch_vectors_src = F.normalize(batch_vectors_src, dim=2)
-            batch_vectors_trg = F.normalize(batch_vectors_trg, dim=2)
-
-            btach_sim = torch.bmm(
-                batch_vectors_src, torch.transpose(batch_vectors_trg, 1, 2)
+            print(
+                f"Embedding cache {embedding_cache_dir}: {len(cached_embeddings)} sentences found in "
+                f"sentence pairs [{chunk_start}, {num_sentences})."
             )
-            btach_sim = ((btach_sim + 1.0) / 2.0).cpu().detach().numpy()
 
-        batch_vectors_src = batch_vectors_src.cpu().detach().numpy()
-        batch_vectors_trg = batch_vectors_trg.cpu().detach().numpy()
+        words_tokens = [[None, None] for _ in range(len(original_corpora[0]))]
+        sentences_input_ids = [[None] * len(corpus) for corpus in original_corpora]
+        for side, corpus in enumerate(original_corpora):
+            new_sent_ids = []
+            for sent_id, sentence in enumerate(corpus):
+                if sentence in cached_embeddings:
+                    words_tokens[sent_id][side] = cached_embeddings[sentence][3]
+                else:
+                    new_sent_ids.append(sent_id)
+            for i in range(0, len(new_sent_ids), TOKENIZATION_BATCH_SIZE):
+                batch_sent_ids = new_sent_ids[i : i + TOKENIZATION_BATCH_SIZE]
+                batch_tokens, batch_input_ids = tokenize(
+                    [corpus[sent_id] for sent_id in batch_sent_ids]
+                )
+                for sent_id, tokens, input_ids in zip(
+                    batch_sent_ids, batch_tokens, batch_input_ids
+                ):
+                    words_tokens[sent_id][side] = tokens
+                    sentences_input_ids[side][sent_id] = input_ids
 
-        for in_batch_id, sent_id in enumerate(batch_sentences[0].numpy()):
-            sent_pair = sentences_bpe_lists[sent_id]
-            vectors = [
-                batch_vectors_src[in_batch_id, : len(sent_pair[0])],
-                batch_vectors_trg[in_batch_id, : len(sent_pair[1])],
+        sentences_bpe_lists = []
+        sentences_b2w_map = []
+        for sent_id in range(len(words_tokens)):
+            sent_pair = [
+                [bpe for w in sent for bpe in w] for sent in words_tokens[sent_id]
+            ]
+            # Word of each subword, as arrays to map the aligned subwords with a single lookup
+            b2w_map_pair = [
+                np.array([i for i, w in enumerate(sent) for _ in w], dtype=np.int64)
+                for sent in words_tokens[sent_id]
             ]
+            sentences_bpe_lists.append(sent_pair)
+            sentences_b2w_map.append(b2w_map_pair)
+
+        cached_alignments = {}
+        cache_keys = {}
+        if sentence_cache is not None:
+            cache_keys = {
+                chunk_start
+                + sent_id: {
+                    ext: sentence_cache.key(
+                        original_corpora[0][sent_id], original_corpora[1][sent_id], ext
+                    )
+                    for ext in matching_methods
+                }
+                for sent_id in range(len(original_corpora[0]))
+            }
+            hits = sentence_cache.get_many(
+                [
+                    key
+                    for sentence_keys in cache_keys.values()
+                    for key in sentence_keys.values()
+                ]
+            )
+            for sent_id, sentence_keys in cache_keys.items():
+                if all(key in hits for key in sentence_keys.values()):
+                    cached_alignments[sent_id] = {
+                        ext: hits[key] for ext, key in sentence_keys.items()
+                    }
+            print(
+                f"Sentence alignment cache {sentence_cache_path}: {len(cached_alignments)} hits, "
+                f"{len(original_corpora[0]) - len(cached_alignments)} misses in sentence pairs "
+                f"[{chunk_start}, {num_sentences})."
+            )
 
+        ds = [
+            (idx, original_corpora[0][idx], original_corpora[1][idx])
+            for idx in range(len(original_corpora[0]))
+            if chunk_start + idx not in cached_alignments
+        ]
+        if bucket_by_length or max_tokens:
+            data_loader = torch.utils.data.DataLoader(
+                ds,
+                batch_sampler=LengthBucketSampler(
+                    lengths=[
+                        tuple(len(sent) for sent in sentences_bpe_lists[idx])
+                        for idx, _, _ in ds
+                    ],
+                    batch_size=batch_size,
+                    max_tokens=max_tokens,
+                ),
+            )
+        else:
+            data_loader = torch.utils.data.DataLoader(
+                ds, batch_size=batch_size, shuffle=False
+            )
+        for batch_id, batch_sentences in enumerate(data_loader):
+            batch_vectors_src = get_embed_list(batch_sentences[0].tolist(), side=0)
+            batch_vectors_trg = get_embed_list(batch_sentences[0].tolist(), side=1)
+            btach_sim = None
             if not convert_to_words:
-                sim = btach_sim[in_batch_id, : len(sent_pair[0]), : len(sent_pair[1])]
-            else:
-                vectors = SentenceAligner.average_embeds_over_words(
-                    np.asarray(vectors), words_tokens[sent_id]
+                btach_sim = batch_similarity_matrices(
+                    batch_vectors_src, batch_vectors_trg
                 )
-                sim = SentenceAligner.get_similarity(vectors[0], vectors[1])
 
-            if len(vectors[0]) == 0 or len(vectors[1]) == 0:
-                print(f"WARNING EMPY SENTENCE. sent_id: {sent_id}")
-                for ext in out_f:
-                    if convert_to_words:
-                        out_f[ext].write("\n")
-                    else:
-                        out_f[ext].write("\n")
-                continue
+            batch_vectors_src = batch_vectors_src.cpu().detach().numpy()
+            batch_vectors_trg = batch_vectors_trg.cpu().detach().numpy()
 
-            all_mats = {}
+            batch_sent_ids = batch_sentences[0].numpy()
+            batch_sims = []
+            for in_batch_id, sent_id in enumerate(batch_sent_ids):
+                sent_pair = sentences_bpe_lists[sent_id]
+                vectors = [
+                    batch_vectors_src[in_batch_id, : len(sent_pair[0])],
+                    batch_vectors_trg[in_batch_id, : len(sent_pair[1])],
+                ]
 
-            sim = SentenceAligner.apply_distortion(sim, distortion)
-            if null_align < 1.0:
-                mask_nulls = {
-                    mmethod: apply_percentile_null_aligns(sim, null_thresh[mmethod])
-                    for mmethod in matching_methods
-                }
+                if not convert_to_words:
+                    sim = btach_sim[
+                        in_batch_id, : len(sent_pair[0]), : len(sent_pair[1])
+                    ]
+                else:
+                    vectors = SentenceAligner.average_embeds_over_words(
+                        np.asarray(vectors), words_tokens[sent_id]
+                    )
+                    sim = SentenceAligner.get_similarity(vectors[0], vectors[1])
+
+                if len(vectors[0]) and len(vectors[1]):
+                    sim = SentenceAligner.apply_distortion(sim, distortion)
+                batch_sims.append(sim)
 
-            all_mats["fwd"], all_mats["rev"] = SentenceAligner.get_alignment_matrix(sim)
+            batch_forward, batch_backward = batch_alignment_matrices(batch_sims)
 
-            all_mats["inter"] = all_mats["fwd"] * all_mats["rev"]
-            if "mwmf" in matching_methods:
-                all_mats["mwmf"] = SentenceAligner.get_max_weight_match(sim)
-            if "itermax" in matching_methods:
-                all_mats["itermax"] = SentenceAligner.iter_max(sim)
+            for in_batch_id, (sent_id, sim) in enumerate(
+                zip(batch_sent_ids, batch_sims)
+            ):
+                if sim.shape[0] == 0 or sim.shape[1] == 0:
+                    print(f"WARNING EMPY SENTENCE. sent_id: {chunk_start + sent_id}")
+                    if null_align < 1.0:
+                        null_align_store.append(
+                            chunk_start + sent_id,
+                            (0, 0),
+                            {name: np.zeros(0) for name in null_align_store.dtypes},
+                        )
+                    else:
+                        write_alignments(
+                            chunk_start + sent_id, {ext: "" for ext in out_f}
+                        )
+                    continue
+
+                all_mats = alignment_matrices(
+                    sim,
+                    batch_forward[in_batch_id, : sim.shape[0], : sim.shape[1]],
+                    batch_backward[in_batch_id, : sim.shape[0], : sim.shape[1]],
+                    matching_methods,
+                )
 
-            if null_align < 1.0:
-                if "inter" in matching_methods:
-                    all_mats["inter"] = np.multiply(
-                        all_mats["inter"], mask_nulls["inter"]
+                if null_align < 1.0:
+                    entropies = null_align_entropies(sim)
+                    for m in null_align_methods:
+                        null_align_quantiles[m].add(
+                            gather_null_aligns(entropies, all_mats[m])
+                        )
+                    null_align_store.append(
+                        chunk_start + sent_id,
+                        sim.shape,
+                        {
+                            "entropies": entropies,
+                            **{m: all_mats[m] > 0 for m in matching_methods},
+                        },
+                        metadata={
+                            "b2w_map": [
+                                b2w_map.tolist()
+                                for b2w_map in sentences_b2w_map[sent_id]
+                            ],
+                            "sent_pair": sentences_bpe_lists[sent_id] if log else None,
+                        },
                     )
-                if "mwmf" in matching_methods:
-                    all_mats["mwmf"] = np.multiply(all_mats["mwmf"], mask_nulls["mwmf"])
-                if "itermax" in matching_methods:
-                    all_mats["itermax"] = np.multiply(
-                        all_mats["itermax"], mask_nulls["itermax"]
+                else:
+                    write_sentence_alignments(
+                        chunk_start + sent_id,
+                        all_mats,
+                        sentences_b2w_map[sent_id],
+                        sentences_bpe_lists[sent_id],
                     )
 
-            raw_aligns = {x: [] for x in matching_methods}
-            b2w_aligns = {x: set() for x in matching_methods}
-            log_aligns = []
+            if sentence_cache is not None:
+                sentence_cache.put_many(new_alignments)
+                new_alignments = []
 
-            for i in range(len(vectors[0])):
-                for j in range(len(vectors[1])):
-                    for ext in matching_methods:
-                        if all_mats[ext][i, j] > 0:
-                            raw_aligns[ext].append("{}-{}".format(i, j))
-                            if token_type == "bpe":
-                                b2w_aligns[ext].add(
-                                    "{}-{}".format(
-                                        sentences_b2w_map[sent_id][0][i],
-                                        sentences_b2w_map[sent_id][1][j],
-                                    )
-                                )
-                                if ext == "inter":
-                                    log_aligns.append(
-                                        "{}-{}:({}, {})".format(
-                                            i, j, sent_pair[0][i], sent_pair[1][j]
-                                        )
-                                    )
-                            else:
-                                b2w_aligns[ext].add("{}-{}".format(i, j))
-
-            for ext in out_f:
-                if convert_to_words:
-                    out_f[ext].write(" ".join(sorted(raw_aligns[ext])) + "\n")
-                else:
-                    out_f[ext].write(" ".join(sorted(b2w_aligns[ext])) + "\n")
-            if log:
-                out_log.write(str(sent_id) + "\t" + " ".join(sorted(log_aligns)) + "\n")
+        # The cached alignments at the end of the chunk
+        flush_alignments()
+
+    if null_align < 1.0:
+        null_align_store.finish()
+        null_thresh = {}
+        for m in null_align_methods:
+            if len(null_align_quantiles[m]):
+                null_thresh[m] = null_align_quantiles[m].quantile(
+                    null_align,
+                    lambda m=m: (
+                        gather_null_aligns(matrices["entropies"], matrices[m])
+                        for _, matrices, _ in null_align_store
+                    ),
+                )
+            else:
+                # No sentence can be thresholded
+                null_thresh[m] = np.inf
+
+        for sent_id, matrices, metadata in null_align_store:
+            if matrices["entropies"].size == 0:
+                write_alignments(sent_id, {ext: "" for ext in out_f})
+                continue
+            all_mats = {m: matrices[m] for m in matching_methods}
+            for m in null_align_methods:
+                all_mats[m] = np.multiply(
+                    all_mats[m],
+                    apply_percentile_null_aligns(matrices["entropies"], null_thresh[m]),
+                )
+            write_sentence_alignments(
+                sent_id,
+                all_mats,
+                [np.array(b2w_map, dtype=np.int64) for b2w_map in metadata["b2w_map"]],
+                metadata["sent_pair"],
+            )
+        null_align_dir.cleanup()
+
+    flush_alignments()
+    assert (
+        next_sent_id == num_sentences
+    ), f"Alignments of sentence {next_sent_id} not written"
+    if sentence_cache is not None:
+        sentence_cache.close()
+    if embedding_cache is not None:
+        embedding_cache.close()
 
     if log:
         out_log.close()
     for ext in out_f:
         out_f[ext].close()
+        if binary_alignments:
+            talp2binary("{}.{}.talp".format(output, ext))
 
 
 if __name__ == "__main__":
@@ -344,6 +1018,58 @@ if __name__ == "__main__":
     )
     parser.add_argument("--batch-size", type=int, default=100)
     parser.add_argument("-log", action="store_true")
+    parser.add_argument(
+        "--binary-alignments",
+        action="store_true",
+        help="Also store the alignments in the binary format (.talpb)",
+    )
+    parser.add_argument(
+        "--sentence-cache-path",
+        type=str,
+        default=None,
+        help="Path to the sentence alignment cache (SQLite database). Sentence pairs found in the cache are not "
+        "aligned again, the new alignments are added to the cache",
+    )
+    parser.add_argument(
+        "--layer",
+        type=int,
+        default=8,
+        help="Layer of the model used as embeddings",
+    )
+    parser.add_argument(
+        "--embedding-cache-dir",
+        type=str,
+        default=None,
+        help="Path to the embedding cache directory. The embeddings of the sentences found in the cache are not "
+        "computed again (i.e. when only distortion, null-align or matching-methods change), the new ones are "
+        "added to the cache",
+    )
+    parser.add_argument(
+        "--embedding-cache-size",
+        type=float,
+        default=DEFAULT_EMBEDDING_CACHE_SIZE_GB,
+        help="Maximum size of the embedding cache in GB. The least recently used embeddings are removed",
+    )
+    parser.add_argument(
+        "--bucket-by-length",
+        action="store_true",
+        help="Group the sentence pairs with a similar number of subwords in the same batch, so long sentences do not "
+        "pad whole batches. The output order does not change",
+    )
+    parser.add_argument(
+        "--max-tokens",
+        type=int,
+        default=None,
+        help="Maximum number of padded subwords per batch (sentences * (longest source + longest target)). "
+        "Implies --bucket-by-length",
+    )
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=DEFAULT_CHUNK_SIZE,
+        help="Number of sentence pairs read, tokenized and aligned together. The memory used depends on it and not "
+        "on the size of the corpus",
+    )
     parser.add_argument(
         "-output",
         type=str,
@@ -364,4 +1090,12 @@ if __name__ == "__main__":
         batch_size=args.batch_size,
         num_test_sents=args.num_test_sents,
         log=args.log,
+        binary_alignments=args.binary_alignments,
+        sentence_cache_path=args.sentence_cache_path,
+        layer=args.layer,
+        embedding_cache_dir=args.embedding_cache_dir,
+        embedding_cache_size=args.embedding_cache_size,
+        bucket_by_length=args.bucket_by_length,
+        max_tokens=args.max_tokens,
+        chunk_size=args.chunk_size,
     )
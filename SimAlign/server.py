@@ -0,0 +1,545 @@
+import argparse
+import json
+import os
+import queue
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from socketserver import ThreadingMixIn, UnixStreamServer
+from typing import Callable, Dict, List, Optional, Tuple, Union
+
+import numpy as np
+
+from projection.api import project_tags
+from projection.instrumentation import LatencyHistogram
+
+# Local projection service. It keeps a SimAlign model loaded, aligns the (source, target) sentence pairs of the
+# requests and projects the source tags. Concurrent requests are grouped in micro-batches, so the model computes
+# the embeddings of several sentences at once.
+#
+#   POST /project  {"source_tokens": ["The", "Eiffel", "Tower"], "source_tags": ["O", "B-LOC", "I-LOC"],
+#                   "target": "La Torre Eiffel"}
+#   => {"target_tokens": ["La", "Torre", "Eiffel"], "target_tags": ["O", "B-LOC", "I-LOC"],
+#       "alignment": "0-0 1-2 2-1"}
+#   GET /stats     Number of requests, batch sizes and latency histograms.
+#   GET /health
+
+
+class SimAlignWordAligner:
+    """
+    Word aligner that keeps a SimAlign EmbeddingLoader warm and aligns batches of tokenized sentence pairs. Uses the
+    same parameters and code as the alignments generated by SimAlign/generate_alignments.py (bpe tokens, no null
+    alignment).
+    """
+
+    def __init__(
+        self,
+        model: str = "bert-base-multilingual-cased",
+        matching_method: str = "itermax",
+        distortion: float = 0.0,
+        layer: int = 8,
+    ):
+        import regex
+        import torch
+        from simalign.simalign import EmbeddingLoader, SentenceAligner
+
+        from SimAlign.generate_alignments import SubwordTokenizer
+
+        if model == "bert":
+            model = "bert-base-multilingual-cased"
+        elif model == "xlmr":
+            model = "xlm-roberta-base"
+
+        if matching_method not in ["inter", "mwmf", "itermax"]:
+            raise ValueError(
+                f"Matching method {matching_method} not supported. Supported methods: [inter, mwmf, itermax]"
+            )
+
+        self.regex = regex
+        self.SentenceAligner = SentenceAligner
+        self.matching_method = matching_method
+        self.distortion = distortion
+        self.layer = layer
+        self.device = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
+        self.embed_loader = EmbeddingLoader(
+            model=model, device=self.device, layer=layer
+        )
+        self.tokenizer = SubwordTokenizer(self.embed_loader.tokenizer)
+
+    def clean_word(self, word: str) -> str:
+        # Same normalization as SimAlign/generate_alignments.py. Separators are removed instead of replaced by a
+        # space, so a word is never split in two and the word ids of the tags do not change.
+        return self.regex.sub("\\p{C}+|\\p{Separator}+", "", word)
+
+    def align(
+        self, sentence_pairs: List[Tuple[List[str], List[str]]]
+    ) -> List[List[Tuple[int, int]]]:
+        """
+        Align a batch of (source words, target words) pairs.
+        :return: The (source word, target word) pairs of each sentence pair.
+        """
+        from SimAlign.generate_alignments import (
+            alignment_matrices,
+            batch_alignment_matrices,
+            batch_similarity_matrices,
+            embed_input_ids,
+            word_alignments,
+        )
+
+        # Subwords of each word of each sentence pair, the words removed by clean_word have no subwords
+        words_tokens: List[List[List[List[str]]]] = [[] for _ in sentence_pairs]
+        vectors = []
+        for side in range(2):
+            sentences_words = [
+                [self.clean_word(word) for word in sentence_pair[side]]
+                for sentence_pair in sentence_pairs
+            ]
+            sentences_tokens, input_ids = self.tokenizer(
+                [" ".join(word for word in words if word) for words in sentences_words]
+            )
+            for pair_tokens, words, sentence_tokens in zip(
+                words_tokens, sentences_words, sentences_tokens
+            ):
+                sentence_tokens = iter(sentence_tokens)
+                pair_tokens.append(
+                    [next(sentence_tokens) if word else [] for word in words]
+                )
+            vectors.append(
+                embed_input_ids(self.embed_loader, input_ids, self.layer, self.device)
+            )
+        batch_sim = batch_similarity_matrices(vectors[0], vectors[1])
+
+        sims = []
+        b2w_maps = []
+        for sent_no, pair_tokens in enumerate(words_tokens):
+            b2w_map = [
+                np.array([i for i, w in enumerate(words) for _ in w], dtype=np.int64)
+                for words in pair_tokens
+            ]
+            sim = batch_sim[sent_no, : len(b2w_map[0]), : len(b2w_map[1])]
+            if sim.size:
+                sim = self.SentenceAligner.apply_distortion(sim, self.distortion)
+            sims.append(sim)
+            b2w_maps.append(b2w_map)
+        batch_forward, batch_backward = batch_alignment_matrices(sims)
+
+        alignments: List[List[Tuple[int, int]]] = []
+        for sent_no, (sim, b2w_map) in enumerate(zip(sims, b2w_maps)):
+            if sim.size == 0:
+                alignments.append([])
+                continue
+            all_mats = alignment_matrices(
+                sim,
+                batch_forward[sent_no, : sim.shape[0], : sim.shape[1]],
+                batch_backward[sent_no, : sim.shape[0], : sim.shape[1]],
+                [self.matching_method],
+            )
+            alignments.append(
+                sorted(word_alignments(all_mats[self.matching_method], b2w_map))
+            )
+        return alignments
+
+
+class MicroBatcher:
+    """
+    Groups the items submitted by concurrent threads in batches and processes them in a single worker thread.
+    A batch is processed when it has max_batch_size items or max_wait_ms after its first item arrived.
+    process_batch returns the result of each item, an Exception as the result of an item fails only that item.
+    """
+
+    def __init__(
+        self,
+        process_batch: Callable[[List], List],
+        max_batch_size: int = 32,
+        max_wait_ms: float = 5.0,
+    ):
+        self.process_batch = process_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait: float = max_wait_ms / 1000
+        self.queue: queue.Queue = queue.Queue()
+        self.queue_latency = LatencyHistogram()
+        self.batch_latency = LatencyHistogram()
+        self.batch_sizes: Counter = Counter()
+        self.worker = threading.Thread(target=self.run, daemon=True)
+        self.worker.start()
+
+    def submit(self, item) -> Future:
+        future: Future = Future()
+        self.queue.put((item, future, time.perf_counter()))
+        return future
+
+    def next_batch(self) -> List:
+        batch = [self.queue.get()]
+        deadline: float = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout: float = deadline - time.perf_counter()
+            try:
+                batch.append(
+                    self.queue.get(timeout=timeout)
+                    if timeout > 0
+                    else self.queue.get_nowait()
+                )
+            except queue.Empty:
+                break
+        return batch
+
+    def run(self) -> None:
+        while True:
+            batch = self.next_batch()
+            start_time: float = time.perf_counter()
+            for _, _, submit_time in batch:
+                self.queue_latency.add(start_time - submit_time)
+            try:
+                results = self.process_batch([item for item, _, _ in batch])
+                for (_, future, _), result in zip(batch, results):
+                    if isinstance(result, Exception):
+                        future.set_exception(result)
+                    else:
+                        future.set_result(result)
+            except Exception as e:
+                for _, future, _ in batch:
+                    future.set_exception(e)
+            self.batch_latency.add(time.perf_counter() - start_time)
+            self.batch_sizes[len(batch)] += 1
+
+
+class ProjectionService:
+    """
+    Aligns and projects the requests in micro-batches.
+    """
+
+    def __init__(
+        self,
+        aligner,
+        max_batch_size: int = 32,
+        max_wait_ms: float = 5.0,
+        remove_puncs: bool = True,
+        fill_gap_size: int = 1,
+    ):
+        """
+        :param aligner: Object with an align method that takes a list of (source words, target words) pairs and
+        returns the (source word, target word) alignment pairs of each one (i.e. SimAlignWordAligner).
+        :param int max_batch_size: Maximum number of requests in a batch.
+        :param float max_wait_ms: Maximum time that the first request of a batch waits for other requests.
+        :param bool remove_puncs: If a source word is aligned to a punctuation mark, we remove the alignment.
+        :param int fill_gap_size: Gaps smaller or equal than fill_gap_size in the projected labels are filled.
+        """
+        self.aligner = aligner
+        self.remove_puncs = remove_puncs
+        self.fill_gap_size = fill_gap_size
+        self.start_time: float = time.time()
+        self.request_latency = LatencyHistogram()
+        self.errors: int = 0
+        self.batcher = MicroBatcher(
+            self.project_batch, max_batch_size=max_batch_size, max_wait_ms=max_wait_ms
+        )
+
+    def project_tags(
+        self, requests: List[Dict], alignments: List[List[Tuple[int, int]]]
+    ) -> List[List[str]]:
+        return project_tags(
+            source_sentences=[
+                (request["source_tokens"], request["source_tags"])
+                for request in requests
+            ],
+            target_sentences=[request["target_tokens"] for request in requests],
+            alignments=alignments,
+            remove_puncs=self.remove_puncs,
+            fill_gap_size=self.fill_gap_size,
+        )
+
+    def project_batch(self, requests: List[Dict]) -> List[Union[Dict, Exception]]:
+        """
+        Align and project a batch of requests. Returns the response of each request, or the exception raised while
+        projecting it: a request that cannot be projected does not fail the other requests of the batch.
+        """
+        alignments = self.aligner.align(
+            [
+                (request["source_tokens"], request["target_tokens"])
+                for request in requests
+            ]
+        )
+        try:
+            target_tags: List[Union[List[str], Exception]] = self.project_tags(
+                requests, alignments
+            )
+        except Exception:
+            # Project each request on its own to find the ones that fail
+            target_tags = []
+            for request, alignment in zip(requests, alignments):
+                try:
+                    target_tags.extend(self.project_tags([request], [alignment]))
+                except Exception as e:
+                    target_tags.append(e)
+
+        return [
+            (
+                tags
+                if isinstance(tags, Exception)
+                else {
+                    "target_tokens": request["target_tokens"],
+                    "target_tags": tags,
+                    "alignment": " ".join(f"{i}-{j}" for i, j in alignment),
+                }
+            )
+            for request, tags, alignment in zip(requests, target_tags, alignments)
+        ]
+
+    def project(self, request: Dict, timeout: Optional[float] = None) -> Dict:
+        start_time: float = time.perf_counter()
+        try:
+            return self.batcher.submit(request).result(timeout=timeout)
+        except Exception:
+            self.errors += 1
+            raise
+        finally:
+            self.request_latency.add(time.perf_counter() - start_time)
+
+    def stats(self) -> Dict:
+        return {
+            "uptime_seconds": time.time() - self.start_time,
+            "requests": self.request_latency.count,
+            "errors": self.errors,
+            "batches": sum(self.batcher.batch_sizes.values()),
+            "batch_sizes": dict(sorted(self.batcher.batch_sizes.items())),
+            "request_latency": self.request_latency.to_dict(),
+            "queue_latency": self.batcher.queue_latency.to_dict(),
+            "batch_latency": self.batcher.batch_latency.to_dict(),
+        }
+
+
+def is_valid_tag(tag: str) -> bool:
+    """
+    Whether the tag is O or a B, I or U prefix followed by one -type (i.e. B-LOC), the tags of the projection.
+    """
+    if tag == "O":
+        return True
+    prefix, _, tag_type = tag.partition("-")
+    return prefix in ["B", "I", "U"] and bool(tag_type) and "-" not in tag_type
+
+
+def parse_request(body: bytes) -> Dict:
+    """
+    Parse and validate the json body of a projection request. Raises ValueError if the request is not valid.
+    """
+    request = json.loads(body)
+    if not isinstance(request, dict):
+        raise ValueError("The request should be a json object.")
+    source_tokens = request.get("source_tokens")
+    source_tags = request.get("source_tags")
+    if "target_tokens" in request:
+        target_tokens = request["target_tokens"]
+    elif isinstance(request.get("target"), str):
+        target_tokens = request["target"].split()
+    else:
+        raise ValueError("The request should have a target (str) or target_tokens.")
+
+    for name, value in [
+        ("source_tokens", source_tokens),
+        ("source_tags", source_tags),
+        ("target_tokens", target_tokens),
+    ]:
+        if not isinstance(value, list) or not all(isinstance(v, str) for v in value):
+            raise ValueError(f"{name} should be a list of strings.")
+    if len(source_tokens) != len(source_tags):
+        raise ValueError(
+            f"Each source token should have a tag. "
+            f"source_tokens: {len(source_tokens)}. source_tags: {len(source_tags)}."
+        )
+    invalid_tags = [tag for tag in source_tags if not is_valid_tag(tag)]
+    if invalid_tags:
+        raise ValueError(
+            f"Invalid source tags: {invalid_tags}. The tags should be O or B-type, I-type, U-type."
+        )
+    return {
+        "source_tokens": source_tokens,
+        "source_tags": source_tags,
+        "target_tokens": target_tokens,
+    }
+
+
+class ProjectionRequestHandler(BaseHTTPRequestHandler):
+    service: ProjectionService
+    timeout_seconds: Optional[float] = None
+
+    def send_json(self, status: int, data: Dict) -> None:
+        body = json.dumps(data, ensure_ascii=False).encode("utf8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/stats":
+            self.send_json(200, self.service.stats())
+        elif self.path == "/health":
+            self.send_json(200, {"status": "ok"})
+        else:
+            self.send_json(404, {"error": f"Unknown path {self.path}"})
+
+    def do_POST(self):
+        if self.path != "/project":
+            self.send_json(404, {"error": f"Unknown path {self.path}"})
+            return
+        try:
+            request = parse_request(
+                self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            )
+        except ValueError as e:
+            # json.JSONDecodeError is a ValueError
+            self.send_json(400, {"error": str(e)})
+            return
+        try:
+            self.send_json(
+                200, self.service.project(request, timeout=self.timeout_seconds)
+            )
+        except Exception as e:
+            self.send_json(500, {"error": f"{type(e).__name__}: {e}"})
+
+    def address_string(self) -> str:
+        # Unix socket clients have no address
+        return str(self.client_address[0]) if self.client_address else "unix"
+
+    def log_message(self, format, *args):
+        # Do not log every request, the stats endpoint has the request counts and latencies
+        pass
+
+
+class ProjectionHTTPServer(ThreadingHTTPServer):
+    # Many clients connect at the same time to fill the batches, the default backlog (5) resets their connections
+    request_queue_size = 1024
+
+
+class ProjectionUnixHTTPServer(ThreadingMixIn, UnixStreamServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+
+def serve(
+    service: ProjectionService,
+    host: str = "127.0.0.1",
+    port: int = 8080,
+    unix_socket: Optional[str] = None,
+    timeout_seconds: Optional[float] = None,
+):
+    """
+    Serve the projection service over HTTP, on host:port or on a Unix socket, until the process is interrupted.
+    """
+    handler = type(
+        "Handler",
+        (ProjectionRequestHandler,),
+        {"service": service, "timeout_seconds": timeout_seconds},
+    )
+    if unix_socket:
+        if os.path.exists(unix_socket):
+            os.remove(unix_socket)
+        server = ProjectionUnixHTTPServer(unix_socket, handler)
+        print(f"Projection service listening on unix socket {unix_socket}")
+    else:
+        server = ProjectionHTTPServer((host, port), handler)
+        print(f"Projection service listening on http://{host}:{server.server_port}")
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if unix_socket and os.path.exists(unix_socket):
+            os.remove(unix_socket)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Local HTTP service that aligns sentence pairs with SimAlign and projects the source tags"
+    )
+    parser.add_argument(
+        "--model_name_or_path",
+        type=str,
+        default="bert-base-multilingual-cased",
+        help="Hugginface Hub model name or path to a local model",
+    )
+    parser.add_argument(
+        "--offline",
+        action="store_true",
+        help="Do not connect to the Huggingface Hub, the model must be a local path or be in the local cache",
+    )
+    parser.add_argument(
+        "--matching_method",
+        type=str,
+        default="itermax",
+        choices=["inter", "mwmf", "itermax"],
+        help="SimAlign matching method",
+    )
+    parser.add_argument(
+        "--layer",
+        type=int,
+        default=8,
+        help="Layer of the model used to compute the embeddings",
+    )
+    parser.add_argument("--host", type=str, default="127.0.0.1", help="Host")
+    parser.add_argument("--port", type=int, default=8080, help="Port")
+    parser.add_argument(
+        "--unix_socket",
+        type=str,
+        default=None,
+        help="Listen on this Unix socket instead of host:port",
+    )
+    parser.add_argument(
+        "--max_batch_size",
+        type=int,
+        default=32,
+        help="Maximum number of requests aligned in the same batch",
+    )
+    parser.add_argument(
+        "--max_wait_ms",
+        type=float,
+        default=5.0,
+        help="Maximum time (milliseconds) that a request waits for other requests to fill a batch",
+    )
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        default=None,
+        help="Maximum time (seconds) to answer a request",
+    )
+    parser.add_argument(
+        "--do_not_remove_puncs",
+        action="store_false",
+        help="Do not remove the alignments of punctuation marks",
+    )
+    parser.add_argument(
+        "--fill_gap_size",
+        type=int,
+        default=1,
+        help="Fill the gaps in the projected labels that are smaller or equal than this value",
+    )
+
+    args = parser.parse_args()
+
+    if args.offline:
+        # Must be set before transformers is imported
+        os.environ["HF_HUB_OFFLINE"] = "1"
+        os.environ["TRANSFORMERS_OFFLINE"] = "1"
+
+    projection_service = ProjectionService(
+        aligner=SimAlignWordAligner(
+            model=args.model_name_or_path,
+            matching_method=args.matching_method,
+            layer=args.layer,
+        ),
+        max_batch_size=args.max_batch_size,
+        max_wait_ms=args.max_wait_ms,
+        remove_puncs=args.do_not_remove_puncs,
+        fill_gap_size=args.fill_gap_size,
+    )
+    serve(
+        projection_service,
+        host=args.host,
+        port=args.port,
+        unix_socket=args.unix_socket,
+        timeout_seconds=args.timeout,
+    )
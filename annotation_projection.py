@@ -4,7 +4,32 @@ import os
 from typing import Optional, List
 from tokenization.conll2text import conll2text
 from tokenization.utils import count_lines
-from projection.annotation_proyection import dataset_projection
+from projection.sentence_index import SentenceIndex
+from projection.annotation_proyection import (
+    dataset_projection,
+    multi_dataset_projection,
+    ProjectionPool,
+)
+from projection.alignment_store import binary_alignments_path, talp2binary
+from projection.alignment_cache import (
+    AlignmentCache,
+    alignment_cache_keys,
+    DEFAULT_CACHE_DIR,
+    DEFAULT_CACHE_SIZE_GB,
+)
+from projection.sentence_alignment_cache import DEFAULT_SENTENCE_CACHE_PATH
+from projection.embedding_cache import DEFAULT_EMBEDDING_CACHE_SIZE_GB
+from projection.columnar import OUTPUT_FORMATS, output_extension
+from projection.compression import (
+    COMPRESSIONS,
+    add_compression_extension,
+    split_compression_extension,
+)
+from projection.instrumentation import (
+    disable_run_report,
+    enable_run_report,
+    get_run_report,
+)
 import argparse
 
 
@@ -25,6 +50,12 @@ def generate_alignments(
     do_awesome: bool = False,
     remove_awesome_model: bool = True,
     model_name_or_path: str = "bert-base-multilingual-cased",
+    binary_alignments: bool = False,
+    alignment_cache_dir: Optional[str] = None,
+    alignment_cache_size: float = DEFAULT_CACHE_SIZE_GB,
+    sentence_alignment_cache: Optional[str] = None,
+    embedding_cache_dir: Optional[str] = None,
+    embedding_cache_size: float = DEFAULT_EMBEDDING_CACHE_SIZE_GB,
 ):
     """
     Generate word alignments for the given datasets.
@@ -44,6 +75,20 @@ def generate_alignments(
     :param bool do_awesome: Whether to generate word alignments with awesome.
     :param bool remove_awesome_model: Whether to remove the trained awesome model after the alignment generation.
     :param str model_name_or_path: Hugginface Hub model name or path to a local model. Used for simalign and awesome.
+    :param bool binary_alignments: Whether to also store the alignments in the binary format (.talpb).
+    :param str alignment_cache_dir: Path to the alignment cache. If the alignments of an alignment method for the
+    same sentences, augmentation corpus, model and parameters are in the cache, they are copied to the output
+    directory instead of generating them again. New alignments are added to the cache. If None, no cache is used.
+    :param float alignment_cache_size: Maximum size of the alignment cache in GB. The least recently used alignments
+    are removed.
+    :param str sentence_alignment_cache: Path to the sentence alignment cache (SQLite database) used by simalign.
+    Sentence pairs that were already aligned (in any dataset) are taken from the cache, only the new sentence pairs
+    are aligned. If None, no cache is used.
+    :param str embedding_cache_dir: Path to the embedding cache used by simalign. The embeddings of the sentences
+    that are in the cache are not computed again, if every sentence is in the cache the model is not loaded. If
+    None, no cache is used.
+    :param float embedding_cache_size: Maximum size of the embedding cache in GB. The least recently used embeddings
+    are removed.
     """
 
     # 1) Sanity checks
@@ -71,22 +116,64 @@ def generate_alignments(
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
 
+    report = get_run_report()
+
+    alignment_cache: Optional[AlignmentCache] = (
+        AlignmentCache(alignment_cache_dir, alignment_cache_size)
+        if alignment_cache_dir
+        else None
+    )
+
     # Projection
 
     source_paths: List[str] = []
     target_paths: List[str] = []
+    dataset_splits: List[str] = []
 
     if source_train:
         source_paths.append(source_train)
         target_paths.append(target_train)
+        dataset_splits.append("train")
     if source_dev:
         source_paths.append(source_dev)
         target_paths.append(target_dev)
+        dataset_splits.append("dev")
     if source_test:
         source_paths.append(source_test)
         target_paths.append(target_test)
+        dataset_splits.append("test")
+
+    # Arguments of get_alignment_cache_keys, restore_alignments and store_alignments that are the same for every
+    # alignment method
+    cache_key_args = dict(
+        alignment_cache=alignment_cache,
+        source_augmentation=source_augmentation,
+        target_augmentation=target_augmentation,
+        model_name_or_path=model_name_or_path,
+    )
+    cache_args = dict(
+        alignment_cache=alignment_cache,
+        output_dir=output_dir,
+        output_name=output_name,
+    )
 
-    if do_mgiza:
+    mgiza_cache_keys = (
+        get_alignment_cache_keys(
+            alignment_method="mgiza",
+            source_paths=source_paths,
+            target_paths=target_paths,
+            **cache_key_args,
+        )
+        if do_mgiza
+        else None
+    )
+    if do_mgiza and not restore_alignments(
+        cache_keys=mgiza_cache_keys,
+        alignment_method="mgiza",
+        dataset_splits=dataset_splits,
+        binary_alignments=binary_alignments,
+        **cache_args,
+    ):
         from mgiza.generate_alignments import generate_word_alignments_mgiza
 
         output_names = []
@@ -107,20 +194,48 @@ def generate_alignments(
             f"Output_dir: {output_dir}.\n"
         )
 
-        generate_word_alignments_mgiza(
+        # The aligners extend the lists of paths with the augmentation corpus, they get a copy so the cache keys
+        # and the next aligners use the original lists
+        with report.timer("alignments/mgiza"):
+            generate_word_alignments_mgiza(
+                source_paths=list(source_paths),
+                target_paths=list(target_paths),
+                source_parallel_corpus=[source_augmentation]
+                if source_augmentation
+                else None,
+                target_parallel_corpus=[target_augmentation]
+                if target_augmentation
+                else None,
+                output_names=output_names,
+                output_dir=output_dir,
+                binary_alignments=binary_alignments,
+            )
+
+        store_alignments(
+            cache_keys=mgiza_cache_keys,
+            alignment_method="mgiza",
+            dataset_splits=dataset_splits,
+            model_name_or_path=model_name_or_path,
+            **cache_args,
+        )
+
+    fast_align_cache_keys = (
+        get_alignment_cache_keys(
+            alignment_method="fast_align",
             source_paths=source_paths,
             target_paths=target_paths,
-            source_parallel_corpus=[source_augmentation]
-            if source_augmentation
-            else None,
-            target_parallel_corpus=[target_augmentation]
-            if target_augmentation
-            else None,
-            output_names=output_names,
-            output_dir=output_dir,
+            **cache_key_args,
         )
-
-    if do_fastalign:
+        if do_fastalign
+        else None
+    )
+    if do_fastalign and not restore_alignments(
+        cache_keys=fast_align_cache_keys,
+        alignment_method="fast_align",
+        dataset_splits=dataset_splits,
+        binary_alignments=binary_alignments,
+        **cache_args,
+    ):
         from fast_align.generate_alignments import generate_word_alignments_fast_align
 
         output_names = []
@@ -141,23 +256,54 @@ def generate_alignments(
             f"Output_dir: {output_dir}.\n"
         )
 
-        generate_word_alignments_fast_align(
-            source_paths=source_paths,
-            target_paths=target_paths,
-            source_parallel_corpus=[source_augmentation]
-            if source_augmentation
-            else None,
-            target_parallel_corpus=[target_augmentation]
-            if target_augmentation
-            else None,
-            output_names=output_names,
-            output_dir=output_dir,
+        with report.timer("alignments/fast_align"):
+            generate_word_alignments_fast_align(
+                source_paths=list(source_paths),
+                target_paths=list(target_paths),
+                source_parallel_corpus=[source_augmentation]
+                if source_augmentation
+                else None,
+                target_parallel_corpus=[target_augmentation]
+                if target_augmentation
+                else None,
+                output_names=output_names,
+                output_dir=output_dir,
+                binary_alignments=binary_alignments,
+            )
+
+        store_alignments(
+            cache_keys=fast_align_cache_keys,
+            alignment_method="fast_align",
+            dataset_splits=dataset_splits,
+            model_name_or_path=model_name_or_path,
+            **cache_args,
         )
 
     if do_simalign:
         from SimAlign.generate_alignments import generate_word_alignments_simalign
 
-        if source_train and target_train:
+        # SimAlign aligns each split independently, so each split is cached independently
+        train_cache_keys = (
+            get_alignment_cache_keys(
+                alignment_method="simalign",
+                source_paths=[source_train],
+                target_paths=[target_train],
+                **cache_key_args,
+            )
+            if source_train and target_train
+            else None
+        )
+        if (
+            source_train
+            and target_train
+            and not restore_alignments(
+                cache_keys=train_cache_keys,
+                alignment_method="simalign",
+                dataset_splits=["train"],
+                binary_alignments=binary_alignments,
+                **cache_args,
+            )
+        ):
             print(
                 f"Generate word alignments SimAlign. "
                 f"source_file: {source_train}. "
@@ -165,14 +311,47 @@ def generate_alignments(
                 f"output: {os.path.join(output_dir, f'{output_name}.simalign.train')}"
             )
 
-            generate_word_alignments_simalign(
-                source_file=source_train,
-                target_file=target_train,
-                output=os.path.join(output_dir, f"{output_name}.simalign.train"),
-                model=model_name_or_path,
+            with report.timer("alignments/simalign"):
+                generate_word_alignments_simalign(
+                    source_file=source_train,
+                    target_file=target_train,
+                    output=os.path.join(output_dir, f"{output_name}.simalign.train"),
+                    model=model_name_or_path,
+                    binary_alignments=binary_alignments,
+                    sentence_cache_path=sentence_alignment_cache,
+                    embedding_cache_dir=embedding_cache_dir,
+                    embedding_cache_size=embedding_cache_size,
+                )
+
+            store_alignments(
+                cache_keys=train_cache_keys,
+                alignment_method="simalign",
+                dataset_splits=["train"],
+                model_name_or_path=model_name_or_path,
+                **cache_args,
             )
 
-        if source_dev and target_dev:
+        dev_cache_keys = (
+            get_alignment_cache_keys(
+                alignment_method="simalign",
+                source_paths=[source_dev],
+                target_paths=[target_dev],
+                **cache_key_args,
+            )
+            if source_dev and target_dev
+            else None
+        )
+        if (
+            source_dev
+            and target_dev
+            and not restore_alignments(
+                cache_keys=dev_cache_keys,
+                alignment_method="simalign",
+                dataset_splits=["dev"],
+                binary_alignments=binary_alignments,
+                **cache_args,
+            )
+        ):
             print(
                 f"Generate word alignments SimAlign. "
                 f"source_file: {source_dev}. "
@@ -180,14 +359,47 @@ def generate_alignments(
                 f"output: {os.path.join(output_dir, f'{output_name}.simalign.dev')}"
             )
 
-            generate_word_alignments_simalign(
-                source_file=source_dev,
-                target_file=target_dev,
-                output=os.path.join(output_dir, f"{output_name}.simalign.dev"),
-                model=model_name_or_path,
+            with report.timer("alignments/simalign"):
+                generate_word_alignments_simalign(
+                    source_file=source_dev,
+                    target_file=target_dev,
+                    output=os.path.join(output_dir, f"{output_name}.simalign.dev"),
+                    model=model_name_or_path,
+                    binary_alignments=binary_alignments,
+                    sentence_cache_path=sentence_alignment_cache,
+                    embedding_cache_dir=embedding_cache_dir,
+                    embedding_cache_size=embedding_cache_size,
+                )
+
+            store_alignments(
+                cache_keys=dev_cache_keys,
+                alignment_method="simalign",
+                dataset_splits=["dev"],
+                model_name_or_path=model_name_or_path,
+                **cache_args,
             )
 
-        if source_test and target_test:
+        test_cache_keys = (
+            get_alignment_cache_keys(
+                alignment_method="simalign",
+                source_paths=[source_test],
+                target_paths=[target_test],
+                **cache_key_args,
+            )
+            if source_test and target_test
+            else None
+        )
+        if (
+            source_test
+            and target_test
+            and not restore_alignments(
+                cache_keys=test_cache_keys,
+                alignment_method="simalign",
+                dataset_splits=["test"],
+                binary_alignments=binary_alignments,
+                **cache_args,
+            )
+        ):
             print(
                 f"Generate word alignments SimAlign. "
                 f"source_file: {source_test}. "
@@ -195,14 +407,43 @@ def generate_alignments(
                 f"output: {os.path.join(output_dir, f'{output_name}.simalign.test')}"
             )
 
-            generate_word_alignments_simalign(
-                source_file=source_test,
-                target_file=target_test,
-                output=os.path.join(output_dir, f"{output_name}.simalign.test"),
-                model=model_name_or_path,
+            with report.timer("alignments/simalign"):
+                generate_word_alignments_simalign(
+                    source_file=source_test,
+                    target_file=target_test,
+                    output=os.path.join(output_dir, f"{output_name}.simalign.test"),
+                    model=model_name_or_path,
+                    binary_alignments=binary_alignments,
+                    sentence_cache_path=sentence_alignment_cache,
+                    embedding_cache_dir=embedding_cache_dir,
+                    embedding_cache_size=embedding_cache_size,
+                )
+
+            store_alignments(
+                cache_keys=test_cache_keys,
+                alignment_method="simalign",
+                dataset_splits=["test"],
+                model_name_or_path=model_name_or_path,
+                **cache_args,
             )
 
-    if do_awesome:
+    awesome_cache_keys = (
+        get_alignment_cache_keys(
+            alignment_method="awesome",
+            source_paths=source_paths,
+            target_paths=target_paths,
+            **cache_key_args,
+        )
+        if do_awesome
+        else None
+    )
+    if do_awesome and not restore_alignments(
+        cache_keys=awesome_cache_keys,
+        alignment_method="awesome",
+        dataset_splits=dataset_splits,
+        binary_alignments=binary_alignments,
+        **cache_args,
+    ):
         from awesome.generate_alignments import generate_word_alignments_awesome
 
         output_names = []
@@ -223,22 +464,171 @@ def generate_alignments(
             f"Output_dir: {output_dir}.\n"
         )
 
-        generate_word_alignments_awesome(
-            source_paths=source_paths,
-            target_paths=target_paths,
-            source_parallel_corpus=[source_augmentation]
-            if source_augmentation
-            else None,
-            target_parallel_corpus=[target_augmentation]
-            if target_augmentation
-            else None,
-            output_names=output_names,
-            output_dir=output_dir,
-            remove_tmp_dir=remove_awesome_model,
+        with report.timer("alignments/awesome"):
+            generate_word_alignments_awesome(
+                source_paths=list(source_paths),
+                target_paths=list(target_paths),
+                source_parallel_corpus=[source_augmentation]
+                if source_augmentation
+                else None,
+                target_parallel_corpus=[target_augmentation]
+                if target_augmentation
+                else None,
+                output_names=output_names,
+                output_dir=output_dir,
+                remove_tmp_dir=remove_awesome_model,
+                model_name_or_path=model_name_or_path,
+                binary_alignments=binary_alignments,
+            )
+
+        store_alignments(
+            cache_keys=awesome_cache_keys,
+            alignment_method="awesome",
+            dataset_splits=dataset_splits,
             model_name_or_path=model_name_or_path,
+            **cache_args,
         )
 
 
+def get_alignments_path(
+    output_dir: str,
+    output_name: str,
+    alignment_method: str,
+    dataset_split: str,
+    binary_alignments: bool = False,
+) -> str:
+    """
+    Get the path of the alignments generated by an alignment method for a dataset split.
+    :param str output_dir: Path to the output directory.
+    :param str output_name: Name of the output files
+    :param str alignment_method: Alignment method [mgiza, fast_align, simalign, awesome].
+    :param str dataset_split: Dataset split [train, dev, test].
+    :param bool binary_alignments: Whether to return the path of the binary alignments. If the binary file does not
+    exist or is older than the talp file, it will be created from the talp file.
+    """
+    if alignment_method == "mgiza" or alignment_method == "fast_align":
+        alignments_path = os.path.join(
+            output_dir,
+            f"{output_name}.{alignment_method}.{dataset_split}.grow_diag_final-and.talp",
+        )
+
+    elif alignment_method == "simalign":
+        alignments_path = os.path.join(
+            output_dir,
+            f"{output_name}.{alignment_method}.{dataset_split}.itermax.talp",
+        )
+
+    elif alignment_method == "awesome":
+        alignments_path = os.path.join(
+            output_dir,
+            f"{output_name}.{alignment_method}.{dataset_split}.talp",
+        )
+    else:
+        raise ValueError(f"{alignment_method} not supported")
+
+    if binary_alignments:
+        binary_path = binary_alignments_path(alignments_path)
+        if not os.path.exists(binary_path) or os.path.getmtime(
+            binary_path
+        ) < os.path.getmtime(alignments_path):
+            with get_run_report().timer("talp2binary"):
+                talp2binary(alignments_path)
+        alignments_path = binary_path
+
+    return alignments_path
+
+
+def get_alignment_cache_keys(
+    alignment_cache: Optional[AlignmentCache],
+    alignment_method: str,
+    source_paths: List[str],
+    target_paths: List[str],
+    source_augmentation: Optional[str],
+    target_augmentation: Optional[str],
+    model_name_or_path: str,
+) -> Optional[List[str]]:
+    """
+    Alignment cache keys of the given splits for an alignment method, None if there is no alignment cache. The keys
+    are computed once, before the alignments are generated, and used to restore and to store the alignments.
+    """
+    if alignment_cache is None:
+        return None
+
+    return alignment_cache_keys(
+        alignment_method=alignment_method,
+        source_paths=list(source_paths),
+        target_paths=list(target_paths),
+        source_augmentation=source_augmentation,
+        target_augmentation=target_augmentation,
+        model_name_or_path=model_name_or_path,
+    )
+
+
+def restore_alignments(
+    alignment_cache: Optional[AlignmentCache],
+    cache_keys: Optional[List[str]],
+    alignment_method: str,
+    dataset_splits: List[str],
+    output_dir: str,
+    output_name: str,
+    binary_alignments: bool = False,
+) -> bool:
+    """
+    Copy the alignments of an alignment method for the given splits from the alignment cache to the output
+    directory. Returns True if the alignments of all the splits were in the cache, False otherwise (the alignments
+    must be generated).
+    """
+    if alignment_cache is None:
+        return False
+
+    restored = alignment_cache.restore(
+        keys=cache_keys,
+        output_paths=[
+            get_alignments_path(
+                output_dir, output_name, alignment_method, dataset_split
+            )
+            for dataset_split in dataset_splits
+        ],
+        binary_alignments=binary_alignments,
+    )
+    if restored:
+        print(
+            f"The {alignment_method} alignments of {dataset_splits} were found in the alignment cache "
+            f"{alignment_cache.cache_dir}. Skipping {alignment_method}."
+        )
+    return restored
+
+
+def store_alignments(
+    alignment_cache: Optional[AlignmentCache],
+    cache_keys: Optional[List[str]],
+    alignment_method: str,
+    dataset_splits: List[str],
+    model_name_or_path: str,
+    output_dir: str,
+    output_name: str,
+) -> None:
+    """
+    Add the alignments generated by an alignment method for the given splits to the alignment cache.
+    """
+    if alignment_cache is None:
+        return
+
+    alignment_cache.store(
+        keys=cache_keys,
+        alignments_paths=[
+            get_alignments_path(
+                output_dir, output_name, alignment_method, dataset_split
+            )
+            for dataset_split in dataset_splits
+        ],
+        description={
+            "alignment_method": alignment_method,
+            "model_name_or_path": model_name_or_path,
+        },
+    )
+
+
 def run_projection(
     source_train: Optional[str],
     source_dev: Optional[str],
@@ -259,6 +649,18 @@ def run_projection(
     remove_puncs: bool = True,
     fill_gap_size: int = 1,
     use_existing_alignments: bool = False,
+    projection_engine: str = "python",
+    binary_alignments: bool = False,
+    single_pass_projection: bool = False,
+    run_report: bool = False,
+    resume: bool = False,
+    alignment_cache_dir: Optional[str] = None,
+    alignment_cache_size: float = DEFAULT_CACHE_SIZE_GB,
+    sentence_alignment_cache: Optional[str] = None,
+    output_compression: str = "none",
+    output_format: str = "tsv",
+    embedding_cache_dir: Optional[str] = None,
+    embedding_cache_size: float = DEFAULT_EMBEDDING_CACHE_SIZE_GB,
 ):
     """
     Perform annotation projection for the given datasets.
@@ -287,9 +689,44 @@ def run_projection(
     Use a larger value for argumentation datasets and datasets in which the labels are long sentences.
     :param bool use_existing_alignments: Whether to use existing word alignments instead of generating new ones. You
     must use the same --output_dir and --output_name as the one used to generate the word alignments. You must
-    also use the same train, dev and test files.
+    also use the same train, dev and test files. Deprecated, use the alignment cache instead.
+    :param str projection_engine: Implementation used to project the labels. "python" projects each sentence with
+    pure python, "numpy" projects the whole batch with numpy array operations. Both produce the same output.
+    :param bool binary_alignments: Whether to store the alignments in the binary format (.talpb) and read them from
+    it during the projection. If the binary file does not exist or is older than the talp file, it will be created
+    from the talp file.
+    :param bool single_pass_projection: Whether to project each dataset split with all the alignment methods in a
+    single pass. The source and target datasets are read only once and all the alignment files are read in lockstep.
+    :param bool run_report: Whether to measure the time spent in each stage and count the projected sentences and
+    spans. The report is stored in {output_dir}/{output_name}.run_report.json
+    :param bool resume: Whether to resume the interrupted projections. The progress of each projection is stored in
+    {output_file}.checkpoint.json, the projection continues from the last checkpoint. The alignments must not
+    change, use it together with the alignment cache (or use_existing_alignments). If the alignments are generated
+    again the projections start from the beginning.
+    :param str alignment_cache_dir: Path to the alignment cache. Alignments that were already generated for the same
+    sentences, augmentation corpus, alignment method, model and parameters (in any output directory) are taken
+    from the cache instead of generating them again. If None, no cache is used.
+    :param float alignment_cache_size: Maximum size of the alignment cache in GB. The least recently used alignments
+    are removed.
+    :param str sentence_alignment_cache: Path to the sentence alignment cache (SQLite database) used by simalign.
+    Sentence pairs that were already aligned (in any dataset) are taken from the cache, only the new sentence pairs
+    are aligned. If None, no cache is used.
+    :param str output_compression: Compression of the projected datasets [none, gzip, zstd, xz]. The input datasets
+    can be compressed too, the compression of each file is given by its extension (.gz, .zst, .xz).
+    :param str output_format: Format of the projected datasets [tsv, arrow, parquet]. arrow (Arrow IPC) and parquet
+    store the target words and the integer-encoded tags of each sentence, and the tag vocabulary as metadata (see
+    projection.columnar). They require the pyarrow package and cannot be compressed or resumed.
+    :param str embedding_cache_dir: Path to the embedding cache used by simalign. The embeddings of the sentences
+    that are in the cache are not computed again. If None, no cache is used.
+    :param float embedding_cache_size: Maximum size of the embedding cache in GB. The least recently used embeddings
+    are removed.
     """
 
+    assert output_format == "tsv" or output_compression == "none", (
+        f"Columnar outputs are not compressed with --output_compression. "
+        f"output_format: {output_format}. output_compression: {output_compression}"
+    )
+
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
 
@@ -313,13 +750,24 @@ def run_projection(
         source_augmentation is None and target_augmentation is None
     )
 
+    report = enable_run_report() if run_report else get_run_report()
+
     if source_train:
         source_train_txt = os.path.join(
-            output_dir, os.path.basename(os.path.splitext(source_train)[0]) + ".txt"
+            output_dir,
+            os.path.basename(
+                os.path.splitext(split_compression_extension(source_train)[0])[0]
+            )
+            + ".txt",
         )
-        conll2text(input_path=source_train, sentences_output_path=source_train_txt)
-        lines_source = count_lines(input_path=source_train_txt)
-        lines_target = count_lines(input_path=target_train)
+        with report.timer("conll2text/train"):
+            lines_source = conll2text(
+                input_path=source_train, sentences_output_path=source_train_txt
+            )
+        with report.timer("count_lines/train"):
+            # The sentence index is reused by the projection dataloader
+            lines_target = len(SentenceIndex(target_train))
+        report.count("sentences/train", lines_source)
         assert lines_source == lines_target, (
             f"The number of lines in the source and target files are different.\n"
             f"Source ({source_train_txt}): {lines_source}\n"
@@ -330,11 +778,20 @@ def run_projection(
 
     if source_dev:
         source_dev_txt = os.path.join(
-            output_dir, os.path.basename(os.path.splitext(source_dev)[0]) + ".txt"
+            output_dir,
+            os.path.basename(
+                os.path.splitext(split_compression_extension(source_dev)[0])[0]
+            )
+            + ".txt",
         )
-        conll2text(input_path=source_dev, sentences_output_path=source_dev_txt)
-        lines_source = count_lines(input_path=source_dev_txt)
-        lines_target = count_lines(input_path=target_dev)
+        with report.timer("conll2text/dev"):
+            lines_source = conll2text(
+                input_path=source_dev, sentences_output_path=source_dev_txt
+            )
+        with report.timer("count_lines/dev"):
+            # The sentence index is reused by the projection dataloader
+            lines_target = len(SentenceIndex(target_dev))
+        report.count("sentences/dev", lines_source)
         assert lines_source == lines_target, (
             f"The number of lines in the source and target files are different.\n"
             f"Source ({source_dev_txt}): {lines_source}\n"
@@ -345,11 +802,20 @@ def run_projection(
 
     if source_test:
         source_test_txt = os.path.join(
-            output_dir, os.path.basename(os.path.splitext(source_test)[0]) + ".txt"
+            output_dir,
+            os.path.basename(
+                os.path.splitext(split_compression_extension(source_test)[0])[0]
+            )
+            + ".txt",
         )
-        conll2text(input_path=source_test, sentences_output_path=source_test_txt)
-        lines_source = count_lines(input_path=source_test_txt)
-        lines_target = count_lines(input_path=target_test)
+        with report.timer("conll2text/test"):
+            lines_source = conll2text(
+                input_path=source_test, sentences_output_path=source_test_txt
+            )
+        with report.timer("count_lines/test"):
+            # The sentence index is reused by the projection dataloader
+            lines_target = len(SentenceIndex(target_test))
+        report.count("sentences/test", lines_source)
         assert lines_source == lines_target, (
             f"The number of lines in the source and target files are different.\n"
             f"Source ({source_test_txt}): {lines_source}\n"
@@ -359,8 +825,10 @@ def run_projection(
         source_test_txt = None
 
     if source_augmentation:
-        lines_source = count_lines(input_path=source_augmentation)
-        lines_target = count_lines(input_path=target_augmentation)
+        with report.timer("count_lines/augmentation"):
+            lines_source = count_lines(input_path=source_augmentation)
+            lines_target = count_lines(input_path=target_augmentation)
+        report.count("sentences/augmentation", lines_source)
         assert lines_source == lines_target, (
             f"The number of lines in the source and target files are different.\n"
             f"Source ({source_augmentation}): {lines_source}\n"
@@ -385,6 +853,12 @@ def run_projection(
             do_awesome=do_awesome,
             remove_awesome_model=remove_awesome_model,
             model_name_or_path=model_name_or_path,
+            binary_alignments=binary_alignments,
+            alignment_cache_dir=alignment_cache_dir,
+            alignment_cache_size=alignment_cache_size,
+            sentence_alignment_cache=sentence_alignment_cache,
+            embedding_cache_dir=embedding_cache_dir,
+            embedding_cache_size=embedding_cache_size,
         )
     else:
         print(
@@ -411,57 +885,89 @@ def run_projection(
 
     output_files: List[str] = []
 
-    for alignment_method in alignment_list:
-        for dataset_split in dataset_list:
-            if alignment_method == "mgiza" or alignment_method == "fast_align":
-                alignments_path = os.path.join(
-                    output_dir,
-                    f"{output_name}.{alignment_method}.{dataset_split}.grow_diag_final-and.talp",
-                )
-
-            elif alignment_method == "simalign":
-                alignments_path = os.path.join(
-                    output_dir,
-                    f"{output_name}.{alignment_method}.{dataset_split}.itermax.talp",
-                )
-
-            elif alignment_method == "awesome":
-                alignments_path = os.path.join(
-                    output_dir,
-                    f"{output_name}.{alignment_method}.{dataset_split}.talp",
-                )
-            else:
-                raise ValueError(f"{alignment_method} not supported")
-
-            if dataset_split == "train":
-                source_dataset = source_train
-                target_dataset = target_train
-            elif dataset_split == "dev":
-                source_dataset = source_dev
-                target_dataset = target_dev
-            elif dataset_split == "test":
-                source_dataset = source_test
-                target_dataset = target_test
-            else:
-                raise ValueError(f"{dataset_split} dataset split not supported")
-
-            dataset_projection(
-                source_dataset=source_dataset,
-                target_sentences=target_dataset,
-                alignments_path=alignments_path,
-                batch_size=10000,
-                output_path=os.path.join(
-                    output_dir, f"{output_name}.{alignment_method}.{dataset_split}.tsv"
-                ),
-                remove_puncs=remove_puncs,
-                fill_gap_size=fill_gap_size,
-            )
-
-            output_files.append(
-                os.path.join(
-                    output_dir, f"{output_name}.{alignment_method}.{dataset_split}.tsv"
-                )
-            )
+    split_datasets = {
+        "train": (source_train, target_train),
+        "dev": (source_dev, target_dev),
+        "test": (source_test, target_test),
+    }
+
+    # A single pool of workers is shared by all the projections of the run
+    with ProjectionPool() as projection_pool:
+        if single_pass_projection:
+            # Read each split once and project it with all the alignment methods at the same time
+            for dataset_split in dataset_list:
+                source_dataset, target_dataset = split_datasets[dataset_split]
+                split_output_files = [
+                    add_compression_extension(
+                        os.path.join(
+                            output_dir,
+                            f"{output_name}.{alignment_method}.{dataset_split}"
+                            + output_extension(output_format),
+                        ),
+                        output_compression,
+                    )
+                    for alignment_method in alignment_list
+                ]
+
+                with report.timer(f"projection/{dataset_split}"):
+                    multi_dataset_projection(
+                        source_dataset=source_dataset,
+                        target_sentences=target_dataset,
+                        alignments_paths=[
+                            get_alignments_path(
+                                output_dir=output_dir,
+                                output_name=output_name,
+                                alignment_method=alignment_method,
+                                dataset_split=dataset_split,
+                                binary_alignments=binary_alignments,
+                            )
+                            for alignment_method in alignment_list
+                        ],
+                        batch_size=10000,
+                        output_paths=split_output_files,
+                        remove_puncs=remove_puncs,
+                        fill_gap_size=fill_gap_size,
+                        projection_pool=projection_pool,
+                        projection_engine=projection_engine,
+                        resume=resume,
+                    )
+
+                output_files.extend(split_output_files)
+
+        else:
+            for alignment_method in alignment_list:
+                for dataset_split in dataset_list:
+                    source_dataset, target_dataset = split_datasets[dataset_split]
+                    output_path = add_compression_extension(
+                        os.path.join(
+                            output_dir,
+                            f"{output_name}.{alignment_method}.{dataset_split}"
+                            + output_extension(output_format),
+                        ),
+                        output_compression,
+                    )
+
+                    with report.timer(f"projection/{alignment_method}.{dataset_split}"):
+                        dataset_projection(
+                            source_dataset=source_dataset,
+                            target_sentences=target_dataset,
+                            alignments_path=get_alignments_path(
+                                output_dir=output_dir,
+                                output_name=output_name,
+                                alignment_method=alignment_method,
+                                dataset_split=dataset_split,
+                                binary_alignments=binary_alignments,
+                            ),
+                            batch_size=10000,
+                            output_path=output_path,
+                            remove_puncs=remove_puncs,
+                            fill_gap_size=fill_gap_size,
+                            projection_pool=projection_pool,
+                            projection_engine=projection_engine,
+                            resume=resume,
+                        )
+
+                    output_files.append(output_path)
 
     if source_train_txt:
         os.remove(source_train_txt)
@@ -470,6 +976,10 @@ def run_projection(
     if source_test_txt:
         os.remove(source_test_txt)
 
+    if run_report:
+        report.save(os.path.join(output_dir, f"{output_name}.run_report.json"))
+        disable_run_report()
+
     print("Done!")
     print("Output files:")
     print("\n".join(output_files))
@@ -593,11 +1103,119 @@ if __name__ == "__main__":
         action="store_true",
         help="If set, the script will use the existing alignments in the output directory instead of generating "
         "new ones. You must use the same --output_dir and --output_name as the previous run and the same "
-        "train, dev and test files.",
+        "train, dev and test files. Deprecated: the alignment cache reuses the alignments automatically.",
+    )
+
+    parser.add_argument(
+        "--alignment_cache_dir",
+        default=DEFAULT_CACHE_DIR,
+        type=str,
+        help="Path to the alignment cache. Alignments that were already generated for the same sentences, "
+        "augmentation corpus, alignment method, model and parameters are taken from the cache instead of "
+        "generating them again. Defaults to the ALIGNMENT_CACHE_DIR environment variable or "
+        "~/.cache/easy_label_projection/alignments",
+    )
+
+    parser.add_argument(
+        "--alignment_cache_size",
+        default=DEFAULT_CACHE_SIZE_GB,
+        type=float,
+        help="Maximum size of the alignment cache in GB. The least recently used alignments are removed.",
+    )
+
+    parser.add_argument(
+        "--sentence_alignment_cache",
+        default=DEFAULT_SENTENCE_CACHE_PATH,
+        type=str,
+        help="Path to the sentence alignment cache (SQLite database) used by simalign. Sentence pairs that were "
+        "already aligned in any dataset are not aligned again. Defaults to the SENTENCE_ALIGNMENT_CACHE "
+        "environment variable or ~/.cache/easy_label_projection/sentence_alignments.sqlite",
+    )
+
+    parser.add_argument(
+        "--embedding_cache_dir",
+        default=None,
+        type=str,
+        help="Path to the embedding cache used by simalign. The embeddings of the sentences that are in the cache "
+        "are not computed again, the new ones are added to the cache. Disabled by default",
+    )
+
+    parser.add_argument(
+        "--embedding_cache_size",
+        default=DEFAULT_EMBEDDING_CACHE_SIZE_GB,
+        type=float,
+        help="Maximum size of the embedding cache in GB. The least recently used embeddings are removed.",
+    )
+
+    parser.add_argument(
+        "--no_alignment_cache",
+        action="store_true",
+        help="Do not use the alignment cache nor the sentence alignment cache.",
+    )
+
+    parser.add_argument(
+        "--projection_engine",
+        default="python",
+        type=str,
+        choices=["python", "numpy"],
+        help="Implementation used to project the labels. 'python' projects each sentence with pure python, "
+        "'numpy' projects the whole batch with numpy array operations. Both produce the same output.",
+    )
+
+    parser.add_argument(
+        "--binary_alignments",
+        action="store_true",
+        help="Store the alignments in the binary format (.talpb) and read them from it during the projection. "
+        "If the binary file does not exist or is older than the talp file, it will be created from the talp file.",
+    )
+
+    parser.add_argument(
+        "--single_pass_projection",
+        action="store_true",
+        help="Project each dataset split with all the alignment methods in a single pass. The source and target "
+        "datasets are read only once and all the alignment files are read in lockstep.",
+    )
+
+    parser.add_argument(
+        "--run_report",
+        action="store_true",
+        help="Measure the time spent in each stage and count the projected sentences and spans. The report is stored "
+        "in {output_dir}/{output_name}.run_report.json",
+    )
+
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Resume the projections interrupted in a previous run from their last checkpoint "
+        "({output_file}.checkpoint.json). The alignments are taken from the alignment cache.",
+    )
+
+    parser.add_argument(
+        "--output_compression",
+        type=str,
+        default="none",
+        choices=COMPRESSIONS,
+        help="Compress the projected datasets (.gz, .zst or .xz extension). Compressed input datasets are detected "
+        "by their extension",
+    )
+
+    parser.add_argument(
+        "--output_format",
+        type=str,
+        default="tsv",
+        choices=OUTPUT_FORMATS,
+        help="Format of the projected datasets. 'arrow' (Arrow IPC, .arrow) and 'parquet' (.parquet) store the "
+        "target words and the integer-encoded tags of each sentence and the tag vocabulary as metadata, so they "
+        "can be memory-mapped without parsing. Requires pyarrow",
     )
 
     args = parser.parse_args()
 
+    alignment_cache_dir = None if args.no_alignment_cache else args.alignment_cache_dir
+    sentence_alignment_cache = (
+        None if args.no_alignment_cache else args.sentence_alignment_cache
+    )
+
     run_projection(
         source_train=args.source_train,
         target_train=args.target_train,
@@ -618,4 +1236,16 @@ if __name__ == "__main__":
         remove_puncs=args.do_not_remove_puncs,
         fill_gap_size=args.fill_gap_size,
         use_existing_alignments=args.use_existing_alignments,
+        projection_engine=args.projection_engine,
+        binary_alignments=args.binary_alignments,
+        single_pass_projection=args.single_pass_projection,
+        run_report=args.run_report,
+        resume=args.resume,
+        alignment_cache_dir=alignment_cache_dir,
+        alignment_cache_size=args.alignment_cache_size,
+        sentence_alignment_cache=sentence_alignment_cache,
+        output_compression=args.output_compression,
+        output_format=args.output_format,
+        embedding_cache_dir=args.embedding_cache_dir,
+        embedding_cache_size=args.embedding_cache_size,
     )
@@ -1,5 +1,11 @@
 from awesome.utils import data2awesome, count_lines, run_bash_command, concatenate_files
 from awesome.model_utils import train_awesome, inference_awesome
+from projection.alignment_store import talp2binary
+from projection.compression import open_file
+from projection.sentence_alignment_cache import (
+    SentenceAlignmentCache,
+    split_cached_pairs,
+)
 import os
 import argparse
 from typing import List
@@ -7,6 +13,68 @@ import shutil
 import uuid
 
 
+def inference_awesome_cached(
+    source_path: str,
+    target_path: str,
+    output_path: str,
+    model_dir: str,
+    sentence_cache: SentenceAlignmentCache,
+):
+    """
+    Awesome inference that only aligns the sentence pairs that are not in the sentence alignment cache. The
+    alignments are written in the original order and the new ones are added to the cache.
+    :param str source_path: Source sentences in txt format (one per line)
+    :param str target_path: Target sentences in txt format (one per line)
+    :param str output_path: Path to the output talp file
+    :param str model_dir: Path to the pretrained awesome model
+    :param SentenceAlignmentCache sentence_cache: Sentence alignment cache
+    """
+    with open_file(source_path) as source_file:
+        source_lines = [line.strip().replace("\t", " ") for line in source_file]
+    with open_file(target_path) as target_file:
+        target_lines = [line.strip().replace("\t", " ") for line in target_file]
+    assert len(source_lines) == len(target_lines), (
+        f"{source_path} and {target_path} should have the same number of lines. "
+        f"{len(source_lines)} != {len(target_lines)}"
+    )
+
+    keys, alignments, misses = split_cached_pairs(
+        sentence_cache, source_lines, target_lines
+    )
+
+    if misses:
+        corpus_path: str = f"{output_path}.misses.awesome"
+        misses_output_path: str = f"{output_path}.misses.talp"
+        with open(corpus_path, "w", encoding="utf8") as corpus_file:
+            for i in misses:
+                print(f"{source_lines[i]} ||| {target_lines[i]}", file=corpus_file)
+
+        inference_awesome(
+            corpus_path=corpus_path,
+            output_path=misses_output_path,
+            model_name_or_path=model_dir,
+        )
+
+        with open(misses_output_path, "r", encoding="utf8") as misses_file:
+            new_alignments = [line.rstrip("\n") for line in misses_file]
+        assert len(new_alignments) == len(misses), (
+            f"{misses_output_path} should have {len(misses)} lines. "
+            f"It has {len(new_alignments)} lines."
+        )
+        for i, alignment in zip(misses, new_alignments):
+            alignments[i] = alignment
+        sentence_cache.put_many(
+            [(keys[i], alignment) for i, alignment in zip(misses, new_alignments)]
+        )
+
+        os.remove(corpus_path)
+        os.remove(misses_output_path)
+
+    with open(output_path, "w", encoding="utf8") as output_file:
+        for alignment in alignments:
+            print(alignment, file=output_file)
+
+
 def generate_word_alignments_awesome(
     source_paths: List[str],
     target_paths: List[str],
@@ -17,6 +85,8 @@ def generate_word_alignments_awesome(
     tmp_dir: str = None,
     remove_tmp_dir: bool = True,
     model_name_or_path: str = "bert-base-multilingual-cased",
+    binary_alignments: bool = False,
+    sentence_cache_path: str = None,
 ):
 
     train_model = False
@@ -93,6 +163,22 @@ def generate_word_alignments_awesome(
             model_name_or_path=model_name_or_path,
         )
 
+    # The alignments of a model trained in this run are never in the sentence alignment cache, so the cache is
+    # only used with a pretrained model
+    sentence_cache = None
+    if sentence_cache_path and train_model:
+        print(
+            f"The sentence alignment cache can only be used with a pretrained awesome model (tmp_dir). "
+            f"Ignoring {sentence_cache_path}"
+        )
+    elif sentence_cache_path:
+        sentence_cache = SentenceAlignmentCache(
+            path=sentence_cache_path,
+            alignment_method="awesome",
+            model_name_or_path=tmp_dir,
+            parameters={"extraction": "softmax"},
+        )
+
     for source_set_path, target_set_path, output_name in zip(
         source_paths, target_paths, output_names
     ):
@@ -100,17 +186,32 @@ def generate_word_alignments_awesome(
             f"Awesome inference: {source_set_path}-{target_set_path} => {output_name}"
         )
 
-        data2awesome(
-            source_path=source_set_path,
-            target_path=target_set_path,
-            output_path=os.path.join(tmp_dir, f"{output_name}.awesome"),
-        )
+        if sentence_cache is None:
+            data2awesome(
+                source_path=source_set_path,
+                target_path=target_set_path,
+                output_path=os.path.join(tmp_dir, f"{output_name}.awesome"),
+            )
 
-        inference_awesome(
-            corpus_path=os.path.join(tmp_dir, f"{output_name}.awesome"),
-            output_path=os.path.join(output_dir, output_name),
-            model_name_or_path=tmp_dir,
-        )
+            inference_awesome(
+                corpus_path=os.path.join(tmp_dir, f"{output_name}.awesome"),
+                output_path=os.path.join(output_dir, output_name),
+                model_name_or_path=tmp_dir,
+            )
+        else:
+            inference_awesome_cached(
+                source_path=source_set_path,
+                target_path=target_set_path,
+                output_path=os.path.join(output_dir, output_name),
+                model_dir=tmp_dir,
+                sentence_cache=sentence_cache,
+            )
+
+        if binary_alignments:
+            talp2binary(os.path.join(output_dir, output_name))
+
+    if sentence_cache is not None:
+        sentence_cache.close()
 
     if remove_tmp_dir:
         shutil.rmtree(tmp_dir, ignore_errors=True)
@@ -165,6 +266,27 @@ if __name__ == "__main__":
         help="Paths to the dataset augmentation corpus target sentences (one per line)",
     )
 
+    parser.add_argument(
+        "--binary_alignments",
+        action="store_true",
+        help="Also store the alignments in the binary format (.talpb), which can be loaded much faster",
+    )
+
+    parser.add_argument(
+        "--tmp_dir",
+        type=str,
+        default=None,
+        help="Path to a pretrained awesome model. If not provided, a model is trained on the input sentences",
+    )
+
+    parser.add_argument(
+        "--sentence_cache_path",
+        type=str,
+        default=None,
+        help="Path to the sentence alignment cache (SQLite database). Only used with a pretrained model (--tmp_dir). "
+        "Sentence pairs found in the cache are not aligned again, the new alignments are added to the cache",
+    )
+
     args = parser.parse_args()
 
     generate_word_alignments_awesome(
@@ -174,4 +296,7 @@ if __name__ == "__main__":
         target_parallel_corpus=args.target_parallel_corpus,
         output_names=args.output_names,
         output_dir=args.output_dir,
+        binary_alignments=args.binary_alignments,
+        tmp_dir=args.tmp_dir,
+        sentence_cache_path=args.sentence_cache_path,
     )
@@ -0,0 +1,681 @@
+import abc
+import argparse
+import contextlib
+import json
+import multiprocessing
+import os
+import queue
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional
+
+from projection.instrumentation import peak_rss_mb
+
+REPO_DIR: str = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ALIGNMENTS_DIR: str = os.path.join(
+    REPO_DIR, "data/absa_datasets/automatic_projections/alignments/en2es"
+)
+
+# Input files of each benchmark dataset. The target sentences of the data dataset are not shipped as txt,
+# they are extracted from the automatic projections (same translation, same tokenization).
+DATASETS: Dict[str, Dict[str, str]] = {
+    "sample": {
+        "source_tsv": os.path.join(REPO_DIR, "sample/en.absa.test.tsv"),
+        "target_txt": os.path.join(REPO_DIR, "sample/en2es.absa.test.txt"),
+        "alignments_talp": os.path.join(
+            ALIGNMENTS_DIR, "DeepL.50000.simalign.test.itermax.talp"
+        ),
+    },
+    "data": {
+        "source_tsv": os.path.join(
+            REPO_DIR, "data/absa_datasets/original/en/en.absa.train.tsv"
+        ),
+        "target_tsv": os.path.join(
+            REPO_DIR,
+            "data/absa_datasets/automatic_projections/en2es/DeepL.50000.simalign.train.tsv",
+        ),
+        "alignments_talp": os.path.join(
+            ALIGNMENTS_DIR, "DeepL.50000.simalign.train.itermax.talp"
+        ),
+    },
+}
+
+
+def tsv2txt(input_path: str, output_path: str) -> None:
+    with open(input_path, "r", encoding="utf8") as input_file, open(
+        output_path, "w", encoding="utf8"
+    ) as output_file:
+        words: List[str] = []
+        for line in input_file:
+            line = line.strip()
+            if line:
+                words.append(line.split()[0])
+            elif words:
+                print(" ".join(words), file=output_file)
+                words = []
+        if words:
+            print(" ".join(words), file=output_file)
+
+
+def replicate_file(input_path: str, output_path: str, copies: int) -> None:
+    with open(input_path, "r", encoding="utf8") as input_file:
+        text = input_file.read()
+    if input_path.endswith(".tsv") and not text.endswith("\n\n"):
+        text = text.rstrip("\n") + "\n\n"
+    with open(output_path, "w", encoding="utf8") as output_file:
+        for _ in range(copies):
+            output_file.write(text)
+
+
+def talp2mgiza(
+    source_tsv: str, target_txt: str, alignments_talp: str, output_path: str
+):
+    """
+    Write the alignments in the mgiza A3 format, the input of mgiza2fastalign.
+    """
+    from projection.dataset import SourceDataset
+
+    with open(target_txt, "r", encoding="utf8") as target_file, open(
+        alignments_talp, "r", encoding="utf8"
+    ) as alignments_file, open(output_path, "w", encoding="utf8") as output_file:
+        for sentence_no, ((source_words, _, _), target, alignment) in enumerate(
+            zip(SourceDataset(source_tsv), target_file, alignments_file)
+        ):
+            target_ids: List[List[int]] = [[] for _ in source_words]
+            for pair in alignment.split():
+                source, target_id = pair.split("-")
+                target_ids[int(source)].append(int(target_id) + 1)
+            print(
+                f"# Sentence pair ({sentence_no + 1}) source length {len(source_words)} "
+                f"target length {len(target.split())} alignment score : 0",
+                file=output_file,
+            )
+            print(target.strip(), file=output_file)
+            print(
+                "NULL ({ }) "
+                + " ".join(
+                    f"{word} ({{ {' '.join(str(i) for i in ids)} }})"
+                    for word, ids in zip(source_words, target_ids)
+                ),
+                file=output_file,
+            )
+
+
+def prepare_dataset(dataset: str, workdir: str, scale: int) -> Dict[str, str]:
+    """
+    Build the input files of a benchmark dataset in workdir. Each file is replicated scale times.
+    """
+    paths: Dict[str, str] = {}
+    dataset_paths = DATASETS[dataset]
+
+    if "target_txt" not in dataset_paths:
+        target_txt = os.path.join(workdir, f"{dataset}.target.txt.orig")
+        tsv2txt(dataset_paths["target_tsv"], target_txt)
+        dataset_paths = {**dataset_paths, "target_txt": target_txt}
+
+    for name, extension in (
+        ("source_tsv", "tsv"),
+        ("target_txt", "txt"),
+        ("alignments_talp", "talp"),
+    ):
+        paths[name] = os.path.join(workdir, f"{dataset}.{name}.{extension}")
+        replicate_file(dataset_paths[name], paths[name], scale)
+
+    paths["mgiza_a3"] = os.path.join(workdir, f"{dataset}.A3.final")
+    talp2mgiza(
+        paths["source_tsv"],
+        paths["target_txt"],
+        paths["alignments_talp"],
+        paths["mgiza_a3"],
+    )
+
+    paths["output_dir"] = os.path.join(workdir, dataset)
+    os.makedirs(paths["output_dir"], exist_ok=True)
+
+    return paths
+
+
+class Benchmark(abc.ABC):
+    """
+    A pipeline stage. setup is not measured (imports, loading data), run is measured and returns the number of
+    sentences processed.
+    """
+
+    name: str = ""
+
+    def __init__(self, paths: Dict[str, str], batch_size: int):
+        self.paths = paths
+        self.batch_size = batch_size
+        self.num_sentences: int = 0
+
+    def setup(self) -> None:
+        from projection.dataset import count_sentence_tsv
+
+        self.num_sentences = count_sentence_tsv(self.paths["source_tsv"])
+
+    @abc.abstractmethod
+    def run(self) -> int:
+        pass
+
+
+class SourceDatasetBenchmark(Benchmark):
+    name = "source_dataset"
+
+    def setup(self) -> None:
+        from projection.dataset import SourceDataset
+
+        self.dataset_class = SourceDataset
+
+    def run(self) -> int:
+        return sum(1 for _ in self.dataset_class(self.paths["source_tsv"]))
+
+
+class AlignmentDatasetBenchmark(Benchmark):
+    name = "alignment_dataset"
+
+    def setup(self) -> None:
+        from projection.dataset import AlignmentDataset
+
+        self.dataset_class = AlignmentDataset
+
+    def run(self) -> int:
+        return sum(1 for _ in self.dataset_class(self.paths["alignments_talp"]))
+
+
+class ProjectionDataloaderBenchmark(Benchmark):
+    name = "projection_dataloader"
+
+    def setup(self) -> None:
+        from projection.dataset import ProjectionDataloader
+
+        self.dataloader_class = ProjectionDataloader
+
+    def run(self) -> int:
+        data_loader = self.dataloader_class(
+            source_tsv=self.paths["source_tsv"],
+            target_txt=self.paths["target_txt"],
+            alignments_talp=self.paths["alignments_talp"],
+            batch_size=self.batch_size,
+        )
+        return sum(len(source_words) for source_words, _, _, _, _ in data_loader)
+
+
+class SentenceProjectionBenchmark(Benchmark):
+    name = "sentence_projection"
+
+    def setup(self) -> None:
+        from projection.annotation_proyection import sentence_projection
+        from projection.dataset import ProjectionDataloader
+
+        self.sentence_projection = sentence_projection
+        self.sentences = []
+        for batch in ProjectionDataloader(
+            source_tsv=self.paths["source_tsv"],
+            target_txt=self.paths["target_txt"],
+            alignments_talp=self.paths["alignments_talp"],
+            batch_size=self.batch_size,
+        ):
+            # Empty sentences are skipped by sentences_projection
+            self.sentences.extend(s for s in zip(*batch) if s[0] and s[3])
+
+    def run(self) -> int:
+        for (
+            source_words,
+            tags_type,
+            tags_ids,
+            target_words,
+            alignments,
+        ) in self.sentences:
+            self.sentence_projection(
+                source_words=source_words,
+                source_tags_type=tags_type,
+                source_tags_ids=tags_ids,
+                target_words=target_words,
+                alignments=alignments,
+            )
+        return len(self.sentences)
+
+
+class DatasetProjectionBenchmark(Benchmark):
+    name = "dataset_projection"
+
+    def setup(self) -> None:
+        super().setup()
+        from projection.annotation_proyection import dataset_projection
+
+        self.dataset_projection = dataset_projection
+
+    def run(self) -> int:
+        self.dataset_projection(
+            source_dataset=self.paths["source_tsv"],
+            target_sentences=self.paths["target_txt"],
+            alignments_path=self.paths["alignments_talp"],
+            batch_size=self.batch_size,
+            output_path=os.path.join(self.paths["output_dir"], "projection.tsv"),
+        )
+        return self.num_sentences
+
+
+class Conll2TextBenchmark(Benchmark):
+    name = "conll2text"
+
+    def setup(self) -> None:
+        super().setup()
+        from tokenization.conll2text import conll2text
+
+        self.conll2text = conll2text
+
+    def run(self) -> int:
+        self.conll2text(
+            input_path=self.paths["source_tsv"],
+            sentences_output_path=os.path.join(self.paths["output_dir"], "text.txt"),
+            tags_output_path=os.path.join(self.paths["output_dir"], "tags.txt"),
+        )
+        return self.num_sentences
+
+
+class Mgiza2FastalignBenchmark(Benchmark):
+    name = "mgiza2fastalign"
+
+    def setup(self) -> None:
+        super().setup()
+        from mgiza.utils import mgiza2fastalign
+
+        self.mgiza2fastalign = mgiza2fastalign
+
+    def run(self) -> int:
+        self.mgiza2fastalign(
+            input_path=self.paths["mgiza_a3"],
+            output_path=os.path.join(self.paths["output_dir"], "mgiza.talp"),
+        )
+        return self.num_sentences
+
+
+class TagEncodingBenchmark(Benchmark):
+    encoding: str = ""
+
+    def setup(self) -> None:
+        super().setup()
+        from tokenization import tag_encoding
+
+        self.encoding_function = getattr(tag_encoding, f"to_{self.encoding}_encoding")
+
+    def run(self) -> int:
+        self.encoding_function(
+            self.paths["source_tsv"],
+            os.path.join(self.paths["output_dir"], f"{self.encoding}.tsv"),
+        )
+        return self.num_sentences
+
+
+class IOBBenchmark(TagEncodingBenchmark):
+    name = "to_IOB_encoding"
+    encoding = "IOB"
+
+
+class IOB2Benchmark(TagEncodingBenchmark):
+    name = "to_IOB2_encoding"
+    encoding = "IOB2"
+
+
+class BILOUBenchmark(TagEncodingBenchmark):
+    name = "to_BILOU_encoding"
+    encoding = "BILOU"
+
+
+BENCHMARKS: Dict[str, type] = {
+    benchmark.name: benchmark
+    for benchmark in (
+        SourceDatasetBenchmark,
+        AlignmentDatasetBenchmark,
+        ProjectionDataloaderBenchmark,
+        SentenceProjectionBenchmark,
+        DatasetProjectionBenchmark,
+        Conll2TextBenchmark,
+        Mgiza2FastalignBenchmark,
+        IOBBenchmark,
+        IOB2Benchmark,
+        BILOUBenchmark,
+    )
+}
+
+
+# Entry points that must start without the heavy and optional dependencies (LAZY_MODULES). They are loaded only
+# when a model is used (torch, transformers, simalign), a text is tokenized (spacy, psutil) or a compressed or
+# columnar file is written (zstandard, pyarrow). Each entry point is imported in a fresh interpreter.
+STARTUP_MODULES: List[str] = [
+    "annotation_projection",
+    "generate_alignments",
+    "projection.annotation_proyection",
+    "projection.api",
+    "projection.evaluate",
+    "projection.sentence_index",
+    "projection.sharding",
+    "projection.sweep",
+    "tokenization.conll2text",
+    "tokenization.tag_encoding",
+    "tokenization.tokenize_lines",
+]
+LAZY_MODULES: List[str] = [
+    "torch",
+    "transformers",
+    "simalign",
+    "spacy",
+    "psutil",
+    "zstandard",
+    "pyarrow",
+]
+STARTUP_SCRIPT: str = """
+import importlib, json, sys, time
+start_time = time.perf_counter()
+importlib.import_module(sys.argv[1])
+import_time = time.perf_counter() - start_time
+lazy_modules = [module for module in sys.argv[2:] if module in sys.modules]
+print(json.dumps({"import_time": import_time, "lazy_modules": lazy_modules}))
+"""
+
+
+def measure_startup(module: str, repeat: int) -> Dict:
+    """
+    Import time of a module in a fresh interpreter (the fastest of repeat runs) and the lazy modules that it imports.
+    """
+    import_times: List[float] = []
+    lazy_modules: List[str] = []
+    for _ in range(repeat):
+        process = subprocess.run(
+            [sys.executable, "-c", STARTUP_SCRIPT, module, *LAZY_MODULES],
+            cwd=REPO_DIR,
+            capture_output=True,
+            text=True,
+        )
+        if process.returncode != 0:
+            return {"error": process.stderr.strip().split("\n")[-1]}
+        measurement = json.loads(process.stdout.strip().split("\n")[-1])
+        import_times.append(measurement["import_time"])
+        lazy_modules = measurement["lazy_modules"]
+    return {"import_time": min(import_times), "lazy_modules": lazy_modules}
+
+
+def lazy_import_violations(results: Dict[str, Dict]) -> List[str]:
+    """
+    Return the startup benchmarks that import a lazy module. They are reported with or without a baseline.
+    """
+    return [
+        f"{key}: imports {', '.join(result['lazy_modules'])} at startup"
+        for key, result in results.items()
+        if result.get("lazy_modules")
+    ]
+
+
+def _run_stage(
+    stage: str,
+    paths: Dict[str, str],
+    batch_size: int,
+    repeat: int,
+    result_queue: multiprocessing.Queue,
+) -> None:
+    try:
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(
+            devnull
+        ), contextlib.redirect_stderr(devnull):
+            benchmark = BENCHMARKS[stage](paths, batch_size)
+            benchmark.setup()
+            wall_times: List[float] = []
+            for _ in range(repeat):
+                start_time = time.perf_counter()
+                num_sentences = benchmark.run()
+                wall_times.append(time.perf_counter() - start_time)
+
+        result_queue.put(
+            {
+                "sentences": num_sentences,
+                "wall_time": min(wall_times),
+                "sentences_per_second": num_sentences / max(min(wall_times), 1e-9),
+                "peak_rss_mb": peak_rss_mb(),
+            }
+        )
+    except Exception as e:
+        result_queue.put({"error": f"{type(e).__name__}: {e}"})
+        raise
+
+
+# Seconds between checks that the benchmark process is still running while we wait for its result
+RESULT_POLL_SECONDS: float = 1.0
+
+
+def run_stage(stage: str, paths: Dict[str, str], batch_size: int, repeat: int) -> Dict:
+    """
+    Run a benchmark in a fresh process, so the peak RSS is measured for this stage only.
+    """
+    context = multiprocessing.get_context("spawn")
+    result_queue = context.Queue()
+    process = context.Process(
+        target=_run_stage, args=(stage, paths, batch_size, repeat, result_queue)
+    )
+    process.start()
+    while True:
+        try:
+            result = result_queue.get(timeout=RESULT_POLL_SECONDS)
+            break
+        except queue.Empty:
+            if process.is_alive():
+                continue
+            # The process may have exited right after sending its result
+            try:
+                result = result_queue.get(timeout=RESULT_POLL_SECONDS)
+                break
+            except queue.Empty:
+                raise RuntimeError(
+                    f"Benchmark {stage} exited with code {process.exitcode} without a result "
+                    f"(a negative code is the signal that killed it, i.e. -9 by the OOM killer)."
+                )
+    process.join()
+    return result
+
+
+def compare_with_baseline(
+    results: Dict[str, Dict], baseline: Dict[str, Dict], threshold: float
+) -> List[str]:
+    """
+    Return the benchmarks that are slower (sentences/sec) or use more memory (peak RSS) than the baseline by more
+    than threshold (relative). For the startup benchmarks, the import time is compared.
+    """
+    regressions: List[str] = []
+    for key, result in results.items():
+        if key not in baseline or "error" in result or "error" in baseline[key]:
+            continue
+        reference = baseline[key]
+        if "import_time" in result:
+            if "import_time" in reference and result["import_time"] > reference[
+                "import_time"
+            ] * (1 + threshold):
+                regressions.append(
+                    f"{key}: {result['import_time'] * 1000:.1f} ms import time, "
+                    f"baseline {reference['import_time'] * 1000:.1f} ms"
+                )
+            continue
+        if result["sentences_per_second"] < reference["sentences_per_second"] * (
+            1 - threshold
+        ):
+            regressions.append(
+                f"{key}: {result['sentences_per_second']:.1f} sentences/sec, "
+                f"baseline {reference['sentences_per_second']:.1f} sentences/sec"
+            )
+        if result["peak_rss_mb"] > reference["peak_rss_mb"] * (1 + threshold):
+            regressions.append(
+                f"{key}: {result['peak_rss_mb']:.1f} MB peak RSS, "
+                f"baseline {reference['peak_rss_mb']:.1f} MB peak RSS"
+            )
+    return regressions
+
+
+def run_benchmarks(
+    datasets: List[str],
+    stages: List[str],
+    batch_size: int = 10000,
+    repeat: int = 3,
+    scale: int = 1,
+    baseline_path: Optional[str] = None,
+    threshold: float = 0.2,
+    save_baseline: bool = False,
+    output_path: Optional[str] = None,
+    startup: bool = True,
+) -> List[str]:
+    """
+    Run the benchmarks and compare them with the stored baseline.
+    :param List[str] datasets: Datasets to use (sample, data).
+    :param List[str] stages: Pipeline stages to benchmark.
+    :param int batch_size: Batch size of the projection stages.
+    :param int repeat: Number of runs of each benchmark, we report the fastest one.
+    :param int scale: Number of times the input files are replicated.
+    :param str baseline_path: Path to the baseline (json format).
+    :param float threshold: Relative slowdown (or memory increase) reported as a regression.
+    :param bool save_baseline: Store the results as the new baseline instead of comparing with it.
+    :param str output_path: If set, the results will be stored in this path (json format).
+    :param bool startup: Whether to measure the import time of the entry points (STARTUP_MODULES) and check that
+    they do not import the heavy and optional dependencies (LAZY_MODULES).
+    :return: List of regressions.
+    """
+    results: Dict[str, Dict] = {}
+    if startup:
+        for module in STARTUP_MODULES:
+            key = f"startup.{module}"
+            results[key] = measure_startup(module, repeat)
+            if "error" in results[key]:
+                print(f"{key:40}\tERROR {results[key]['error']}")
+            else:
+                print(
+                    f"{key:40}\t{results[key]['import_time'] * 1000:12.1f} ms import time\t"
+                    f"{', '.join(results[key]['lazy_modules']) or 'no lazy modules imported'}"
+                )
+
+    with tempfile.TemporaryDirectory() as workdir:
+        for dataset in datasets:
+            paths = prepare_dataset(dataset, workdir, scale)
+            for stage in stages:
+                key = f"{dataset}.{stage}"
+                results[key] = run_stage(stage, paths, batch_size, repeat)
+                if "error" in results[key]:
+                    print(f"{key:40}\tERROR {results[key]['error']}")
+                else:
+                    print(
+                        f"{key:40}\t{results[key]['sentences_per_second']:12.1f} sentences/sec\t"
+                        f"{results[key]['wall_time']:8.3f} s\t{results[key]['peak_rss_mb']:8.1f} MB"
+                    )
+
+    if output_path:
+        with open(output_path, "w", encoding="utf8") as output_file:
+            json.dump(results, output_file, indent=4)
+
+    regressions: List[str] = lazy_import_violations(results)
+    if regressions:
+        print("Lazy modules imported at startup:")
+        for regression in regressions:
+            print(f"  {regression}")
+
+    if baseline_path and save_baseline:
+        with open(baseline_path, "w", encoding="utf8") as baseline_file:
+            json.dump(results, baseline_file, indent=4)
+        print(f"Baseline stored in {baseline_path}")
+    elif baseline_path and os.path.exists(baseline_path):
+        with open(baseline_path, "r", encoding="utf8") as baseline_file:
+            baseline = json.load(baseline_file)
+        baseline_regressions = compare_with_baseline(results, baseline, threshold)
+        regressions.extend(baseline_regressions)
+        if baseline_regressions:
+            print(f"Regressions (threshold {threshold:.0%}):")
+            for regression in baseline_regressions:
+                print(f"  {regression}")
+        else:
+            print(f"No regressions (threshold {threshold:.0%}).")
+    elif baseline_path:
+        print(f"Baseline {baseline_path} not found. Use --save_baseline to create it.")
+
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark the projection and alignment pipeline"
+    )
+    parser.add_argument(
+        "--datasets",
+        type=str,
+        nargs="+",
+        default=list(DATASETS.keys()),
+        choices=list(DATASETS.keys()),
+        help="Datasets to use: sample (sample/ directory) and data (ABSA en2es train split in data/)",
+    )
+    parser.add_argument(
+        "--stages",
+        type=str,
+        nargs="+",
+        default=list(BENCHMARKS.keys()),
+        choices=list(BENCHMARKS.keys()),
+        help="Pipeline stages to benchmark",
+    )
+    parser.add_argument(
+        "--batch_size",
+        type=int,
+        default=10000,
+        help="Batch size of the projection stages",
+    )
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=3,
+        help="Number of runs of each benchmark, we report the fastest one",
+    )
+    parser.add_argument(
+        "--scale",
+        type=int,
+        default=1,
+        help="Replicate the input files scale times, use it to get more stable measurements",
+    )
+    parser.add_argument(
+        "--baseline_path",
+        type=str,
+        default=os.path.join(REPO_DIR, "benchmarks/baseline.json"),
+        help="Path to the baseline (json format)",
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.2,
+        help="Relative slowdown (or peak RSS increase) reported as a regression",
+    )
+    parser.add_argument(
+        "--save_baseline",
+        action="store_true",
+        help="Store the results as the new baseline",
+    )
+    parser.add_argument(
+        "--output_path",
+        type=str,
+        default=None,
+        help="If set, the results will be stored in this path (json format)",
+    )
+    parser.add_argument(
+        "--skip_startup",
+        action="store_true",
+        help="Do not measure the import time of the entry points",
+    )
+
+    args = parser.parse_args()
+
+    found_regressions = run_benchmarks(
+        datasets=args.datasets,
+        stages=args.stages,
+        batch_size=args.batch_size,
+        repeat=args.repeat,
+        scale=args.scale,
+        baseline_path=args.baseline_path,
+        threshold=args.threshold,
+        save_baseline=args.save_baseline,
+        output_path=args.output_path,
+        startup=not args.skip_startup,
+    )
+
+    sys.exit(1 if found_regressions else 0)
@@ -5,6 +5,7 @@ from fast_align.utils import (
     concatenate_files,
 )
 from fast_align.model_utils import align_corpus
+from projection.alignment_store import talp2binary
 import os
 import argparse
 from typing import List
@@ -22,6 +23,7 @@ def generate_word_alignments_fast_align(
     tmp_dir: str = None,
     remove_tmp_dir: bool = True,
     fast_align_dir="fast_align/fast_align/build",
+    binary_alignments: bool = False,
 ):
     if tmp_dir is None:
         tmp_dir = os.path.join(output_dir, f"tmp_dir_fastalign_{str(uuid.uuid4().hex)}")
@@ -103,6 +105,9 @@ def generate_word_alignments_fast_align(
 
             run_bash_command(command)
 
+            if binary_alignments:
+                talp2binary(output_name)
+
             current_line += file_len
 
     if remove_tmp_dir:
@@ -158,6 +163,12 @@ if __name__ == "__main__":
         help="Paths to the dataset augmentation corpus target sentences (one per line)",
     )
 
+    parser.add_argument(
+        "--binary_alignments",
+        action="store_true",
+        help="Also store the alignments in the binary format (.talpb), which can be loaded much faster",
+    )
+
     args = parser.parse_args()
 
     generate_word_alignments_fast_align(
@@ -167,4 +178,5 @@ if __name__ == "__main__":
         target_parallel_corpus=args.target_parallel_corpus,
         output_names=args.output_names,
         output_dir=args.output_dir,
+        binary_alignments=args.binary_alignments,
     )
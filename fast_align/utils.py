@@ -1,5 +1,6 @@
 import subprocess
 from typing import List
+from projection.compression import open_file
 
 
 def run_bash_command(command: str) -> None:
@@ -7,14 +8,14 @@ def run_bash_command(command: str) -> None:
 
 
 def count_lines(input_path: str) -> int:
-    with open(input_path, "r", encoding="utf8") as f:
+    with open_file(input_path) as f:
         return sum(1 for _ in f)
 
 
 def concatenate_files(input_paths: List[str], output_path: str) -> None:
-    with open(output_path, "w", encoding="utf8") as output_file:
+    with open_file(output_path, "w") as output_file:
         for input_path in input_paths:
-            with open(input_path, "r", encoding="utf8") as input_file:
+            with open_file(input_path) as input_file:
                 for line in input_file:
                     line = line.strip().rstrip()
                     if line != "":
@@ -32,9 +33,9 @@ def data2fastalign(
         f"{count_lines(source_path)} != {count_lines(target_path)}"
     )
 
-    with open(source_path, "r", encoding="utf8") as source_file, open(
-        target_path, "r", encoding="utf8"
-    ) as target_file, open(output_path, "w", encoding="utf8") as output_file:
+    with open_file(source_path) as source_file, open_file(
+        target_path
+    ) as target_file, open_file(output_path, "w") as output_file:
         for source_line, target_line in zip(source_file, target_file):
             source_line = source_line.strip().replace("\t", " ")
             target_line = target_line.strip().replace("\t", " ")
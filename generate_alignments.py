@@ -1,5 +1,10 @@
 import argparse
+import os
 from annotation_projection import generate_alignments
+from projection.alignment_cache import DEFAULT_CACHE_DIR, DEFAULT_CACHE_SIZE_GB
+from projection.sentence_alignment_cache import DEFAULT_SENTENCE_CACHE_PATH
+from projection.embedding_cache import DEFAULT_EMBEDDING_CACHE_SIZE_GB
+from projection.instrumentation import enable_run_report
 
 
 if __name__ == "__main__":
@@ -96,8 +101,76 @@ if __name__ == "__main__":
         help="Huggingface Hub model name or path to a local model",
     )
 
+    parser.add_argument(
+        "--binary_alignments",
+        action="store_true",
+        help="Also store the alignments in the binary format (.talpb), which can be loaded much faster",
+    )
+
+    parser.add_argument(
+        "--alignment_cache_dir",
+        default=DEFAULT_CACHE_DIR,
+        type=str,
+        help="Path to the alignment cache. Alignments that were already generated for the same sentences, "
+        "augmentation corpus, alignment method, model and parameters are taken from the cache instead of "
+        "generating them again. Defaults to the ALIGNMENT_CACHE_DIR environment variable or "
+        "~/.cache/easy_label_projection/alignments",
+    )
+
+    parser.add_argument(
+        "--alignment_cache_size",
+        default=DEFAULT_CACHE_SIZE_GB,
+        type=float,
+        help="Maximum size of the alignment cache in GB. The least recently used alignments are removed.",
+    )
+
+    parser.add_argument(
+        "--sentence_alignment_cache",
+        default=DEFAULT_SENTENCE_CACHE_PATH,
+        type=str,
+        help="Path to the sentence alignment cache (SQLite database) used by simalign. Sentence pairs that were "
+        "already aligned in any dataset are not aligned again. Defaults to the SENTENCE_ALIGNMENT_CACHE "
+        "environment variable or ~/.cache/easy_label_projection/sentence_alignments.sqlite",
+    )
+
+    parser.add_argument(
+        "--embedding_cache_dir",
+        default=None,
+        type=str,
+        help="Path to the embedding cache used by simalign. The embeddings of the sentences that are in the cache "
+        "are not computed again, the new ones are added to the cache. Disabled by default",
+    )
+
+    parser.add_argument(
+        "--embedding_cache_size",
+        default=DEFAULT_EMBEDDING_CACHE_SIZE_GB,
+        type=float,
+        help="Maximum size of the embedding cache in GB. The least recently used embeddings are removed.",
+    )
+
+    parser.add_argument(
+        "--no_alignment_cache",
+        action="store_true",
+        help="Do not use the alignment cache nor the sentence alignment cache.",
+    )
+
+    parser.add_argument(
+        "--run_report",
+        action="store_true",
+        help="Measure the time spent by each alignment method. The report is stored in "
+        "{output_dir}/{output_name}.alignments.run_report.json",
+    )
+
     args = parser.parse_args()
 
+    if args.run_report:
+        report = enable_run_report()
+
+    alignment_cache_dir = None if args.no_alignment_cache else args.alignment_cache_dir
+    sentence_alignment_cache = (
+        None if args.no_alignment_cache else args.sentence_alignment_cache
+    )
+
     generate_alignments(
         source_train=args.source_train,
         target_train=args.target_train,
@@ -115,4 +188,17 @@ if __name__ == "__main__":
         do_awesome=args.do_awesome,
         remove_awesome_model=args.remove_awesome_model,
         model_name_or_path=args.model_name_or_path,
+        binary_alignments=args.binary_alignments,
+        alignment_cache_dir=alignment_cache_dir,
+        alignment_cache_size=args.alignment_cache_size,
+        sentence_alignment_cache=sentence_alignment_cache,
+        embedding_cache_dir=args.embedding_cache_dir,
+        embedding_cache_size=args.embedding_cache_size,
     )
+
+    if args.run_report:
+        report.save(
+            os.path.join(
+                args.output_dir, f"{args.output_name}.alignments.run_report.json"
+            )
+        )
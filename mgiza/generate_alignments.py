@@ -2,6 +2,7 @@ import os
 from mgiza.utils import count_lines, run_bash_command, concatenate_files
 from typing import List
 from mgiza.model_utils import align_corpus
+from projection.alignment_store import talp2binary
 import argparse
 import shutil
 import uuid
@@ -17,6 +18,7 @@ def generate_word_alignments_mgiza(
     tmp_dir: str = None,
     remove_tmp_dir: bool = True,
     mgizapp_dir: str = "mgiza/mgiza/mgizapp",
+    binary_alignments: bool = False,
 ):
 
     if tmp_dir is None:
@@ -92,6 +94,9 @@ def generate_word_alignments_mgiza(
 
             run_bash_command(command)
 
+            if binary_alignments:
+                talp2binary(output_name)
+
             current_line += file_len
 
     if remove_tmp_dir:
@@ -147,6 +152,12 @@ if __name__ == "__main__":
         help="Paths to the dataset augmentation corpus target sentences (one per line)",
     )
 
+    parser.add_argument(
+        "--binary_alignments",
+        action="store_true",
+        help="Also store the alignments in the binary format (.talpb), which can be loaded much faster",
+    )
+
     args = parser.parse_args()
 
     generate_word_alignments_mgiza(
@@ -156,4 +167,5 @@ if __name__ == "__main__":
         target_parallel_corpus=args.target_parallel_corpus,
         output_names=args.output_names,
         output_dir=args.output_dir,
+        binary_alignments=args.binary_alignments,
     )
@@ -1,6 +1,7 @@
 from typing import List
 import re
 import subprocess
+from projection.compression import open_file
 
 
 def run_bash_command(command: str) -> None:
@@ -9,14 +10,14 @@ def run_bash_command(command: str) -> None:
 
 
 def count_lines(input_path: str) -> int:
-    with open(input_path, "r", encoding="utf8") as f:
+    with open_file(input_path) as f:
         return sum(1 for _ in f)
 
 
 def concatenate_files(input_paths: List[str], output_path: str) -> None:
-    with open(output_path, "w", encoding="utf8") as output_file:
+    with open_file(output_path, "w") as output_file:
         for input_path in input_paths:
-            with open(input_path, "r", encoding="utf8") as input_file:
+            with open_file(input_path) as input_file:
                 for line in input_file:
                     line = line.strip().rstrip()
                     if line != "":
@@ -24,8 +25,8 @@ def concatenate_files(input_paths: List[str], output_path: str) -> None:
 
 
 def mgiza2fastalign(input_path, output_path, reverse=False):
-    with open(input_path, "r", encoding="utf8") as input_file:
-        with open(output_path, "w+", encoding="utf8") as output_file:
+    with open_file(input_path) as input_file:
+        with open_file(output_path, "w+") as output_file:
             word_format = re.compile(r"[^ ]+ \({[0-9|\s]*}\)")
             line: str = input_file.readline()
             while line:
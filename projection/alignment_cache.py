@@ -0,0 +1,325 @@
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import socket
+import time
+from typing import Dict, List, Optional, Tuple
+
+from projection.alignment_store import binary_alignments_path, talp2binary
+
+# Content-addressed cache of word alignments. Each entry stores the talp file of a dataset split aligned with an
+# alignment method:
+#   {cache_dir}/{key}/alignments.talp
+#   {cache_dir}/{key}/entry.json   (description of the entry, for humans)
+# The key is the sha256 of the content of the sentences, the alignment method, its parameters and the model.
+# Methods that are trained on the whole corpus (mgiza, fast_align and awesome) also include the content of every
+# split and of the augmentation corpus in the key. The modification time of an entry is its last use, when the
+# cache is larger than its maximum size the least recently used entries are removed.
+
+CACHE_VERSION: int = 1
+DEFAULT_CACHE_DIR: str = os.environ.get(
+    "ALIGNMENT_CACHE_DIR",
+    os.path.join(
+        os.path.expanduser("~"), ".cache", "easy_label_projection", "alignments"
+    ),
+)
+DEFAULT_CACHE_SIZE_GB: float = 10.0
+
+ALIGNMENTS_FILENAME: str = "alignments.talp"
+ENTRY_FILENAME: str = "entry.json"
+
+# Directory of the code of each alignment method. The parameters of the methods are set in their model_utils.py
+# and config files, so the code is part of the key.
+METHOD_DIRS: Dict[str, str] = {
+    "mgiza": "mgiza",
+    "fast_align": "fast_align",
+    "simalign": "SimAlign",
+    "awesome": "awesome",
+}
+# Parameters of the alignments that are used in the projection
+METHOD_PARAMETERS: Dict[str, Dict] = {
+    "mgiza": {"symmetrization": "grow_diag_final-and"},
+    "fast_align": {"symmetrization": "grow_diag_final-and"},
+    "simalign": {"matching_method": "itermax", "token_type": "bpe"},
+    "awesome": {},
+}
+# Methods trained on all the splits and the augmentation corpus
+TRAINED_METHODS = {"mgiza", "fast_align", "awesome"}
+# Methods that use model_name_or_path
+MODEL_METHODS = {"simalign", "awesome"}
+
+_file_hashes: Dict[Tuple[str, int, int], str] = {}
+
+
+def file_hash(path: str, block_size: int = 1 << 24) -> str:
+    """
+    sha256 of the content of a file. Hashes are memoized by (path, size, mtime), so each file is read only once
+    even if it is used by several alignment methods.
+    """
+    stat = os.stat(path)
+    memo_key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    if memo_key not in _file_hashes:
+        sha256 = hashlib.sha256()
+        with open(path, "rb") as file:
+            for block in iter(lambda: file.read(block_size), b""):
+                sha256.update(block)
+        _file_hashes[memo_key] = sha256.hexdigest()
+    return _file_hashes[memo_key]
+
+
+def method_code_hash(alignment_method: str) -> str:
+    method_dir = os.path.join(
+        os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        METHOD_DIRS[alignment_method],
+    )
+    sha256 = hashlib.sha256()
+    for filename in sorted(os.listdir(method_dir)):
+        if filename.endswith(".py"):
+            sha256.update(filename.encode("utf8"))
+            sha256.update(file_hash(os.path.join(method_dir, filename)).encode("utf8"))
+    return sha256.hexdigest()
+
+
+def alignment_cache_keys(
+    alignment_method: str,
+    source_paths: List[str],
+    target_paths: List[str],
+    source_augmentation: Optional[str] = None,
+    target_augmentation: Optional[str] = None,
+    model_name_or_path: Optional[str] = None,
+) -> List[str]:
+    """
+    Cache key of the alignments of each (source, target) split.
+    :param str alignment_method: Alignment method [mgiza, fast_align, simalign, awesome].
+    :param List[str] source_paths: Source sentences of each split (txt format).
+    :param List[str] target_paths: Target sentences of each split (txt format).
+    :param str source_augmentation: Source augmentation corpus, used to train mgiza, fast_align and awesome.
+    :param str target_augmentation: Target augmentation corpus, used to train mgiza, fast_align and awesome.
+    :param str model_name_or_path: Model used by simalign and awesome.
+    :return: A key for each split.
+    """
+    if alignment_method not in METHOD_DIRS:
+        raise ValueError(f"{alignment_method} not supported")
+
+    description: Dict = {
+        "version": CACHE_VERSION,
+        "method": alignment_method,
+        "parameters": METHOD_PARAMETERS[alignment_method],
+        "code": method_code_hash(alignment_method),
+    }
+    if alignment_method in MODEL_METHODS:
+        description["model_name_or_path"] = model_name_or_path
+    if alignment_method in TRAINED_METHODS:
+        description["corpus"] = [
+            [file_hash(source_path), file_hash(target_path)]
+            for source_path, target_path in zip(source_paths, target_paths)
+        ]
+        if source_augmentation:
+            description["augmentation"] = [
+                file_hash(source_augmentation),
+                file_hash(target_augmentation),
+            ]
+
+    return [
+        hashlib.sha256(
+            json.dumps(
+                {
+                    **description,
+                    "source": file_hash(source_path),
+                    "target": file_hash(target_path),
+                },
+                sort_keys=True,
+            ).encode("utf8")
+        ).hexdigest()
+        for source_path, target_path in zip(source_paths, target_paths)
+    ]
+
+
+def same_size_and_mtime(path: str, other_path: str) -> bool:
+    """
+    Whether both files exist and have the same size and modification time.
+    """
+    if not os.path.exists(other_path):
+        return False
+    stat, other_stat = os.stat(path), os.stat(other_path)
+    return (stat.st_size, stat.st_mtime_ns) == (
+        other_stat.st_size,
+        other_stat.st_mtime_ns,
+    )
+
+
+class AlignmentCache:
+    """
+    Shared directory with the alignments generated by every run, indexed by alignment_cache_keys. The cache can be
+    shared by several projects and machines: entries are written to a temporary directory and atomically renamed.
+    """
+
+    def __init__(
+        self,
+        cache_dir: str = DEFAULT_CACHE_DIR,
+        max_size_gb: float = DEFAULT_CACHE_SIZE_GB,
+    ):
+        self.cache_dir = cache_dir
+        self.max_size: int = int(max_size_gb * 1024**3)
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def entry_dir(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key)
+
+    def restore(
+        self, keys: List[str], output_paths: List[str], binary_alignments: bool = False
+    ) -> bool:
+        """
+        Copy the cached alignments of every key to its output path. Returns False (and copies nothing) unless
+        all the keys are in the cache.
+        :param List[str] keys: Cache keys.
+        :param List[str] output_paths: Path of the talp file of each key.
+        :param bool binary_alignments: Also store the alignments in the binary format (.talpb).
+        """
+        if not all(
+            os.path.exists(os.path.join(self.entry_dir(key), ALIGNMENTS_FILENAME))
+            for key in keys
+        ):
+            return False
+
+        # Output paths whose alignments were replaced, their binary alignments have to be converted again
+        replaced_paths: List[str] = []
+        try:
+            for key, output_path in zip(keys, output_paths):
+                cached_path: str = os.path.join(
+                    self.entry_dir(key), ALIGNMENTS_FILENAME
+                )
+                # copy2 keeps the modification time, so a projection checkpoint is still valid after the
+                # alignments are restored again
+                if not same_size_and_mtime(cached_path, output_path):
+                    shutil.copy2(cached_path, output_path)
+                    replaced_paths.append(output_path)
+                # Mark the entry as recently used
+                os.utime(self.entry_dir(key))
+                print(f"Alignments {output_path} restored from the cache ({key}).")
+        except OSError:
+            # The entry was evicted by another process while we were copying it
+            return False
+
+        if binary_alignments:
+            for output_path in output_paths:
+                # Only convert when needed: rewriting the binary alignments changes their modification time and
+                # invalidates the projection checkpoints that use them
+                binary_path: str = binary_alignments_path(output_path)
+                if (
+                    output_path in replaced_paths
+                    or not os.path.exists(binary_path)
+                    or os.stat(binary_path).st_mtime_ns
+                    < os.stat(output_path).st_mtime_ns
+                ):
+                    talp2binary(output_path)
+
+        return True
+
+    def store(self, keys: List[str], alignments_paths: List[str], description: Dict):
+        """
+        Add the alignments of every key to the cache and remove the least recently used entries if the cache is
+        larger than its maximum size.
+        """
+        for key, alignments_path in zip(keys, alignments_paths):
+            if os.path.exists(self.entry_dir(key)):
+                os.utime(self.entry_dir(key))
+                continue
+
+            tmp_dir: str = (
+                f"{self.entry_dir(key)}.{socket.gethostname()}.{os.getpid()}.tmp"
+            )
+            os.makedirs(tmp_dir, exist_ok=True)
+            shutil.copy2(alignments_path, os.path.join(tmp_dir, ALIGNMENTS_FILENAME))
+            with open(
+                os.path.join(tmp_dir, ENTRY_FILENAME), "w", encoding="utf8"
+            ) as entry_file:
+                json.dump(
+                    {
+                        **description,
+                        "alignments_path": os.path.abspath(alignments_path),
+                        "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+                    },
+                    entry_file,
+                    indent=4,
+                )
+            try:
+                os.rename(tmp_dir, self.entry_dir(key))
+            except OSError:
+                # Another process stored the same entry
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+
+        self.evict(keep=keys)
+
+    def entries(self) -> List[Tuple[float, int, str]]:
+        """
+        (last use, size in bytes, key) of every entry in the cache.
+        """
+        entries: List[Tuple[float, int, str]] = []
+        for key in os.listdir(self.cache_dir):
+            entry_dir = self.entry_dir(key)
+            if key.endswith(".tmp") or not os.path.isdir(entry_dir):
+                continue
+            try:
+                entries.append(
+                    (
+                        os.path.getmtime(entry_dir),
+                        sum(
+                            os.path.getsize(os.path.join(entry_dir, filename))
+                            for filename in os.listdir(entry_dir)
+                        ),
+                        key,
+                    )
+                )
+            except OSError:
+                continue
+        return entries
+
+    def size(self) -> int:
+        return sum(size for _, size, _ in self.entries())
+
+    def evict(self, keep: Optional[List[str]] = None) -> None:
+        """
+        Remove the least recently used entries until the cache is smaller than its maximum size. The entries in
+        keep are never removed.
+        """
+        keep = set(keep) if keep else set()
+        entries = sorted(self.entries())
+        cache_size: int = sum(size for _, size, _ in entries)
+        for _, size, key in entries:
+            if cache_size <= self.max_size:
+                break
+            if key in keep:
+                continue
+            shutil.rmtree(self.entry_dir(key), ignore_errors=True)
+            cache_size -= size
+            print(f"Alignment cache entry {key} evicted ({size / 1024**2:.1f} MB).")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Show the size of the alignment cache and remove the least recently used entries"
+    )
+    parser.add_argument(
+        "--cache_dir",
+        type=str,
+        default=DEFAULT_CACHE_DIR,
+        help="Path to the alignment cache directory",
+    )
+    parser.add_argument(
+        "--max_size_gb",
+        type=float,
+        default=DEFAULT_CACHE_SIZE_GB,
+        help="Maximum size of the cache in GB, the least recently used entries are removed",
+    )
+
+    args = parser.parse_args()
+
+    alignment_cache = AlignmentCache(args.cache_dir, args.max_size_gb)
+    alignment_cache.evict()
+    print(
+        f"{args.cache_dir}: {len(alignment_cache.entries())} entries, "
+        f"{alignment_cache.size() / 1024**3:.2f} GB"
+    )
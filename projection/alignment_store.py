@@ -0,0 +1,251 @@
+import argparse
+import os
+import struct
+from typing import Dict, Iterable, Iterator, List, Tuple
+
+import numpy as np
+
+from projection.compression import open_file, split_compression_extension
+
+# Binary alignment format (little endian):
+#   header:  magic (8 bytes) | version (uint64) | num_sentences (uint64) | num_pairs (uint64)
+#   pairs:   int32[num_pairs, 2], the (source, target) word ids of every alignment, sentence after sentence
+#   offsets: int64[num_sentences + 1], the alignments of sentence i are pairs[offsets[i]:offsets[i + 1]]
+
+MAGIC: bytes = b"TALPBIN\x00"
+VERSION: int = 1
+HEADER_FORMAT: str = "<8sQQQ"
+HEADER_SIZE: int = struct.calcsize(HEADER_FORMAT)
+BINARY_EXTENSION: str = ".talpb"
+
+
+def binary_alignments_path(talp_path: str) -> str:
+    """
+    Path of the binary alignment file corresponding to a talp file.
+    """
+    return (
+        os.path.splitext(split_compression_extension(talp_path)[0])[0]
+        + BINARY_EXTENSION
+    )
+
+
+def is_binary_alignments(path: str) -> bool:
+    return path.endswith(BINARY_EXTENSION)
+
+
+def parse_talp_line(alignment: str) -> List[Tuple[int, int]]:
+    pairs: List[Tuple[int, int]] = []
+    for pair in alignment.rstrip().strip().split():
+        try:
+            source, target = pair.split("-")
+            pairs.append((int(source), int(target)))
+        except ValueError:
+            raise ValueError(
+                f"Unable to split pair {pair} from alignment line: {alignment}."
+            )
+    return pairs
+
+
+class BinaryAlignmentsWriter:
+    """
+    Write alignments in the binary format, one sentence at a time. Pairs are buffered and written in blocks,
+    the offset table and the header are written when the writer is closed.
+    """
+
+    def __init__(self, output_path: str, block_size: int = 65536):
+        self.output_path = output_path
+        self.block_size = block_size
+        self.offsets: List[int] = [0]
+        self.block: List[int] = []
+        self.output_file = open(f"{output_path}.tmp", "wb")
+        self.output_file.write(struct.pack(HEADER_FORMAT, MAGIC, VERSION, 0, 0))
+
+    def write(self, pairs: Iterable[Tuple[int, int]]) -> None:
+        num_pairs: int = 0
+        for source, target in pairs:
+            self.block.append(source)
+            self.block.append(target)
+            num_pairs += 1
+        self.offsets.append(self.offsets[-1] + num_pairs)
+
+        if len(self.block) >= 2 * self.block_size:
+            self.flush()
+
+    def flush(self) -> None:
+        self.output_file.write(np.asarray(self.block, dtype="<i4").tobytes())
+        self.block = []
+
+    def close(self) -> None:
+        self.flush()
+        self.output_file.write(np.asarray(self.offsets, dtype="<i8").tobytes())
+        self.output_file.seek(0)
+        self.output_file.write(
+            struct.pack(
+                HEADER_FORMAT, MAGIC, VERSION, len(self.offsets) - 1, self.offsets[-1]
+            )
+        )
+        self.output_file.close()
+        os.replace(f"{self.output_path}.tmp", self.output_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.output_file.close()
+            os.remove(f"{self.output_path}.tmp")
+
+
+class BinaryAlignments:
+    """
+    Read-only, memory-mapped access to a binary alignment file. Getting the alignments of a sentence is O(1) and
+    returns views of the mapped file (no copy).
+    """
+
+    def __init__(self, filename: str):
+        self.filename = filename
+        with open(filename, "rb") as binary_file:
+            header = binary_file.read(HEADER_SIZE)
+        if len(header) != HEADER_SIZE:
+            raise ValueError(f"{filename} is not a binary alignment file.")
+        magic, version, self.num_sentences, self.num_pairs = struct.unpack(
+            HEADER_FORMAT, header
+        )
+        if magic != MAGIC:
+            raise ValueError(f"{filename} is not a binary alignment file.")
+        if version != VERSION:
+            raise ValueError(
+                f"Unsupported binary alignment version {version} in {filename}. Supported version: {VERSION}"
+            )
+
+        if self.num_pairs:
+            self.pairs = np.memmap(
+                filename,
+                dtype="<i4",
+                mode="r",
+                offset=HEADER_SIZE,
+                shape=(self.num_pairs, 2),
+            )
+        else:
+            self.pairs = np.zeros((0, 2), dtype="<i4")
+
+        self.offsets = np.memmap(
+            filename,
+            dtype="<i8",
+            mode="r",
+            offset=HEADER_SIZE + self.num_pairs * 8,
+            shape=(self.num_sentences + 1,),
+        )
+
+    def __len__(self) -> int:
+        return self.num_sentences
+
+    def __getitem__(self, index: int) -> np.ndarray:
+        """
+        Alignments of a sentence, an int32 array of shape [num_pairs, 2] with the (source, target) word ids.
+        """
+        if index < 0:
+            index += self.num_sentences
+        if not 0 <= index < self.num_sentences:
+            raise IndexError(
+                f"Sentence {index} out of range. {self.filename} has {self.num_sentences} sentences."
+            )
+        return self.pairs[self.offsets[index] : self.offsets[index + 1]]
+
+    @property
+    def sources(self) -> np.ndarray:
+        return self.pairs[:, 0]
+
+    @property
+    def targets(self) -> np.ndarray:
+        return self.pairs[:, 1]
+
+    def get_dictionary(self, index: int) -> Dict[int, List[int]]:
+        return pairs2dictionary(self[index].tolist())
+
+    def iter_dictionaries(
+        self, start: int = 0, block_size: int = 10000
+    ) -> Iterator[Dict[int, List[int]]]:
+        """
+        Iterate over the alignments of each sentence as {source: [targets]} dictionaries. The pairs are read in blocks
+        of block_size sentences.
+        """
+        for block_start in range(start, self.num_sentences, block_size):
+            block_end: int = min(block_start + block_size, self.num_sentences)
+            block_offsets = self.offsets[block_start : block_end + 1]
+            sources: List[int] = self.pairs[
+                block_offsets[0] : block_offsets[-1], 0
+            ].tolist()
+            targets: List[int] = self.pairs[
+                block_offsets[0] : block_offsets[-1], 1
+            ].tolist()
+            offsets: List[int] = (block_offsets - block_offsets[0]).tolist()
+            for sentence_start, sentence_end in zip(offsets[:-1], offsets[1:]):
+                yield pairs2dictionary(
+                    zip(
+                        sources[sentence_start:sentence_end],
+                        targets[sentence_start:sentence_end],
+                    )
+                )
+
+
+def pairs2dictionary(pairs: Iterable[Tuple[int, int]]) -> Dict[int, List[int]]:
+    alignment_dictionary: Dict[int, List[int]] = {}
+    for source, target in pairs:
+        if source in alignment_dictionary:
+            alignment_dictionary[source].append(target)
+        else:
+            alignment_dictionary[source] = [target]
+    return alignment_dictionary
+
+
+def talp2binary(talp_path: str, output_path: str = None) -> str:
+    """
+    Convert a talp alignment file (one sentence per line, "i-j" pairs) into the binary alignment format.
+    :param str talp_path: Path to the talp file.
+    :param str output_path: Path to the output binary file. By default, the talp path with the .talpb extension.
+    :return: Path to the output binary file.
+    """
+    if output_path is None:
+        output_path = binary_alignments_path(talp_path)
+
+    with open_file(talp_path) as talp_file, BinaryAlignmentsWriter(
+        output_path
+    ) as writer:
+        for alignment in talp_file:
+            writer.write(parse_talp_line(alignment))
+
+    return output_path
+
+
+def binary2talp(binary_path: str, output_path: str) -> None:
+    """
+    Convert a binary alignment file back into the talp format.
+    """
+    alignments = BinaryAlignments(binary_path)
+    with open_file(output_path, "w") as output_file:
+        for sentence_no in range(len(alignments)):
+            print(
+                " ".join(f"{s}-{t}" for s, t in alignments[sentence_no].tolist()),
+                file=output_file,
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Convert talp alignment files into the binary alignment format"
+    )
+    parser.add_argument(
+        "--talp_paths",
+        type=str,
+        required=True,
+        nargs="+",
+        help="Paths to the talp alignment files. The binary files will be stored with the .talpb extension",
+    )
+
+    args = parser.parse_args()
+
+    for talp_path in args.talp_paths:
+        print(f"{talp_path} => {talp2binary(talp_path)}")
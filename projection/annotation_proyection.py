@@ -1,9 +1,22 @@
 import multiprocessing
+from multiprocessing.pool import AsyncResult
 import os
-from typing import List, Dict
-from projection.dataset import ProjectionDataloader
+import time
+from contextlib import ExitStack
+from collections import Counter
+from typing import List, Dict, Callable, Optional, Tuple, Union
+from projection.checkpoint import (
+    checkpoint_state,
+    get_checkpoint_path,
+    load_checkpoint,
+    save_checkpoint,
+)
+from projection.columnar import ColumnarWriter, is_columnar, source_tag_vocabulary
+from projection.compression import is_compressed, open_file
+from projection.dataset import MultiProjectionDataloader
+from projection.instrumentation import get_run_report
+from projection.span_statistics import SpanStatistics
 import math
-from tqdm.auto import tqdm
 import string
 from functools import partial
 
@@ -18,6 +31,51 @@ def batch(iterable, n=1) -> iter:
         yield iterable[ndx : min(ndx + p, l)]
 
 
+def fix_collisions(
+    target_tags_ids: List[List[int]], target_tags_types: List[str]
+) -> None:
+    """
+    Resolve the collisions between consecutive projected tags. The lists are modified in place.
+    First, colliding tags of the same type are merged. Then, if two tags still collide, we keep the largest one.
+    :param List[List[int]] target_tags_ids: Sorted target word ids of each projected tag.
+    :param List[str] target_tags_types: Type of each projected tag.
+    """
+
+    # FIX COLLISIONS
+    # MERGE SAME TYPE TAGS
+
+    i = 0
+    while i < len(target_tags_ids) - 1:
+        if target_tags_ids[i][-1] >= target_tags_ids[i + 1][0]:
+
+            if target_tags_types[i] == target_tags_types[i + 1]:
+                target_tags_ids[i] = sorted(
+                    list(set(target_tags_ids[i] + target_tags_ids[i + 1]))
+                )
+
+                del target_tags_ids[i + 1]
+                del target_tags_types[i + 1]
+
+            else:
+                i += 1
+        else:
+            i += 1
+
+    # GET LARGEST TAG IF COLLISION
+    i = 0
+    while i < len(target_tags_ids) - 1:
+        if target_tags_ids[i][-1] >= target_tags_ids[i + 1][0]:
+            if len(target_tags_ids[i]) > len(target_tags_ids[i + 1]):
+                del target_tags_types[i + 1]
+                del target_tags_ids[i + 1]
+            else:
+                del target_tags_types[i]
+                del target_tags_ids[i]
+
+        else:
+            i += 1
+
+
 def sentence_projection(
     source_words: List[str],
     source_tags_type: List[str],
@@ -31,6 +89,8 @@ def sentence_projection(
     # less or equal than fill_gap_size.  Else we will choose the largest label and remove the other part.
     # Use True 1 if you are projection named entities or labels with a small number of words.
     # Use a larger value for argumentation datasets and datasets in which the labels are long sentences.
+    counters: Optional[Counter] = None,  # If provided, we add the number of source
+    # spans, dropped spans and punctuation removals to it.
 ) -> List[str]:
 
     assert len(source_tags_type) == len(source_tags_ids)
@@ -84,6 +144,8 @@ def sentence_projection(
                 if all([char in puncs for char in tword]):
                     # print(f"Warning: Removing word: {tword} from projected tag. ")
                     del target_tags_ids[target_tag_idx][tag_idx]
+                    if counters is not None:
+                        counters["punctuation_removals"] += 1
 
             if len(target_tags_ids[target_tag_idx]) == 0:
                 del target_tags_ids[target_tag_idx]
@@ -122,39 +184,11 @@ def sentence_projection(
 
         target_tags_ids[target_tag_no] = max(groups, key=len)
 
-    # FIX COLLISIONS
-    # MERGE SAME TYPE TAGS
-
-    i = 0
-    while i < len(target_tags_ids) - 1:
-        if target_tags_ids[i][-1] >= target_tags_ids[i + 1][0]:
-
-            if target_tags_types[i] == target_tags_types[i + 1]:
-                target_tags_ids[i] = sorted(
-                    list(set(target_tags_ids[i] + target_tags_ids[i + 1]))
-                )
-
-                del target_tags_ids[i + 1]
-                del target_tags_types[i + 1]
+    fix_collisions(target_tags_ids, target_tags_types)
 
-            else:
-                i += 1
-        else:
-            i += 1
-
-    # GET LARGEST TAG IF COLLISION
-    i = 0
-    while i < len(target_tags_ids) - 1:
-        if target_tags_ids[i][-1] >= target_tags_ids[i + 1][0]:
-            if len(target_tags_ids[i]) > len(target_tags_ids[i + 1]):
-                del target_tags_types[i + 1]
-                del target_tags_ids[i + 1]
-            else:
-                del target_tags_types[i]
-                del target_tags_ids[i]
-
-        else:
-            i += 1
+    if counters is not None:
+        counters["source_spans"] += len(source_tags_ids)
+        counters["dropped_spans"] += len(source_tags_ids) - len(target_tags_ids)
 
     # WRITE TAGS
 
@@ -186,7 +220,13 @@ def sentences_projection(
     alignments: List[Dict],
     remove_puncs: bool = True,
     fill_gap_size: int = 1,
-) -> str:
+    return_counters: bool = False,
+) -> Union[str, Tuple[str, Counter]]:
+    """
+    Project the labels of a batch of sentences. Returns the projected sentences in tsv format. If return_counters
+    is set, returns a tuple with the projected sentences and the counters of the batch (sentences, empty sentences,
+    source spans, dropped spans and punctuation removals).
+    """
 
     assert (
         len(sources_words)
@@ -207,6 +247,7 @@ def sentences_projection(
     )
 
     output: List[str] = []
+    counters: Optional[Counter] = Counter() if return_counters else None
 
     for (
         source_words,
@@ -226,6 +267,7 @@ def sentences_projection(
                 alignments=alignments,
                 remove_puncs=remove_puncs,
                 fill_gap_size=fill_gap_size,
+                counters=counters,
             )
 
             assert len(target_words) == len(target_tags)
@@ -238,10 +280,87 @@ def sentences_projection(
             print(
                 f"Warning, empty sentence found. source_words: {source_words}. target_words: {target_words}"
             )
+            if counters is not None:
+                counters["empty_sentences"] += 1
+
+    if counters is not None:
+        counters["sentences"] += len(sources_words)
+        return "\n\n".join(output), counters
 
     return "\n\n".join(output)
 
 
+class ProjectionPool:
+    """
+    Long-lived pool of worker processes used to project batches of sentences.
+    The pool is created once and reused for every batch (and every dataset if it is shared between
+    dataset_projection calls), so we do not pay the process spawn/teardown cost for each batch.
+    """
+
+    def __init__(self, num_workers: Optional[int] = None):
+        self.num_workers: int = num_workers if num_workers else os.cpu_count()
+        self.pool = multiprocessing.Pool(self.num_workers)
+
+    def project_async(
+        self,
+        projection_function: Callable,
+        source_words: List[List[str]],
+        tags_type: List[List[str]],
+        tags_ids: List[List[List[int]]],
+        target_words: List[List[str]],
+        alignment_dictionary: List[Dict],
+    ) -> AsyncResult:
+        return self.pool.starmap_async(
+            projection_function,
+            zip(
+                batch(source_words, n=self.num_workers),
+                batch(tags_type, n=self.num_workers),
+                batch(tags_ids, n=self.num_workers),
+                batch(target_words, n=self.num_workers),
+                batch(alignment_dictionary, n=self.num_workers),
+            ),
+        )
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.pool.terminate()
+            self.pool.join()
+
+
+def get_projection_function(
+    projection_engine: str,
+    remove_puncs: bool,
+    fill_gap_size: int,
+    return_counters: bool = False,
+) -> Callable:
+    if projection_engine == "python":
+        projection_base_function = sentences_projection
+    elif projection_engine == "numpy":
+        from projection.vectorized_projection import sentences_projection_vectorized
+
+        projection_base_function = sentences_projection_vectorized
+    else:
+        raise ValueError(
+            f"Projection engine {projection_engine} not supported. Supported engines: [python, numpy]"
+        )
+
+    return partial(
+        projection_base_function,
+        remove_puncs=remove_puncs,
+        fill_gap_size=fill_gap_size,
+        return_counters=return_counters,
+    )
+
+
 def dataset_projection(
     source_dataset: str,
     target_sentences: str,
@@ -250,7 +369,14 @@ def dataset_projection(
     output_path: str,
     remove_puncs: bool = True,
     fill_gap_size: int = 1,
+    projection_pool: Optional[ProjectionPool] = None,
+    projection_engine: str = "python",
+    resume: bool = False,
 ):
+    """
+    Project the labels of a dataset. The progress is stored in {output_path}.checkpoint.json after each batch,
+    if resume is set and the checkpoint exists, an interrupted projection continues where it stopped.
+    """
     print(
         f"Datset projection:\n"
         f"Source dataset: {source_dataset}.\n"
@@ -260,76 +386,320 @@ def dataset_projection(
         f"output_path:{output_path}.\n"
         f"remove_puncs: {remove_puncs}.\n"
         f"fill_gap_size: {fill_gap_size}.\n"
+        f"projection_engine: {projection_engine}.\n"
     )
 
-    os.makedirs(os.path.abspath(os.path.dirname(output_path)), exist_ok=True)
+    projection_function = get_projection_function(
+        projection_engine=projection_engine,
+        remove_puncs=remove_puncs,
+        fill_gap_size=fill_gap_size,
+        return_counters=get_run_report().enabled,
+    )
 
-    data_loader = ProjectionDataloader(
-        source_tsv=source_dataset,
-        target_txt=target_sentences,
-        alignments_talp=alignments_path,
+    project_alignments(
+        source_dataset=source_dataset,
+        target_sentences=target_sentences,
+        alignments_paths=[alignments_path],
         batch_size=batch_size,
+        output_paths=[output_path],
+        projection_functions=[projection_function],
+        alignment_ids=[0],
+        projection_pool=projection_pool,
+        checkpoint_path=get_checkpoint_path(output_path),
+        resume=resume,
     )
-    data_loader_len = len(data_loader)
 
-    data_loader = iter(data_loader)
 
-    source_words, tags_type, tags_ids, target_words, alignment_dictionary = next(
-        data_loader
+def multi_dataset_projection(
+    source_dataset: str,
+    target_sentences: str,
+    alignments_paths: List[str],
+    batch_size: int,
+    output_paths: List[str],
+    remove_puncs: bool = True,
+    fill_gap_size: int = 1,
+    projection_pool: Optional[ProjectionPool] = None,
+    projection_engine: str = "python",
+    resume: bool = False,
+):
+    """
+    Project the labels of a dataset using several alignment files (i.e. one per alignment method) in a single pass.
+    The source dataset and the target sentences are read only once, the alignment files are read in lockstep and
+    an output file is written for each alignment file. The progress is stored in the checkpoint of the first output
+    path ({output_paths[0]}.checkpoint.json), see dataset_projection.
+    """
+    assert len(alignments_paths) == len(output_paths), (
+        f"Number of alignment paths and output paths should be the same. "
+        f"alignments_paths: {alignments_paths}. output_paths: {output_paths}"
     )
 
-    projections = []
+    print(
+        f"Multi-alignment dataset projection:\n"
+        f"Source dataset: {source_dataset}.\n"
+        f"Target_sentences: {target_sentences}.\n"
+        f"alignments_paths: {alignments_paths}.\n"
+        f"batch_size: {batch_size}.\n"
+        f"output_paths:{output_paths}.\n"
+        f"remove_puncs: {remove_puncs}.\n"
+        f"fill_gap_size: {fill_gap_size}.\n"
+        f"projection_engine: {projection_engine}.\n"
+    )
 
-    projection_function = partial(
-        sentences_projection, remove_puncs=remove_puncs, fill_gap_size=fill_gap_size
+    projection_function = get_projection_function(
+        projection_engine=projection_engine,
+        remove_puncs=remove_puncs,
+        fill_gap_size=fill_gap_size,
+        return_counters=get_run_report().enabled,
     )
 
-    with open(output_path, "w+", encoding="utf8") as output_file, tqdm(
-        total=data_loader_len, desc="Annotation projection"
-    ) as pbar:
-        while (
-            source_words
-            and tags_type
-            and tags_ids
-            and target_words
-            and alignment_dictionary
-        ):
-            with multiprocessing.Pool(os.cpu_count()) as pool:
-
-                async_job = pool.starmap_async(
-                    projection_function,
-                    zip(
-                        batch(source_words, n=os.cpu_count()),
-                        batch(tags_type, n=os.cpu_count()),
-                        batch(tags_ids, n=os.cpu_count()),
-                        batch(target_words, n=os.cpu_count()),
-                        batch(alignment_dictionary, n=os.cpu_count()),
-                    ),
-                )
+    project_alignments(
+        source_dataset=source_dataset,
+        target_sentences=target_sentences,
+        alignments_paths=alignments_paths,
+        batch_size=batch_size,
+        output_paths=output_paths,
+        projection_functions=[projection_function] * len(alignments_paths),
+        alignment_ids=list(range(len(alignments_paths))),
+        projection_pool=projection_pool,
+        checkpoint_path=get_checkpoint_path(output_paths[0]),
+        resume=resume,
+    )
 
-                if projections:
-                    print("\n\n".join(projections), file=output_file)
-                    print(file=output_file)
 
-                pbar.update(1)
+def project_alignments(
+    source_dataset: str,
+    target_sentences: str,
+    alignments_paths: List[str],
+    batch_size: int,
+    output_paths: List[str],
+    projection_functions: List[Callable],
+    alignment_ids: List[int],
+    projection_pool: Optional[ProjectionPool],
+    span_statistics: Optional[List[SpanStatistics]] = None,
+    start: int = 0,
+    end: Optional[int] = None,
+    checkpoint_path: Optional[str] = None,
+    resume: bool = False,
+):
+    """
+    Read the dataset once and run a projection job for every output file on each batch. Job i projects the batch
+    using projection_functions[i] and the alignments in alignments_paths[alignment_ids[i]], and writes the
+    result to output_paths[i]. If span_statistics is provided, span_statistics[i] is updated with the output of job i.
+    If start and end are provided, only the sentences in the [start, end) range are projected.
+    If the run report is enabled, the projection functions must return their counters (return_counters=True), they
+    are added to the report in a section per output file.
+    If checkpoint_path is provided, the progress of the run is stored in it after each batch and removed when the run
+    finishes. If resume is set and the checkpoint belongs to the same run, the outputs are truncated to the
+    checkpoint and the projection continues from the first sentence that was not written (the span statistics
+    and the counters only include the sentences projected by this run).
+    Output paths with the .arrow or .parquet extension are written in a columnar format (see projection.columnar).
+    Columnar files cannot be truncated and appended to, checkpoints are disabled if any output is columnar.
+    """
+    assert len(projection_functions) == len(alignment_ids) == len(output_paths), (
+        f"Number of projection functions, alignment ids and output paths should be the same. "
+        f"projection_functions: {len(projection_functions)}. alignment_ids: {len(alignment_ids)}. "
+        f"output_paths: {len(output_paths)}"
+    )
 
-                try:
-                    (
+    report = get_run_report()
+
+    for output_path in output_paths:
+        os.makedirs(os.path.abspath(os.path.dirname(output_path)), exist_ok=True)
+
+    tag_vocabulary: Optional[List[str]] = None
+    if any(is_columnar(output_path) for output_path in output_paths):
+        tag_vocabulary = source_tag_vocabulary(source_dataset)
+        if checkpoint_path is not None:
+            print(
+                "Warning, columnar outputs cannot be resumed. The projection will not be checkpointed."
+            )
+            checkpoint_path = None
+
+    state: Optional[Dict] = None
+    checkpoint: Optional[Dict] = None
+    if checkpoint_path is not None:
+        state = checkpoint_state(
+            source_dataset=source_dataset,
+            target_sentences=target_sentences,
+            alignments_paths=alignments_paths,
+            output_paths=output_paths,
+            projection_functions=projection_functions,
+            alignment_ids=alignment_ids,
+            start=start,
+            end=end,
+        )
+        if resume:
+            checkpoint = load_checkpoint(checkpoint_path, state)
+
+    first_sentence: int = checkpoint["sentence"] if checkpoint else start
+
+    data_loader = MultiProjectionDataloader(
+        source_tsv=source_dataset,
+        target_txt=target_sentences,
+        alignments_talps=alignments_paths,
+        batch_size=batch_size,
+        start=first_sentence,
+        end=end,
+    )
+    data_loader_len = len(data_loader)
+
+    data_loader = iter(data_loader)
+
+    with report.timer("projection/read"):
+        # The range may be empty (i.e. a shard with no sentences), we still create the output files
+        source_words, tags_type, tags_ids, target_words, alignment_dictionaries = next(
+            data_loader, ([], [], [], [], [])
+        )
+
+    projections_list: List[List[str]] = []
+
+    # If no pool is provided, we create one for the whole dataset and close it when we are done.
+    close_pool: bool = projection_pool is None
+    if close_pool:
+        projection_pool = ProjectionPool()
+
+    # Number of sentences written to the output files
+    num_sentences: int = 0
+    # Number of sentences whose projections are in projections_list (not written yet)
+    num_pending_sentences: int = 0
+    start_time: float = time.time()
+
+    try:
+        with ExitStack() as stack:
+            if checkpoint:
+                # Remove the output written after the checkpoint
+                for output_path, offset in zip(output_paths, checkpoint["offsets"]):
+                    with open(output_path, "r+b") as output_file:
+                        output_file.truncate(offset)
+                output_mode: str = "a"
+            else:
+                output_mode: str = "w+"
+            # Compressed output files are replaced at each checkpoint, we close the current ones when we are done
+            output_files = []
+
+            def close_output_files():
+                for output_file in output_files:
+                    output_file.close()
+
+            stack.callback(close_output_files)
+            for output_path in output_paths:
+                if is_columnar(output_path):
+                    # The columnar files are only renamed to output_path if the projection finishes
+                    output_files.append(
+                        stack.enter_context(ColumnarWriter(output_path, tag_vocabulary))
+                    )
+                else:
+                    output_files.append(open_file(output_path, output_mode))
+            from tqdm.auto import tqdm
+
+            pbar = stack.enter_context(
+                tqdm(total=data_loader_len, desc="Annotation projection")
+            )
+
+            def write_projections():
+                with report.timer("projection/write"):
+                    for output_file, projections in zip(output_files, projections_list):
+                        if not projections:
+                            continue
+                        if isinstance(output_file, ColumnarWriter):
+                            output_file.write(projections)
+                        else:
+                            print("\n\n".join(projections), file=output_file)
+                            print(file=output_file)
+
+                if checkpoint_path is not None:
+                    with report.timer("projection/checkpoint"):
+                        offsets: List[int] = []
+                        for i, output_path in enumerate(output_paths):
+                            if is_compressed(output_path):
+                                # A truncated compressed stream cannot be continued. We end the stream at each
+                                # checkpoint and write the next batches to a new one, concatenated streams are
+                                # a valid compressed file.
+                                output_files[i].close()
+                                offsets.append(os.path.getsize(output_path))
+                                output_files[i] = open_file(output_path, "a")
+                            else:
+                                output_files[i].flush()
+                                offsets.append(
+                                    os.fstat(output_files[i].fileno()).st_size
+                                )
+                            os.fsync(output_files[i].fileno())
+                        save_checkpoint(
+                            checkpoint_path,
+                            state,
+                            sentence=first_sentence + num_sentences,
+                            offsets=offsets,
+                        )
+
+            while source_words:
+                # One job per output file, all of them run in parallel in the pool
+                async_jobs = [
+                    projection_pool.project_async(
+                        projection_function,
                         source_words,
                         tags_type,
                         tags_ids,
                         target_words,
-                        alignment_dictionary,
-                    ) = next(data_loader)
-                except StopIteration:
-                    source_words = []
-                    tags_type = []
-                    tags_ids = []
-                    target_words = []
-                    alignment_dictionary = []
-
-                projections = async_job.get()
-
-        if projections:
-            print("\n\n".join(projections), file=output_file)
-            print(file=output_file)
+                        alignment_dictionaries[alignment_id],
+                    )
+                    for projection_function, alignment_id in zip(
+                        projection_functions, alignment_ids
+                    )
+                ]
+                projected_tags_type = tags_type
+
+                num_sentences += num_pending_sentences
+                write_projections()
+                num_pending_sentences = len(source_words)
+
+                pbar.update(1)
+
+                with report.timer("projection/read"):
+                    try:
+                        (
+                            source_words,
+                            tags_type,
+                            tags_ids,
+                            target_words,
+                            alignment_dictionaries,
+                        ) = next(data_loader)
+                    except StopIteration:
+                        source_words = []
+
+                with report.timer("projection/wait_workers"):
+                    projections_list = [async_job.get() for async_job in async_jobs]
+
+                if report.enabled:
+                    for output_path, projections in zip(output_paths, projections_list):
+                        for _, counters in projections:
+                            report.update(counters, section=output_path)
+                    projections_list = [
+                        [projection for projection, _ in projections]
+                        for projections in projections_list
+                    ]
+
+                if span_statistics is not None:
+                    for statistics, projections in zip(
+                        span_statistics, projections_list
+                    ):
+                        statistics.update(projected_tags_type, projections)
+
+                pbar.set_postfix(
+                    sentences_per_second=f"{(num_sentences + num_pending_sentences) / (time.time() - start_time):.1f}"
+                )
+
+            num_sentences += num_pending_sentences
+            write_projections()
+    finally:
+        if close_pool:
+            projection_pool.close()
+
+    # The run is complete, the checkpoint is no longer needed
+    if checkpoint_path is not None and os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+
+    elapsed_time: float = time.time() - start_time
+    print(
+        f"Projected {num_sentences} sentences in {elapsed_time:.2f} seconds "
+        f"({num_sentences / max(elapsed_time, 1e-6):.2f} sentences/sec)."
+    )
@@ -0,0 +1,212 @@
+import itertools
+from functools import partial
+from multiprocessing.pool import AsyncResult
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+from projection.alignment_store import pairs2dictionary, parse_talp_line
+from projection.annotation_proyection import ProjectionPool, sentence_projection
+from projection.dataset import add_tagged_word
+
+# In-memory projection API. The sentences, tags and alignments are python objects, nothing is read from or written
+# to disk, so the projection can be embedded in other pipelines:
+#
+#   from projection.api import project_tags
+#   project_tags(
+#       source_sentences=[(["The", "Eiffel", "Tower"], ["O", "B-LOC", "I-LOC"])],
+#       target_sentences=[["La", "Torre", "Eiffel"]],
+#       alignments=["0-0 1-2 2-1"],
+#   )
+#   >>> [["O", "B-LOC", "I-LOC"]]
+
+# An alignment is a talp line ("0-0 1-2"), an iterable of (source word, target word) pairs, an int array of shape
+# (num_pairs, 2) or a dictionary {source word: [target words]}.
+Alignment = Union[str, Iterable[Tuple[int, int]], np.ndarray, Dict[int, List[int]]]
+
+
+def alignment_dictionary(alignment: Alignment) -> Dict[int, List[int]]:
+    """
+    Convert an alignment in any of the supported formats to the dictionary used by sentence_projection.
+    """
+    if isinstance(alignment, dict):
+        return alignment
+    if isinstance(alignment, str):
+        return pairs2dictionary(parse_talp_line(alignment))
+    if isinstance(alignment, np.ndarray):
+        if alignment.size == 0:
+            return {}
+        assert alignment.ndim == 2 and alignment.shape[1] == 2, (
+            f"Alignment arrays should have shape (num_pairs, 2). "
+            f"Alignment shape: {alignment.shape}"
+        )
+        return pairs2dictionary(alignment.tolist())
+    return pairs2dictionary((int(source), int(target)) for source, target in alignment)
+
+
+def sentences_tags_projection(
+    sources_words: List[List[str]],
+    sources_tags_type: List[List[str]],
+    sources_tags_ids: List[List[List[int]]],
+    target_words: List[List[str]],
+    alignments: List[Dict],
+    remove_puncs: bool = True,
+    fill_gap_size: int = 1,
+) -> List[List[str]]:
+    """
+    Project the labels of a batch of sentences. Same as sentences_projection, but returns the tags of each target
+    sentence instead of the projected sentences in tsv format. Empty sentences get an "O" tag for each target word.
+    """
+    return [
+        sentence_projection(
+            source_words=source_words,
+            source_tags_type=source_tags_type,
+            source_tags_ids=source_tags_ids,
+            target_words=target_words_,
+            alignments=alignments_,
+            remove_puncs=remove_puncs,
+            fill_gap_size=fill_gap_size,
+        )
+        for (
+            source_words,
+            source_tags_type,
+            source_tags_ids,
+            target_words_,
+            alignments_,
+        ) in zip(
+            sources_words, sources_tags_type, sources_tags_ids, target_words, alignments
+        )
+    ]
+
+
+def prepare_batch(
+    source_sentences: List[Tuple[Sequence[str], Sequence[str]]],
+    target_sentences: List[Sequence[str]],
+    alignments: List[Alignment],
+) -> Tuple[
+    List[List[str]],
+    List[List[str]],
+    List[List[List[int]]],
+    List[List[str]],
+    List[Dict[int, List[int]]],
+]:
+    """
+    Convert a batch of sentences into the inputs of sentences_tags_projection.
+    """
+    assert len(source_sentences) == len(target_sentences) == len(alignments), (
+        f"The number of source sentences, target sentences and alignments should be the same. "
+        f"Source sentences: {len(source_sentences)}. Target sentences: {len(target_sentences)}. "
+        f"Alignments: {len(alignments)}."
+    )
+
+    sources_words: List[List[str]] = []
+    sources_tags_type: List[List[str]] = []
+    sources_tags_ids: List[List[List[int]]] = []
+    for source_words, source_tags in source_sentences:
+        assert len(source_words) == len(source_tags), (
+            f"Each source word should have a tag. "
+            f"source_words: {source_words}. source_tags: {source_tags}"
+        )
+        words: List[str] = []
+        tags_type: List[str] = []
+        tags_ids: List[List[int]] = []
+        for word, tag in zip(source_words, source_tags):
+            add_tagged_word(word, tag, words, tags_type, tags_ids)
+        sources_words.append(words)
+        sources_tags_type.append(tags_type)
+        sources_tags_ids.append(tags_ids)
+
+    return (
+        sources_words,
+        sources_tags_type,
+        sources_tags_ids,
+        [list(target_words) for target_words in target_sentences],
+        [alignment_dictionary(alignment) for alignment in alignments],
+    )
+
+
+def iter_project_tags(
+    source_sentences: Iterable[Tuple[Sequence[str], Sequence[str]]],
+    target_sentences: Iterable[Sequence[str]],
+    alignments: Iterable[Alignment],
+    remove_puncs: bool = True,
+    fill_gap_size: int = 1,
+    batch_size: int = 10000,
+    projection_pool: Optional[ProjectionPool] = None,
+) -> Iterator[List[str]]:
+    """
+    Lazy version of project_tags: the inputs can be generators, they are consumed and projected one batch at a time
+    and the tags of each target sentence are yielded in order. With a projection pool, the next batch is projected
+    by the workers while the current one is consumed.
+    """
+    source_sentences = iter(source_sentences)
+    target_sentences = iter(target_sentences)
+    alignments = iter(alignments)
+    projection_function = partial(
+        sentences_tags_projection,
+        remove_puncs=remove_puncs,
+        fill_gap_size=fill_gap_size,
+    )
+
+    pending: Optional[AsyncResult] = None
+    while True:
+        batch = prepare_batch(
+            list(itertools.islice(source_sentences, batch_size)),
+            list(itertools.islice(target_sentences, batch_size)),
+            list(itertools.islice(alignments, batch_size)),
+        )
+
+        if projection_pool is None:
+            if not batch[0]:
+                break
+            yield from projection_function(*batch)
+            continue
+
+        projected: Optional[AsyncResult] = (
+            projection_pool.project_async(projection_function, *batch)
+            if batch[0]
+            else None
+        )
+        if pending is not None:
+            # The pool splits the batch in a chunk per worker
+            yield from itertools.chain.from_iterable(pending.get())
+        if projected is None:
+            break
+        pending = projected
+
+
+def project_tags(
+    source_sentences: Iterable[Tuple[Sequence[str], Sequence[str]]],
+    target_sentences: Iterable[Sequence[str]],
+    alignments: Iterable[Alignment],
+    remove_puncs: bool = True,
+    fill_gap_size: int = 1,
+    batch_size: int = 10000,
+    projection_pool: Optional[ProjectionPool] = None,
+) -> List[List[str]]:
+    """
+    Project the labels of the source sentences to the target sentences, in memory.
+    :param Iterable source_sentences: (words, tags) of each source sentence. Tags in BIO format.
+    :param Iterable target_sentences: Words of each target sentence.
+    :param Iterable alignments: Word alignments of each sentence pair. A talp line ("0-0 1-2"), an iterable of
+    (source word, target word) pairs, an int array of shape (num_pairs, 2) or a dictionary
+    {source word: [target words]}.
+    :param bool remove_puncs: If a source word is aligned to a punctuation mark, we remove the alignment.
+    :param int fill_gap_size: If the projected label is split in two or more parts, we fill the gap if the gap size
+    is less or equal than fill_gap_size. Else we will choose the largest label and remove the other part.
+    :param int batch_size: Number of sentences projected at once.
+    :param ProjectionPool projection_pool: Pool of worker processes that project each batch in parallel. If None,
+    the sentences are projected in the calling process (better for small inputs).
+    :return: The projected tags of each target sentence.
+    """
+    return list(
+        iter_project_tags(
+            source_sentences=source_sentences,
+            target_sentences=target_sentences,
+            alignments=alignments,
+            remove_puncs=remove_puncs,
+            fill_gap_size=fill_gap_size,
+            batch_size=batch_size,
+            projection_pool=projection_pool,
+        )
+    )
@@ -0,0 +1,109 @@
+import json
+import os
+from typing import Callable, Dict, List, Optional
+
+# A checkpoint records the progress of a projection run: the absolute index of the first sentence that has not
+# been written yet and, for each output file, the byte offset up to which the output is complete. It is updated
+# after each batch, once the outputs have been flushed to disk. A resumed run truncates the outputs to these
+# offsets and seeks the inputs to that sentence (using the sentence index of each file).
+
+
+def get_checkpoint_path(output_path: str) -> str:
+    return f"{output_path}.checkpoint.json"
+
+
+def file_fingerprint(path: str) -> Dict:
+    stat = os.stat(path)
+    return {
+        "path": os.path.abspath(path),
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+    }
+
+
+def projection_function_parameters(projection_function: Callable) -> Dict:
+    """
+    Parameters (i.e. remove_puncs, fill_gap_size) of a projection function created with get_projection_function.
+    The projection engine and return_counters do not change the output, so they are ignored.
+    """
+    return {
+        name: value
+        for name, value in getattr(projection_function, "keywords", {}).items()
+        if name != "return_counters"
+    }
+
+
+def checkpoint_state(
+    source_dataset: str,
+    target_sentences: str,
+    alignments_paths: List[str],
+    output_paths: List[str],
+    projection_functions: List[Callable],
+    alignment_ids: List[int],
+    start: int,
+    end: Optional[int],
+) -> Dict:
+    """
+    Description of a projection run. A checkpoint can only be resumed by a run with the same description.
+    """
+    return {
+        "source_dataset": file_fingerprint(source_dataset),
+        "target_sentences": file_fingerprint(target_sentences),
+        "alignments_paths": [
+            file_fingerprint(alignments_path) for alignments_path in alignments_paths
+        ],
+        "output_paths": [os.path.abspath(output_path) for output_path in output_paths],
+        "projection_functions": [
+            projection_function_parameters(projection_function)
+            for projection_function in projection_functions
+        ],
+        "alignment_ids": alignment_ids,
+        "start": start,
+        "end": end,
+    }
+
+
+def load_checkpoint(path: str, state: Dict) -> Optional[Dict]:
+    """
+    Load a checkpoint. Returns None if there is no checkpoint or if it cannot be resumed (it belongs to a different
+    run or the outputs are shorter than the checkpoint offsets).
+    """
+    if not os.path.exists(path):
+        print(f"No checkpoint found in {path}. Starting from the beginning.")
+        return None
+
+    with open(path, "r", encoding="utf8") as checkpoint_file:
+        checkpoint = json.load(checkpoint_file)
+
+    if checkpoint["state"] != state:
+        print(
+            f"The checkpoint {path} belongs to a different run (the inputs, outputs or parameters changed). "
+            f"Starting from the beginning."
+        )
+        return None
+
+    for output_path, offset in zip(state["output_paths"], checkpoint["offsets"]):
+        if not os.path.exists(output_path) or os.path.getsize(output_path) < offset:
+            print(
+                f"{output_path} is shorter than the {offset} bytes recorded in the checkpoint {path}. "
+                f"Starting from the beginning."
+            )
+            return None
+
+    print(
+        f"Resuming from checkpoint {path}. {checkpoint['sentence']} sentences already projected."
+    )
+    return checkpoint
+
+
+def save_checkpoint(path: str, state: Dict, sentence: int, offsets: List[int]) -> None:
+    tmp_path: str = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf8") as checkpoint_file:
+        json.dump(
+            {"state": state, "sentence": sentence, "offsets": offsets},
+            checkpoint_file,
+            indent=4,
+        )
+        checkpoint_file.flush()
+        os.fsync(checkpoint_file.fileno())
+    os.replace(tmp_path, path)
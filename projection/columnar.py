@@ -0,0 +1,220 @@
+import json
+import os
+from typing import Dict, List, Optional, Set, Tuple
+
+import numpy as np
+
+from projection.compression import open_file, tmp_path
+
+# Columnar outputs. A projected dataset can be written as an Apache Arrow IPC file (.arrow) or as a Parquet file
+# (.parquet) instead of a tsv file, so it can be memory-mapped by the trainers without parsing it. Each row is a
+# sentence of the tsv output (empty sentences are skipped in both), with two columns:
+#   tokens: list<string>, the target words.
+#   tags:   list<int32>, the projected tags, encoded as positions in the tag vocabulary.
+# The tag vocabulary is stored as a JSON list in the tag_vocabulary key of the schema metadata. Each batch of the
+# projection is written as a record batch (Arrow) or a row group (Parquet). Requires the pyarrow package.
+
+COLUMNAR_EXTENSIONS: Dict[str, str] = {
+    "arrow": ".arrow",
+    "parquet": ".parquet",
+}
+OUTPUT_FORMATS = ["tsv"] + list(COLUMNAR_EXTENSIONS)
+TAG_VOCABULARY_KEY: bytes = b"tag_vocabulary"
+
+
+def get_columnar_format(path: str) -> Optional[str]:
+    """
+    Columnar format of a file according to its extension. None if the file is not an arrow or parquet file.
+    """
+    for columnar_format, extension in COLUMNAR_EXTENSIONS.items():
+        if path.endswith(extension):
+            return columnar_format
+    return None
+
+
+def is_columnar(path: str) -> bool:
+    return get_columnar_format(path) is not None
+
+
+def output_extension(output_format: str) -> str:
+    """
+    Extension of the projected datasets for an output format [tsv, arrow, parquet].
+    """
+    if output_format == "tsv":
+        return ".tsv"
+    if output_format not in COLUMNAR_EXTENSIONS:
+        raise ValueError(
+            f"Output format {output_format} not supported. Supported formats: {OUTPUT_FORMATS}"
+        )
+    return COLUMNAR_EXTENSIONS[output_format]
+
+
+def _import_pyarrow():
+    try:
+        import pyarrow
+    except ImportError:
+        raise ImportError(
+            "Arrow and parquet outputs require the pyarrow package: pip install pyarrow"
+        )
+    return pyarrow
+
+
+def source_tag_vocabulary(source_dataset: str) -> List[str]:
+    """
+    Every tag that the projection of a tsv dataset can produce: "O" and the B- and I- tags of each tag type of the
+    dataset (BIO or BILOU tags). The vocabulary is stored in the header of the columnar files, so it must be known
+    before the first batch is projected. It takes a pass over the source dataset.
+    """
+    tags: Set[str] = set()
+    with open_file(source_dataset) as file:
+        for line in file:
+            line = line.strip()
+            if line:
+                tags.add(line.rsplit(maxsplit=1)[-1])
+
+    tag_types: Set[str] = set()
+    for tag in tags:
+        if tag[0] in "BIU":
+            try:
+                _, tag_type = tag.split("-")
+            except ValueError:
+                raise ValueError(f"Unable to split tag: {tag} in {source_dataset}")
+            tag_types.add(tag_type)
+
+    vocabulary: List[str] = ["O"]
+    for tag_type in sorted(tag_types):
+        vocabulary.extend([f"B-{tag_type}", f"I-{tag_type}"])
+    return vocabulary
+
+
+class ColumnarWriter:
+    """
+    Write the projections of a dataset to an arrow or parquet file, a record batch (row group) per call to write.
+    The file is written to a temporary path and renamed when the writer is closed, if an exception is raised inside
+    the with block the temporary file is removed. Columnar files cannot be appended to, so projections written
+    to a columnar file cannot be resumed.
+    """
+
+    def __init__(self, path: str, tag_vocabulary: List[str]):
+        """
+        :param str path: Path to the output file. The format is given by its extension [.arrow, .parquet].
+        :param List[str] tag_vocabulary: Tags of the dataset, see source_tag_vocabulary.
+        """
+        pa = _import_pyarrow()
+        self.path = path
+        self.format = get_columnar_format(path)
+        assert self.format is not None, (
+            f"{path} is not a columnar file. "
+            f"Supported extensions: {list(COLUMNAR_EXTENSIONS.values())}"
+        )
+        self.tag_vocabulary = tag_vocabulary
+        self.tag2id: Dict[str, int] = {
+            tag: tag_id for tag_id, tag in enumerate(tag_vocabulary)
+        }
+        self.schema = pa.schema(
+            [
+                pa.field("tokens", pa.list_(pa.string())),
+                pa.field("tags", pa.list_(pa.int32())),
+            ],
+            metadata={TAG_VOCABULARY_KEY: json.dumps(tag_vocabulary).encode("utf8")},
+        )
+        self.tmp_path: str = tmp_path(path)
+        if self.format == "arrow":
+            self.writer = pa.ipc.new_file(self.tmp_path, self.schema)
+        else:
+            import pyarrow.parquet as pq
+
+            self.writer = pq.ParquetWriter(self.tmp_path, self.schema)
+        self.num_sentences: int = 0
+
+    def write(self, projections: List[str]) -> None:
+        """
+        Write a batch of projections. projections are the outputs of the projection function (sentences in tsv
+        format) for each chunk of the batch.
+        """
+        pa = _import_pyarrow()
+        tokens: List[str] = []
+        tags: List[int] = []
+        offsets: List[int] = [0]
+        for projection in projections:
+            if not projection:
+                continue
+            for sentence in projection.split("\n\n"):
+                for line in sentence.split("\n"):
+                    word, _, tag = line.rpartition(" ")
+                    try:
+                        tags.append(self.tag2id[tag])
+                    except KeyError:
+                        raise ValueError(
+                            f"Tag {tag} of word {word} is not in the tag vocabulary of {self.path}: "
+                            f"{self.tag_vocabulary}"
+                        )
+                    tokens.append(word)
+                offsets.append(len(tokens))
+
+        if len(offsets) == 1:
+            return
+
+        offsets_array = pa.array(np.asarray(offsets, dtype=np.int32))
+        record_batch = pa.RecordBatch.from_arrays(
+            [
+                pa.ListArray.from_arrays(offsets_array, pa.array(tokens, pa.string())),
+                pa.ListArray.from_arrays(
+                    offsets_array, pa.array(np.asarray(tags, dtype=np.int32))
+                ),
+            ],
+            schema=self.schema,
+        )
+        self.writer.write_batch(record_batch)
+        self.num_sentences += len(offsets) - 1
+
+    def close(self) -> None:
+        if self.writer is None:
+            return
+        self.writer.close()
+        self.writer = None
+        os.replace(self.tmp_path, self.path)
+
+    def abort(self) -> None:
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+def read_columnar_dataset(path: str, memory_map: bool = True) -> Tuple:
+    """
+    Read a projected dataset written by ColumnarWriter.
+    :param str path: Path to the arrow or parquet file.
+    :param bool memory_map: Whether to memory-map the file. Arrow files are read without copying the data.
+    :return: A tuple with the pyarrow Table (tokens and tags columns) and the tag vocabulary.
+    """
+    pa = _import_pyarrow()
+    columnar_format = get_columnar_format(path)
+    if columnar_format == "arrow":
+        source = pa.memory_map(path) if memory_map else pa.OSFile(path)
+        table = pa.ipc.open_file(source).read_all()
+    elif columnar_format == "parquet":
+        import pyarrow.parquet as pq
+
+        table = pq.read_table(path, memory_map=memory_map)
+    else:
+        raise ValueError(
+            f"{path} is not a columnar file. "
+            f"Supported extensions: {list(COLUMNAR_EXTENSIONS.values())}"
+        )
+    metadata = table.schema.metadata or {}
+    tag_vocabulary: List[str] = json.loads(
+        metadata.get(TAG_VOCABULARY_KEY, b"[]").decode("utf8")
+    )
+    return table, tag_vocabulary
@@ -0,0 +1,133 @@
+import gzip
+import io
+import lzma
+from typing import IO, Dict, Optional, Tuple
+
+# Transparent compression. Every reader and writer opens its files with open_file, files are compressed or not
+# according to their extension: .gz (gzip), .zst (zstd, requires the zstandard package) and .xz (xz). The
+# compressed formats allow concatenated streams, so compressed files can be appended to and concatenated (i.e. the
+# shards of a projection). Sentence offsets (see SentenceIndex) are positions in the decompressed data.
+
+COMPRESSION_EXTENSIONS: Dict[str, str] = {
+    "gzip": ".gz",
+    "zstd": ".zst",
+    "xz": ".xz",
+}
+COMPRESSIONS = ["none"] + list(COMPRESSION_EXTENSIONS)
+# Fast levels, the projection writes large files and most of the gain comes from the first levels
+COMPRESSION_LEVELS: Dict[str, int] = {
+    "gzip": 6,
+    "zstd": 3,
+    "xz": 3,
+}
+
+
+def split_compression_extension(path: str) -> Tuple[str, str]:
+    """
+    Split the compression extension of a path: data/en.train.tsv.gz => (data/en.train.tsv, .gz).
+    The extension is "" if the file is not compressed.
+    """
+    for extension in COMPRESSION_EXTENSIONS.values():
+        if path.endswith(extension):
+            return path[: -len(extension)], extension
+    return path, ""
+
+
+def get_compression(path: str) -> Optional[str]:
+    """
+    Compression of a file according to its extension. None if the file is not compressed.
+    """
+    _, extension = split_compression_extension(path)
+    for compression, compression_extension in COMPRESSION_EXTENSIONS.items():
+        if extension == compression_extension:
+            return compression
+    return None
+
+
+def is_compressed(path: str) -> bool:
+    return get_compression(path) is not None
+
+
+def add_compression_extension(path: str, compression: Optional[str]) -> str:
+    """
+    Add the extension of a compression [none, gzip, zstd, xz] to a path. The path is not changed if compression is
+    None or "none".
+    """
+    if compression is None or compression == "none":
+        return path
+    if compression not in COMPRESSION_EXTENSIONS:
+        raise ValueError(
+            f"Compression {compression} not supported. Supported compressions: {COMPRESSIONS}"
+        )
+    return path + COMPRESSION_EXTENSIONS[compression]
+
+
+def tmp_path(path: str, suffix: str = "tmp") -> str:
+    """
+    Temporary path next to path with the same compression: data/en.train.tsv.gz => data/en.train.tsv.tmp.gz
+    """
+    base_path, extension = split_compression_extension(path)
+    return f"{base_path}.{suffix}{extension}"
+
+
+def _open_zstd(path: str, mode: str) -> IO[bytes]:
+    try:
+        import zstandard
+    except ImportError:
+        raise ImportError(
+            f"Unable to open {path}. zstd compressed files require the zstandard package: pip install zstandard"
+        )
+
+    if mode == "rb":
+        # A file written in several runs (i.e. a resumed projection) has a frame per run
+        return zstandard.ZstdDecompressor().stream_reader(
+            open(path, "rb"), read_across_frames=True, closefd=True
+        )
+    return zstandard.ZstdCompressor(level=COMPRESSION_LEVELS["zstd"]).stream_writer(
+        open(path, mode), closefd=True
+    )
+
+
+def open_binary(path: str, mode: str = "rb") -> IO[bytes]:
+    """
+    Open a file in binary mode ("rb", "wb" or "ab"). Compressed files are decompressed when read and compressed
+    when written.
+    """
+    assert mode in ["rb", "wb", "ab"], f"Mode {mode} not supported for {path}"
+    compression = get_compression(path)
+    if compression is None:
+        return open(path, mode)
+    if compression == "gzip":
+        return gzip.open(path, mode, compresslevel=COMPRESSION_LEVELS["gzip"])
+    if compression == "xz":
+        if mode == "rb":
+            return lzma.open(path, mode)
+        return lzma.open(path, mode, preset=COMPRESSION_LEVELS["xz"])
+    return _open_zstd(path, mode)
+
+
+def open_file(
+    path: str, mode: str = "r", encoding: str = "utf8", offset: int = 0
+) -> IO:
+    """
+    Drop-in replacement of open for the datasets, sentences and alignments. Uncompressed files are opened with open.
+    :param str path: Path to the file. The compression is given by its extension [.gz, .zst, .xz].
+    :param str mode: "r", "w" or "a", text mode by default, add "b" for binary mode. Compressed files cannot be
+    opened for reading and writing at the same time, "+" is ignored for them.
+    :param str encoding: Encoding of the file in text mode.
+    :param int offset: Byte offset (in the decompressed data) of the first byte to read. Seeking a compressed file
+    decompresses the data before the offset.
+    """
+    binary: bool = "b" in mode
+    if not is_compressed(path):
+        file = open(path, mode) if binary else open(path, mode, encoding=encoding)
+        if offset:
+            file.seek(offset)
+        return file
+
+    file = open_binary(
+        path, mode.replace("t", "").replace("b", "").replace("+", "") + "b"
+    )
+    if offset:
+        file.seek(offset)
+    return file if binary else io.TextIOWrapper(file, encoding=encoding)
@@ -1,41 +1,129 @@
-from torch.utils.data import IterableDataset
-from typing import Dict, List
+from typing import Dict, List, Optional, Tuple
+import itertools
 import math
+from projection.alignment_store import (
+    BinaryAlignments,
+    is_binary_alignments,
+    parse_talp_line,
+    pairs2dictionary,
+)
+from projection.compression import open_file
+from projection.sentence_index import SentenceIndex
+
+# The datasets do not subclass torch.utils.data.IterableDataset, so the projection (and the CLIs that only project
+# existing alignments) does not import torch. They implement __iter__, __getitem__ and __len__, they can still be
+# wrapped in a torch DataLoader.
 
 
 def count_lines(input_path: str) -> int:
-    with open(input_path, "r", encoding="utf8") as f:
-        return sum(1 for _ in f)
+    # O(1) if the sentence index of the file is cached
+    return len(SentenceIndex(input_path))
 
 
 def count_sentence_tsv(input_path: str) -> int:
-    sentences = []
-    lines = []
-    with open(input_path, "r", encoding="utf8") as file:
-        for line in file:
-            line = line.rstrip().strip()
-            if line == "":
-                sentences.append(1)
-                lines = []
-            else:
-                lines.append(line)
-
-        if lines:
-            sentences.append(1)
-    return sum(sentences)
-
-
-class AlignmentDataset(IterableDataset):
-    def __init__(self, filename: str):
+    # O(1) if the sentence index of the file is cached
+    return len(SentenceIndex(input_path, tsv=True))
+
+
+def parse_tsv_line(
+    line: str, words: List[str], tags_type: List[str], tags_ids: List[List[int]]
+) -> None:
+    """
+    Add a (non-empty) "word tag" line of a tsv dataset to the words and spans of the current sentence.
+    """
+    tag: str
+    word: str
+    try:
+        word, tag = line.split()
+    except ValueError:
+        raise ValueError(f"Unable to split line: {line}")
+
+    add_tagged_word(word, tag, words, tags_type, tags_ids)
+
+
+def add_tagged_word(
+    word: str,
+    tag: str,
+    words: List[str],
+    tags_type: List[str],
+    tags_ids: List[List[int]],
+) -> None:
+    """
+    Add a word and its BIO tag to the words and spans of the current sentence.
+    """
+    if tag.startswith("B") or tag.startswith("U"):
+        try:
+            _, tag_type = tag.split("-")
+        except ValueError:
+            raise ValueError(f"Unable to split tag: {tag} of word {word}")
+
+        tags_ids.append([len(words)])
+        tags_type.append(tag_type)
+
+    elif tag.startswith("I"):
+        try:
+            _, tag_type = tag.split("-")
+        except ValueError:
+            raise ValueError(f"Unable to split tag: {tag} of word {word}")
+
+        if (
+            tags_ids
+            and tags_ids[-1][-1] == (len(words) - 1)
+            and tags_type[-1] == tag_type
+        ):
+            tags_ids[-1].append(len(words))
+        else:
+            tags_ids.append([len(words)])
+            tags_type.append(tag_type)
+
+    words.append(word)
+
+
+def sentence_range(
+    num_sentences: int, start: int, end: Optional[int]
+) -> Tuple[int, int]:
+    """
+    Check and return the [start, end) range of sentences to read. If end is None, read until the end of the file.
+    """
+    if end is None:
+        end = num_sentences
+    assert 0 <= start <= end <= num_sentences, (
+        f"Invalid sentence range [{start}, {end}). "
+        f"The file has {num_sentences} sentences."
+    )
+    return start, end
+
+
+class AlignmentDataset:
+    def __init__(self, filename: str, start: int = 0, end: Optional[int] = None):
 
         self.filename = filename
-        self.num_lines = count_lines(filename)
+        if is_binary_alignments(filename):
+            # Binary alignments are memory-mapped, the number of sentences is stored in the header
+            self.binary_alignments = BinaryAlignments(filename)
+            self.sentence_index = None
+            self.start, self.end = sentence_range(
+                len(self.binary_alignments), start, end
+            )
+        else:
+            self.binary_alignments = None
+            self.sentence_index = SentenceIndex(filename)
+            self.start, self.end = sentence_range(len(self.sentence_index), start, end)
+        self.num_lines = self.end - self.start
         print(f"Number of sentences in {filename}: {self.num_lines}")
 
     def __iter__(self):
-        with open(self.filename, "r", encoding="utf8") as file:
+        if self.binary_alignments is not None:
+            yield from itertools.islice(
+                self.binary_alignments.iter_dictionaries(start=self.start),
+                self.num_lines,
+            )
+            return
 
-            for alignment in file:
+        with open_file(
+            self.filename, offset=self.sentence_index.offset(self.start)
+        ) as file:
+            for alignment in itertools.islice(file, self.num_lines):
                 alignment_dictionary: Dict[int, List[int]] = {}
                 for pair in alignment.rstrip().strip().split():
                     try:
@@ -53,22 +141,34 @@ class AlignmentDataset(IterableDataset):
 
                 yield alignment_dictionary
 
-    def __getitem__(self, index):
-        pass
+    def __getitem__(self, index) -> Dict[int, List[int]]:
+        if self.binary_alignments is not None:
+            return self.binary_alignments.get_dictionary(self.start + index)
+        return pairs2dictionary(
+            parse_talp_line(self.sentence_index[self.start + index])
+        )
 
     def __len__(self):
         return self.num_lines
 
 
-class SourceDataset(IterableDataset):
-    def __init__(self, filename: str):
+class SourceDataset:
+    def __init__(self, filename: str, start: int = 0, end: Optional[int] = None):
 
         self.filename = filename
-        self.num_lines = count_sentence_tsv(filename)
+        self.sentence_index = SentenceIndex(filename, tsv=True)
+        self.start, self.end = sentence_range(len(self.sentence_index), start, end)
+        self.num_lines = self.end - self.start
         print(f"Number of sentences in {filename}: {self.num_lines}")
 
     def __iter__(self):
-        with open(self.filename, "r", encoding="utf8") as file:
+        if not self.num_lines:
+            return
+
+        with open_file(
+            self.filename, offset=self.sentence_index.offset(self.start)
+        ) as file:
+            num_sentences: int = 0
             words = []
             tags_ids = []
             tags_type = []
@@ -77,73 +177,52 @@ class SourceDataset(IterableDataset):
                 line = line.rstrip().strip()
                 if line == "":
                     yield words, tags_type, tags_ids
+                    num_sentences += 1
+                    if num_sentences == self.num_lines:
+                        return
                     words = []
                     tags_ids = []
                     tags_type = []
 
                 else:
-                    tag: str
-                    word: str
-                    try:
-                        word, tag = line.split()
-                    except ValueError:
-                        raise ValueError(f"Unable to split line: {line}")
-
-                    if tag.startswith("B") or tag.startswith("U"):
-                        try:
-                            _, tag_type = tag.split("-")
-                        except ValueError:
-                            raise ValueError(
-                                f"Unable to split tag: {tag_type} from line {line}"
-                            )
-
-                        tags_ids.append([len(words)])
-                        tags_type.append(tag_type)
-
-                    elif tag.startswith("I"):
-                        try:
-                            _, tag_type = tag.split("-")
-                        except ValueError:
-                            raise ValueError(
-                                f"Unable to split tag: {tag_type} from line {line}"
-                            )
-
-                        if (
-                            tags_ids[-1][-1] == (len(words) - 1)
-                            and tags_type[-1] == tag_type
-                        ):
-                            tags_ids[-1].append(len(words))
-                        else:
-                            tags_ids.append([len(words)])
-                            tags_type.append(tag_type)
-
-                    words.append(word)
+                    parse_tsv_line(line, words, tags_type, tags_ids)
 
             if words:
                 yield words, tags_type, tags_ids
 
-    def __getitem__(self, index):
-        pass
+    def __getitem__(self, index) -> Tuple[List[str], List[str], List[List[int]]]:
+        words = []
+        tags_ids = []
+        tags_type = []
+        for line in self.sentence_index[self.start + index].split("\n"):
+            line = line.rstrip().strip()
+            if line:
+                parse_tsv_line(line, words, tags_type, tags_ids)
+        return words, tags_type, tags_ids
 
     def __len__(self):
         return self.num_lines
 
 
-class TargetDataset(IterableDataset):
-    def __init__(self, filename: str):
+class TargetDataset:
+    def __init__(self, filename: str, start: int = 0, end: Optional[int] = None):
 
         self.filename = filename
-        self.num_lines = count_lines(filename)
+        self.sentence_index = SentenceIndex(filename)
+        self.start, self.end = sentence_range(len(self.sentence_index), start, end)
+        self.num_lines = self.end - self.start
         print(f"Number of sentences in {filename}: {self.num_lines}")
 
     def __iter__(self):
-        with open(self.filename, "r", encoding="utf8") as file:
-            for sentence in file:
+        with open_file(
+            self.filename, offset=self.sentence_index.offset(self.start)
+        ) as file:
+            for sentence in itertools.islice(file, self.num_lines):
                 words: List[str] = sentence.rstrip().strip().split()
                 yield words
 
-    def __getitem__(self, index):
-        pass
+    def __getitem__(self, index) -> List[str]:
+        return self.sentence_index[self.start + index].rstrip().strip().split()
 
     def __len__(self):
         return self.num_lines
@@ -151,19 +230,31 @@ class TargetDataset(IterableDataset):
 
 class ProjectionDataloader:
     def __init__(
-        self, source_tsv: str, target_txt: str, alignments_talp: str, batch_size: int
+        self,
+        source_tsv: str,
+        target_txt: str,
+        alignments_talp: str,
+        batch_size: int,
+        start: int = 0,
+        end: Optional[int] = None,
     ):
 
         self.source_dataset = SourceDataset(
             filename=source_tsv,
+            start=start,
+            end=end,
         )
 
         self.target_dataset = TargetDataset(
             filename=target_txt,
+            start=start,
+            end=end,
         )
 
         self.alignments_dataset = AlignmentDataset(
             filename=alignments_talp,
+            start=start,
+            end=end,
         )
 
         assert (
@@ -219,3 +310,100 @@ class ProjectionDataloader:
 
     def __len__(self):
         return math.ceil(len(self.alignments_dataset) / self.batch_size)
+
+
+class MultiProjectionDataloader:
+    """
+    Same as ProjectionDataloader, but reads the alignments of several alignment files in lockstep. The source and
+    target datasets are read only once. For each batch, it yields a list of alignment dictionaries per alignment file.
+    If start and end are provided, only the sentences in the [start, end) range are read (i.e. a shard of the dataset).
+    """
+
+    def __init__(
+        self,
+        source_tsv: str,
+        target_txt: str,
+        alignments_talps: List[str],
+        batch_size: int,
+        start: int = 0,
+        end: Optional[int] = None,
+    ):
+
+        self.source_dataset = SourceDataset(
+            filename=source_tsv,
+            start=start,
+            end=end,
+        )
+
+        self.target_dataset = TargetDataset(
+            filename=target_txt,
+            start=start,
+            end=end,
+        )
+
+        self.alignments_datasets = [
+            AlignmentDataset(
+                filename=alignments_talp,
+                start=start,
+                end=end,
+            )
+            for alignments_talp in alignments_talps
+        ]
+
+        for alignments_dataset in self.alignments_datasets:
+            assert (
+                len(self.source_dataset)
+                == len(alignments_dataset)
+                == len(self.target_dataset)
+            ), (
+                f"source_dataloader len: {len(self.source_dataset)}. "
+                f"target_dataloader len: { len(self.target_dataset)}. "
+                f"alignments_dataloader ({alignments_dataset.filename}) len: {len(alignments_dataset)}."
+            )
+
+        self.batch_size = batch_size
+
+    def __iter__(self):
+        batch: int = 0
+        source_words_list = []
+        tags_type_list = []
+        tags_ids_list = []
+        target_words_list = []
+        alignment_dictionary_lists = [[] for _ in self.alignments_datasets]
+
+        for (
+            (source_words, tags_type, tags_ids),
+            (target_words),
+            *alignment_dictionaries,
+        ) in zip(self.source_dataset, self.target_dataset, *self.alignments_datasets):
+
+            batch += 1
+            source_words_list.append(source_words)
+            tags_type_list.append(tags_type)
+            tags_ids_list.append(tags_ids)
+            target_words_list.append(target_words)
+            for alignment_dictionary_list, alignment_dictionary in zip(
+                alignment_dictionary_lists, alignment_dictionaries
+            ):
+                alignment_dictionary_list.append(alignment_dictionary)
+
+            if batch == self.batch_size:
+                yield source_words_list, tags_type_list, tags_ids_list, target_words_list, alignment_dictionary_lists
+                batch: int = 0
+                source_words_list = []
+                tags_type_list = []
+                tags_ids_list = []
+                target_words_list = []
+                alignment_dictionary_lists = [[] for _ in self.alignments_datasets]
+
+        if batch:
+            yield (
+                source_words_list,
+                tags_type_list,
+                tags_ids_list,
+                target_words_list,
+                alignment_dictionary_lists,
+            )
+
+    def __len__(self):
+        return math.ceil(len(self.source_dataset) / self.batch_size)
@@ -0,0 +1,273 @@
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import uuid
+from collections import OrderedDict
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from projection.sentence_alignment_cache import model_fingerprint
+
+# Persistent cache of the subword embeddings of the sentences aligned by SimAlign. The alignment parameters
+# (distortion, null_align, matching methods, token type) are applied to the embeddings, so runs that only change
+# them do not need the model. The cache directory contains:
+#   {cache_dir}/index.sqlite: key (sha256 of the model, the layer and the sentence) => segment, first row, number
+#                             of rows and subword tokens of each word of the sentence (JSON).
+#   {cache_dir}/segments/{segment}.npy: float32 array (rows, hidden size) with the embeddings of the sentences
+#                             stored together (one batch of sentences), read with memory-mapping.
+# The modification time of a segment is its last use, when the cache is larger than its maximum size the least
+# recently used segments are removed.
+
+CACHE_VERSION: int = 1
+DEFAULT_EMBEDDING_CACHE_SIZE_GB: float = 20.0
+INDEX_FILENAME: str = "index.sqlite"
+SEGMENTS_DIRNAME: str = "segments"
+SEGMENT_EXTENSION: str = ".npy"
+
+# segment, first row, number of rows and subword tokens of each word
+CachedSentence = Tuple[str, int, int, List[List[str]]]
+
+
+class EmbeddingCache:
+    """
+    Subword embeddings of sentences computed by a model layer. The cache can be shared by several processes: the
+    segments are written to a temporary file and atomically renamed before they are added to the index, and a
+    segment removed by another process is reported as an OSError by vectors.
+    """
+
+    def __init__(
+        self,
+        cache_dir: str,
+        model_name_or_path: str,
+        layer: int,
+        max_size_gb: float = DEFAULT_EMBEDDING_CACHE_SIZE_GB,
+        batch_size: int = 500,
+        max_open_segments: int = 64,
+    ):
+        """
+        :param str cache_dir: Path to the cache directory.
+        :param str model_name_or_path: Model that computes the embeddings (Huggingface Hub name or local path).
+        :param int layer: Layer of the model used as embeddings.
+        :param float max_size_gb: Maximum size of the segments in GB.
+        :param int batch_size: Number of keys per query to the index.
+        :param int max_open_segments: Number of memory-mapped segments kept open.
+        """
+        self.cache_dir = cache_dir
+        self.max_size: int = int(max_size_gb * 1024**3)
+        self.batch_size = batch_size
+        self.max_open_segments = max_open_segments
+        self.namespace: bytes = hashlib.sha256(
+            json.dumps(
+                {
+                    "version": CACHE_VERSION,
+                    "model": model_fingerprint(model_name_or_path),
+                    "layer": layer,
+                },
+                sort_keys=True,
+            ).encode("utf8")
+        ).digest()
+
+        os.makedirs(os.path.join(cache_dir, SEGMENTS_DIRNAME), exist_ok=True)
+        # The index can be shared by several processes, wait for the locks instead of failing
+        self.connection = sqlite3.connect(
+            os.path.join(cache_dir, INDEX_FILENAME), timeout=600
+        )
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings (key BLOB PRIMARY KEY, segment TEXT NOT NULL, "
+            "offset INTEGER NOT NULL, rows INTEGER NOT NULL, tokens TEXT NOT NULL)"
+        )
+        self.connection.execute(
+            "CREATE INDEX IF NOT EXISTS embeddings_segment ON embeddings (segment)"
+        )
+        self.connection.commit()
+
+        self.open_segments: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self.cache_size: int = self.size()
+
+    def key(self, sentence: str) -> bytes:
+        sha256 = hashlib.sha256(self.namespace)
+        sha256.update(sentence.encode("utf8"))
+        return sha256.digest()
+
+    def segment_path(self, segment: str) -> str:
+        return os.path.join(
+            self.cache_dir, SEGMENTS_DIRNAME, segment + SEGMENT_EXTENSION
+        )
+
+    def lookup(self, sentences: List[str]) -> Dict[str, CachedSentence]:
+        """
+        Location and subword tokens of the sentences that are in the cache. Use vectors to read the embeddings.
+        """
+        keys: Dict[bytes, str] = {
+            self.key(sentence): sentence for sentence in sentences
+        }
+        unique_keys: List[bytes] = list(keys)
+        cached: Dict[str, CachedSentence] = {}
+        for i in range(0, len(unique_keys), self.batch_size):
+            batch = unique_keys[i : i + self.batch_size]
+            for key, segment, offset, rows, tokens in self.connection.execute(
+                f"SELECT key, segment, offset, rows, tokens FROM embeddings WHERE key IN "
+                f"({','.join('?' * len(batch))})",
+                batch,
+            ):
+                cached[keys[key]] = (segment, offset, rows, json.loads(tokens))
+        return cached
+
+    def vectors(self, cached_sentence: CachedSentence) -> np.ndarray:
+        """
+        Embeddings of a sentence found by lookup, (subwords, hidden size). The array is memory-mapped, copy it if you
+        keep it. Raises an OSError if the segment was removed.
+        """
+        segment, offset, rows, _ = cached_sentence
+        if segment in self.open_segments:
+            self.open_segments.move_to_end(segment)
+        else:
+            self.open_segments[segment] = np.load(
+                self.segment_path(segment), mmap_mode="r"
+            )
+            # Mark the segment as recently used
+            os.utime(self.segment_path(segment))
+            if len(self.open_segments) > self.max_open_segments:
+                self.open_segments.popitem(last=False)
+        return self.open_segments[segment][offset : offset + rows]
+
+    def put_many(
+        self,
+        sentences: List[str],
+        tokens: List[List[List[str]]],
+        vectors: List[np.ndarray],
+    ) -> None:
+        """
+        Store the embeddings of a batch of sentences in a new segment.
+        :param List[str] sentences: Sentences.
+        :param List[List[List[str]]] tokens: Subword tokens of each word of each sentence.
+        :param List[np.ndarray] vectors: Embeddings of each sentence, (subwords, hidden size).
+        """
+        if not sentences:
+            return
+        segment: str = uuid.uuid4().hex
+        offsets: np.ndarray = np.concatenate(
+            ([0], np.cumsum([len(sentence_vectors) for sentence_vectors in vectors]))
+        )
+        tmp_path: str = f"{self.segment_path(segment)}.tmp"
+        with open(tmp_path, "wb") as segment_file:
+            np.save(segment_file, np.concatenate(vectors).astype(np.float32))
+        os.replace(tmp_path, self.segment_path(segment))
+
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, segment, offset, rows, tokens) VALUES (?, ?, ?, ?, ?)",
+                [
+                    (
+                        self.key(sentence),
+                        segment,
+                        int(offsets[i]),
+                        int(offsets[i + 1] - offsets[i]),
+                        json.dumps(sentence_tokens, ensure_ascii=False),
+                    )
+                    for i, (sentence, sentence_tokens) in enumerate(
+                        zip(sentences, tokens)
+                    )
+                ],
+            )
+
+        self.cache_size += os.path.getsize(self.segment_path(segment))
+        if self.cache_size > self.max_size:
+            self.evict()
+
+    def segments(self) -> List[Tuple[float, int, str]]:
+        """
+        (last use, size in bytes, segment) of every segment in the cache.
+        """
+        segments: List[Tuple[float, int, str]] = []
+        with os.scandir(os.path.join(self.cache_dir, SEGMENTS_DIRNAME)) as entries:
+            for entry in entries:
+                if not entry.name.endswith(SEGMENT_EXTENSION):
+                    continue
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                segments.append(
+                    (stat.st_mtime, stat.st_size, entry.name[: -len(SEGMENT_EXTENSION)])
+                )
+        return segments
+
+    def size(self) -> int:
+        return sum(size for _, size, _ in self.segments())
+
+    def evict(self) -> None:
+        """
+        Remove the least recently used segments (and their sentences from the index) until the cache is smaller
+        than its maximum size. We remove 10% more, so a run that fills the cache does not scan the segments after
+        each batch.
+        """
+        segments = sorted(self.segments())
+        cache_size: int = sum(size for _, size, _ in segments)
+        evicted: List[str] = []
+        for _, size, segment in segments:
+            if cache_size <= self.max_size * 0.9:
+                break
+            try:
+                os.remove(self.segment_path(segment))
+            except OSError:
+                # Removed by another process
+                pass
+            self.open_segments.pop(segment, None)
+            evicted.append(segment)
+            cache_size -= size
+
+        with self.connection:
+            self.connection.executemany(
+                "DELETE FROM embeddings WHERE segment = ?",
+                [(segment,) for segment in evicted],
+            )
+        if evicted:
+            print(
+                f"Embedding cache: {len(evicted)} segments evicted, "
+                f"{cache_size / 1024**3:.2f} GB left."
+            )
+        self.cache_size = cache_size
+
+    def __len__(self) -> int:
+        return self.connection.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def close(self) -> None:
+        self.open_segments.clear()
+        self.connection.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Show the size of the embedding cache and remove the least recently used segments"
+    )
+    parser.add_argument(
+        "--cache_dir",
+        type=str,
+        required=True,
+        help="Path to the embedding cache directory",
+    )
+    parser.add_argument(
+        "--max_size_gb",
+        type=float,
+        default=DEFAULT_EMBEDDING_CACHE_SIZE_GB,
+        help="Maximum size of the cache in GB, the least recently used segments are removed",
+    )
+
+    args = parser.parse_args()
+
+    # The model and the layer only namespace the keys, eviction is shared by every model
+    embedding_cache = EmbeddingCache(
+        args.cache_dir, model_name_or_path="", layer=0, max_size_gb=args.max_size_gb
+    )
+    if embedding_cache.cache_size > embedding_cache.max_size:
+        embedding_cache.evict()
+    print(
+        f"{args.cache_dir}: {len(embedding_cache)} sentences, "
+        f"{embedding_cache.cache_size / 1024**3:.2f} GB"
+    )
+    embedding_cache.close()
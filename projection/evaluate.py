@@ -0,0 +1,358 @@
+import argparse
+import itertools
+import json
+import multiprocessing
+import os
+from typing import Dict, Iterator, List, Optional, Set, TextIO, Tuple
+
+from projection.compression import open_file, split_compression_extension
+
+# Spans are encoded as a single integer: start << 40 | end << 20 | type_id
+SPAN_BITS: int = 20
+SPAN_MASK: int = (1 << SPAN_BITS) - 1
+
+
+class TagVocabulary:
+    """
+    Map each label type (i.e. PER, LOC, TARGET) to an integer id.
+    """
+
+    def __init__(self):
+        self.type2id: Dict[str, int] = {}
+        self.id2type: List[str] = []
+
+    def __getitem__(self, tag_type: str) -> int:
+        try:
+            return self.type2id[tag_type]
+        except KeyError:
+            self.type2id[tag_type] = len(self.id2type)
+            self.id2type.append(tag_type)
+            return self.type2id[tag_type]
+
+    def __len__(self) -> int:
+        return len(self.id2type)
+
+
+def encode_span(start: int, end: int, type_id: int) -> int:
+    return (start << (2 * SPAN_BITS)) | (end << SPAN_BITS) | type_id
+
+
+def decode_span(span: int) -> Tuple[int, int, int]:
+    return span >> (2 * SPAN_BITS), (span >> SPAN_BITS) & SPAN_MASK, span & SPAN_MASK
+
+
+def read_sentence_spans(
+    file: TextIO, vocabulary: TagVocabulary, filename: str = ""
+) -> Iterator[Tuple[int, Set[int]]]:
+    """
+    Read a tsv file (one "word tag" line per word, sentences separated by an empty line) and yield the number
+    of words and the set of encoded spans of each sentence. IOB, IOB2 and BILOU encodings are supported:
+    a span starts with a B- or U- tag, or with an I-/L- tag that does not continue the previous span, and it ends
+    with an L- or U- tag or when the next tag does not continue it. Extra columns after the tag are ignored.
+    """
+    spans: Set[int] = set()
+    num_words: int = 0
+    span_start: int = -1
+    span_type: str = ""
+
+    for line_no, line in enumerate(file):
+        fields = line.split()
+        if not fields:
+            if span_start != -1:
+                spans.add(encode_span(span_start, num_words - 1, vocabulary[span_type]))
+            if num_words:
+                yield num_words, spans
+            spans = set()
+            num_words = 0
+            span_start = -1
+            span_type = ""
+            continue
+
+        try:
+            tag = fields[1]
+        except IndexError:
+            raise ValueError(
+                f"Error in line {line_no} of {filename}, unable to find the tag. Text: {line}"
+            )
+
+        if tag == "O":
+            if span_start != -1:
+                spans.add(encode_span(span_start, num_words - 1, vocabulary[span_type]))
+                span_start = -1
+                span_type = ""
+        else:
+            try:
+                b, t = tag.split("-", 1)
+            except ValueError:
+                raise ValueError(
+                    f"Error in line {line_no} of {filename}, unable to split the tag in 2 fields. "
+                    f"Text: {line} Tag: {tag}"
+                )
+
+            if b in ("B", "U") or span_start == -1 or t != span_type:
+                if span_start != -1:
+                    spans.add(
+                        encode_span(span_start, num_words - 1, vocabulary[span_type])
+                    )
+                span_start = num_words
+                span_type = t
+
+            if b in ("L", "U"):
+                spans.add(encode_span(span_start, num_words, vocabulary[span_type]))
+                span_start = -1
+                span_type = ""
+
+        num_words += 1
+
+    if span_start != -1:
+        spans.add(encode_span(span_start, num_words - 1, vocabulary[span_type]))
+    if num_words:
+        yield num_words, spans
+
+
+def f1_scores(true_positives: int, num_gold: int, num_predicted: int) -> Dict:
+    precision: float = true_positives / num_predicted if num_predicted else 0.0
+    recall: float = true_positives / num_gold if num_gold else 0.0
+    f1: float = (
+        2 * precision * recall / (precision + recall) if precision + recall else 0.0
+    )
+    return {
+        "precision": precision,
+        "recall": recall,
+        "f1": f1,
+        "true_positives": true_positives,
+        "gold_spans": num_gold,
+        "predicted_spans": num_predicted,
+    }
+
+
+def evaluate_files(gold_path: str, predictions_path: str) -> Dict:
+    """
+    Compute the span precision, recall and F1 of a projected dataset against a gold dataset in a single pass.
+    Both files must have the same sentences and the same number of words in each sentence.
+    :param str gold_path: Path to the gold tsv dataset.
+    :param str predictions_path: Path to the predicted (i.e. automatically projected) tsv dataset.
+    :return: Micro averaged scores and the scores of each label type.
+    """
+    vocabulary = TagVocabulary()
+    true_positives: List[int] = []
+    num_gold: List[int] = []
+    num_predicted: List[int] = []
+    num_sentences: int = 0
+
+    def add_spans(counts: List[int], spans: Set[int]):
+        for span in spans:
+            type_id = span & SPAN_MASK
+            if type_id >= len(counts):
+                counts.extend([0] * (type_id + 1 - len(counts)))
+            counts[type_id] += 1
+
+    with open_file(gold_path) as gold_file, open_file(
+        predictions_path
+    ) as predictions_file:
+        gold_sentences = read_sentence_spans(gold_file, vocabulary, gold_path)
+        predicted_sentences = read_sentence_spans(
+            predictions_file, vocabulary, predictions_path
+        )
+
+        for gold_sentence, predicted_sentence in itertools.zip_longest(
+            gold_sentences, predicted_sentences
+        ):
+            if gold_sentence is None or predicted_sentence is None:
+                raise ValueError(
+                    f"{gold_path} and {predictions_path} have a different number of sentences."
+                )
+            gold_words, gold_spans = gold_sentence
+            predicted_words, predicted_spans = predicted_sentence
+            if gold_words != predicted_words:
+                raise ValueError(
+                    f"Sentence {num_sentences} has {gold_words} words in {gold_path} and {predicted_words} words in "
+                    f"{predictions_path}."
+                )
+            add_spans(num_gold, gold_spans)
+            add_spans(num_predicted, predicted_spans)
+            add_spans(true_positives, gold_spans & predicted_spans)
+            num_sentences += 1
+
+    for counts in (true_positives, num_gold, num_predicted):
+        counts.extend([0] * (len(vocabulary) - len(counts)))
+
+    results: Dict = {
+        "gold_path": gold_path,
+        "predictions_path": predictions_path,
+        "sentences": num_sentences,
+        **f1_scores(sum(true_positives), sum(num_gold), sum(num_predicted)),
+        "types": {
+            tag_type: f1_scores(
+                true_positives[type_id], num_gold[type_id], num_predicted[type_id]
+            )
+            for type_id, tag_type in enumerate(vocabulary.id2type)
+        },
+    }
+
+    return results
+
+
+# Splits of the datasets, the last field of their names: DeepL.Iker.test.tsv
+SPLITS = ["train", "dev", "test"]
+
+
+def is_dataset(filename: str) -> bool:
+    # Datasets can be compressed: DeepL.Iker.test.tsv.gz
+    return split_compression_extension(filename)[0].endswith(".tsv")
+
+
+def dataset_name(filename: str) -> str:
+    return split_compression_extension(filename)[0][: -len(".tsv")]
+
+
+def find_gold_path(
+    predictions_path: str, predictions_dir: str, gold_dir: str
+) -> Optional[str]:
+    """
+    Find the gold dataset of a projected dataset. The gold dataset must be in the same relative directory
+    (i.e. en2es), its split (last field) must be the split of the projected dataset and any other field of its name
+    must be the translation system (first field) of the projected dataset:
+    en2es/DeepL.50000.simalign.test.tsv => en2es/DeepL.Iker.test.tsv
+    en2fr/DeepL.50000.simalign.test.tsv => en2fr/Nayla.DeepL.test.tsv
+    Returns None if there is no gold dataset or if there are several candidates.
+    """
+    relative_dir = os.path.relpath(os.path.dirname(predictions_path), predictions_dir)
+    candidates_dir = os.path.join(gold_dir, relative_dir)
+    if not os.path.isdir(candidates_dir):
+        return None
+
+    fields = dataset_name(os.path.basename(predictions_path)).split(".")
+    candidates = []
+    for filename in sorted(os.listdir(candidates_dir)):
+        if not is_dataset(filename):
+            continue
+        gold_fields = dataset_name(filename).split(".")
+        if gold_fields[-1] == fields[-1] and fields[0] in gold_fields[:-1]:
+            candidates.append(os.path.join(candidates_dir, filename))
+
+    if len(candidates) > 1:
+        print(
+            f"WARNING: Several gold datasets found for {predictions_path}: {candidates}."
+        )
+    return candidates[0] if len(candidates) == 1 else None
+
+
+def find_evaluation_pairs(gold_dir: str, predictions_dir: str) -> List[Tuple[str, str]]:
+    pairs: List[Tuple[str, str]] = []
+    skipped: List[str] = []
+    for root, dirs, files in os.walk(predictions_dir):
+        dirs.sort()
+        for filename in sorted(files):
+            if not is_dataset(filename):
+                continue
+            predictions_path = os.path.join(root, filename)
+            fields = dataset_name(filename).split(".")
+            if len(fields) > 2 and fields[-2] in SPLITS:
+                # Datasets of combined splits (DeepL.50000.awesome.train.test.tsv) have no gold dataset
+                print(
+                    f"WARNING: {predictions_path} is a combination of splits. Skipping."
+                )
+                continue
+            gold_path = find_gold_path(predictions_path, predictions_dir, gold_dir)
+            if gold_path is None:
+                print(
+                    f"WARNING: No gold dataset found for {predictions_path}. Skipping."
+                )
+                skipped.append(predictions_path)
+            else:
+                pairs.append((gold_path, predictions_path))
+    if skipped:
+        print(
+            f"WARNING: {len(skipped)} of {len(pairs) + len(skipped)} projected datasets in {predictions_dir} have "
+            f"no gold dataset in {gold_dir}."
+        )
+    return pairs
+
+
+def _evaluate_pair(pair: Tuple[str, str]) -> Dict:
+    gold_path, predictions_path = pair
+    try:
+        return evaluate_files(gold_path, predictions_path)
+    except ValueError as e:
+        return {
+            "gold_path": gold_path,
+            "predictions_path": predictions_path,
+            "error": str(e),
+        }
+
+
+def evaluate_pairs(
+    pairs: List[Tuple[str, str]], num_workers: Optional[int] = None
+) -> List[Dict]:
+    """
+    Evaluate a list of (gold_path, predictions_path) pairs in parallel. Pairs that cannot be evaluated
+    (i.e. the files have different sentences) are returned with an error message instead of the scores.
+    """
+    if not pairs:
+        return []
+    with multiprocessing.Pool(min(num_workers or os.cpu_count(), len(pairs))) as pool:
+        return pool.map(_evaluate_pair, pairs)
+
+
+def print_results(results: List[Dict]) -> None:
+    print("precision\trecall\tf1\tpredictions_path")
+    for result in results:
+        if "error" in result:
+            print(f"-\t-\t-\t{result['predictions_path']} ({result['error']})")
+        else:
+            print(
+                f"{result['precision']:.4f}\t{result['recall']:.4f}\t{result['f1']:.4f}\t"
+                f"{result['predictions_path']}"
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Span precision, recall and F1 of projected datasets against gold datasets"
+    )
+    parser.add_argument(
+        "--gold",
+        type=str,
+        required=True,
+        help="Path to the gold dataset (tsv format). If --predictions is a directory, path to the directory with "
+        "the gold datasets, each projected dataset is evaluated against the gold dataset in the same relative "
+        "directory that has its split and its translation system as another field of the name (i.e. "
+        "en2es/DeepL.50000.simalign.test.tsv => en2es/DeepL.Iker.test.tsv, en2fr/DeepL.50000.simalign.test.tsv => "
+        "en2fr/Nayla.DeepL.test.tsv)",
+    )
+    parser.add_argument(
+        "--predictions",
+        type=str,
+        required=True,
+        nargs="+",
+        help="Paths to the projected datasets (tsv format) or to a directory with projected datasets",
+    )
+    parser.add_argument(
+        "--num_workers",
+        type=int,
+        default=None,
+        help="Number of datasets evaluated in parallel. Defaults to the number of CPUs",
+    )
+    parser.add_argument(
+        "--output_path",
+        type=str,
+        default=None,
+        help="If set, the scores will be stored in this path (json format)",
+    )
+
+    args = parser.parse_args()
+
+    evaluation_pairs: List[Tuple[str, str]] = []
+    for predictions in args.predictions:
+        if os.path.isdir(predictions):
+            evaluation_pairs.extend(find_evaluation_pairs(args.gold, predictions))
+        else:
+            evaluation_pairs.append((args.gold, predictions))
+
+    evaluation_results = evaluate_pairs(evaluation_pairs, args.num_workers)
+    print_results(evaluation_results)
+
+    if args.output_path:
+        with open(args.output_path, "w", encoding="utf8") as output_file:
+            json.dump(evaluation_results, output_file, indent=4)
@@ -0,0 +1,202 @@
+import json
+import resource
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Dict, List, Optional
+
+
+class StageTimer:
+    """
+    Context manager that adds the time spent inside the block to a stage of the run report.
+    """
+
+    def __init__(self, report: "RunReport", name: str):
+        self.report = report
+        self.name = name
+        self.start_time: float = 0.0
+
+    def __enter__(self):
+        self.start_time = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.report.add_time(self.name, time.perf_counter() - self.start_time)
+
+
+class NullTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+
+NULL_TIMER = NullTimer()
+
+
+def peak_rss_mb() -> float:
+    """
+    Peak resident memory of this process and of its finished child processes (aligners, projection workers).
+    """
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    unit: int = 1 if sys.platform == "darwin" else 1024
+    return (
+        max(
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+        )
+        * unit
+        / (1024 * 1024)
+    )
+
+
+class RunReport:
+    """
+    Per-stage timings and counters of a run. Timers and counters are identified by name (i.e. "conll2text/train"),
+    counters can be grouped in sections (i.e. one per output file).
+    """
+
+    enabled: bool = True
+
+    def __init__(self):
+        self.start_time: float = time.perf_counter()
+        self.timings: Dict[str, float] = {}
+        self.calls: Counter = Counter()
+        self.counters: Dict[str, Counter] = {}
+
+    def timer(self, name: str) -> StageTimer:
+        return StageTimer(self, name)
+
+    def add_time(self, name: str, seconds: float) -> None:
+        self.timings[name] = self.timings.get(name, 0.0) + seconds
+        self.calls[name] += 1
+
+    def count(self, name: str, value: int = 1, section: str = "run") -> None:
+        self.counters.setdefault(section, Counter())[name] += value
+
+    def update(self, counters: Dict[str, int], section: str = "run") -> None:
+        self.counters.setdefault(section, Counter()).update(counters)
+
+    def to_dict(self) -> Dict:
+        return {
+            "wall_time": time.perf_counter() - self.start_time,
+            "peak_rss_mb": peak_rss_mb(),
+            "stages": {
+                name: {"seconds": seconds, "calls": self.calls[name]}
+                for name, seconds in self.timings.items()
+            },
+            "counters": {
+                section: dict(counters) for section, counters in self.counters.items()
+            },
+        }
+
+    def save(self, output_path: str) -> None:
+        with open(output_path, "w", encoding="utf8") as output_file:
+            json.dump(self.to_dict(), output_file, indent=4)
+        print(f"Run report stored in {output_path}")
+
+
+class DisabledRunReport(RunReport):
+    """
+    Run report used when the instrumentation is disabled, every method is a no-op.
+    """
+
+    enabled: bool = False
+
+    def timer(self, name: str) -> NullTimer:
+        return NULL_TIMER
+
+    def add_time(self, name: str, seconds: float) -> None:
+        pass
+
+    def count(self, name: str, value: int = 1, section: str = "run") -> None:
+        pass
+
+    def update(self, counters: Dict[str, int], section: str = "run") -> None:
+        pass
+
+    def save(self, output_path: str) -> None:
+        pass
+
+
+class LatencyHistogram:
+    """
+    Histogram of latencies with fixed buckets (upper bounds in milliseconds). It can be updated from several
+    threads. The quantiles are the upper bound of the bucket that contains them.
+    """
+
+    BUCKETS_MS: List[float] = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000]
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # The last bucket counts the latencies larger than the last bound
+        self.counts: List[int] = [0] * (len(self.BUCKETS_MS) + 1)
+        self.count: int = 0
+        self.total_ms: float = 0.0
+        self.max_ms: float = 0.0
+
+    def add(self, seconds: float) -> None:
+        milliseconds: float = seconds * 1000
+        bucket: int = next(
+            (i for i, bound in enumerate(self.BUCKETS_MS) if milliseconds <= bound),
+            len(self.BUCKETS_MS),
+        )
+        with self.lock:
+            self.counts[bucket] += 1
+            self.count += 1
+            self.total_ms += milliseconds
+            self.max_ms = max(self.max_ms, milliseconds)
+
+    def quantile(self, q: float) -> float:
+        with self.lock:
+            if self.count == 0:
+                return 0.0
+            rank: float = q * self.count
+            seen: int = 0
+            for bound, count in zip(self.BUCKETS_MS, self.counts):
+                seen += count
+                if seen >= rank:
+                    return min(bound, self.max_ms)
+            return self.max_ms
+
+    def to_dict(self) -> Dict:
+        with self.lock:
+            buckets = {
+                f"<={bound}ms": count
+                for bound, count in zip(self.BUCKETS_MS, self.counts)
+            }
+            buckets[f">{self.BUCKETS_MS[-1]}ms"] = self.counts[-1]
+            count, total_ms, max_ms = self.count, self.total_ms, self.max_ms
+        return {
+            "count": count,
+            "mean_ms": total_ms / count if count else 0.0,
+            "max_ms": max_ms,
+            "p50_ms": self.quantile(0.5),
+            "p90_ms": self.quantile(0.9),
+            "p99_ms": self.quantile(0.99),
+            "buckets": buckets,
+        }
+
+
+_disabled_run_report = DisabledRunReport()
+_run_report: RunReport = _disabled_run_report
+
+
+def get_run_report() -> RunReport:
+    """
+    The run report of the current run. If the instrumentation is disabled, a report that ignores everything.
+    """
+    return _run_report
+
+
+def enable_run_report(report: Optional[RunReport] = None) -> RunReport:
+    global _run_report
+    _run_report = report if report is not None else RunReport()
+    return _run_report
+
+
+def disable_run_report() -> None:
+    global _run_report
+    _run_report = _disabled_run_report
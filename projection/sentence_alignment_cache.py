@@ -0,0 +1,168 @@
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from projection.alignment_cache import file_hash, method_code_hash
+
+# Persistent cache of the alignments of sentence pairs, shared by every dataset. It is a SQLite database with a
+# single table: key (sha256 of the sentence pair, the alignment method, its parameters and the model) => alignment
+# (talp line). Only methods that align each sentence pair independently can use it (SimAlign, or awesome with a
+# model that is not trained in the same run).
+
+CACHE_VERSION: int = 1
+DEFAULT_SENTENCE_CACHE_PATH: str = os.environ.get(
+    "SENTENCE_ALIGNMENT_CACHE",
+    os.path.join(
+        os.path.expanduser("~"),
+        ".cache",
+        "easy_label_projection",
+        "sentence_alignments.sqlite",
+    ),
+)
+
+
+def model_fingerprint(model_name_or_path: str) -> str:
+    """
+    Identify a model. For a local model, the hash of its files, so a model trained again in the same directory
+    gets a different fingerprint. For a Huggingface Hub model, its name.
+    """
+    if not os.path.isdir(model_name_or_path):
+        return model_name_or_path
+    sha256 = hashlib.sha256()
+    for root, dirs, files in os.walk(model_name_or_path):
+        dirs.sort()
+        for filename in sorted(files):
+            path = os.path.join(root, filename)
+            sha256.update(os.path.relpath(path, model_name_or_path).encode("utf8"))
+            sha256.update(file_hash(path).encode("utf8"))
+    return sha256.hexdigest()
+
+
+class SentenceAlignmentCache:
+    """
+    Key-value store of sentence pair alignments. Keys are namespaced by the alignment method, the model and the
+    parameters, so the same database can be shared by every method and model.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        alignment_method: str,
+        model_name_or_path: str,
+        parameters: Dict,
+        batch_size: int = 500,
+    ):
+        self.path = path
+        self.batch_size = batch_size
+        self.namespace: bytes = hashlib.sha256(
+            json.dumps(
+                {
+                    "version": CACHE_VERSION,
+                    "method": alignment_method,
+                    "code": method_code_hash(alignment_method),
+                    "model": model_fingerprint(model_name_or_path),
+                    "parameters": parameters,
+                },
+                sort_keys=True,
+            ).encode("utf8")
+        ).digest()
+
+        os.makedirs(os.path.abspath(os.path.dirname(path)), exist_ok=True)
+        # The database can be shared by several processes, wait for the locks instead of failing
+        self.connection = sqlite3.connect(path, timeout=600)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS alignments (key BLOB PRIMARY KEY, alignment TEXT NOT NULL)"
+        )
+        self.connection.commit()
+
+    def key(
+        self, source_sentence: str, target_sentence: str, variant: str = ""
+    ) -> bytes:
+        """
+        Key of a sentence pair. variant distinguishes several alignments of the same pair computed in a single run
+        (i.e. the SimAlign matching methods).
+        """
+        sha256 = hashlib.sha256(self.namespace)
+        for text in (source_sentence, target_sentence, variant):
+            sha256.update(text.encode("utf8"))
+            sha256.update(b"\x00")
+        return sha256.digest()
+
+    def get_many(self, keys: List[bytes]) -> Dict[bytes, str]:
+        """
+        Alignments of the keys that are in the cache.
+        """
+        alignments: Dict[bytes, str] = {}
+        for i in range(0, len(keys), self.batch_size):
+            batch = keys[i : i + self.batch_size]
+            alignments.update(
+                self.connection.execute(
+                    f"SELECT key, alignment FROM alignments WHERE key IN ({','.join('?' * len(batch))})",
+                    batch,
+                )
+            )
+        return alignments
+
+    def put_many(self, alignments: Iterable[Tuple[bytes, str]]) -> None:
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO alignments (key, alignment) VALUES (?, ?)",
+                alignments,
+            )
+
+    def __len__(self) -> int:
+        return self.connection.execute("SELECT COUNT(*) FROM alignments").fetchone()[0]
+
+    def close(self) -> None:
+        self.connection.close()
+
+
+def split_cached_pairs(
+    sentence_cache: SentenceAlignmentCache,
+    source_sentences: List[str],
+    target_sentences: List[str],
+) -> Tuple[List[bytes], List[Optional[str]], List[int]]:
+    """
+    Look up the alignments of a list of sentence pairs.
+    :return: The key of each pair, the cached alignment of each pair (None if it is not in the cache) and the
+    indexes of the pairs that are not in the cache.
+    """
+    keys = [
+        sentence_cache.key(source_sentence, target_sentence)
+        for source_sentence, target_sentence in zip(source_sentences, target_sentences)
+    ]
+    hits = sentence_cache.get_many(keys)
+    alignments: List[Optional[str]] = [hits.get(key) for key in keys]
+    misses: List[int] = [
+        i for i, alignment in enumerate(alignments) if alignment is None
+    ]
+    print(
+        f"Sentence alignment cache {sentence_cache.path}: {len(keys) - len(misses)} hits, {len(misses)} misses."
+    )
+    return keys, alignments, misses
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Show the number of sentence pair alignments in the sentence alignment cache"
+    )
+    parser.add_argument(
+        "--cache_path",
+        type=str,
+        default=DEFAULT_SENTENCE_CACHE_PATH,
+        help="Path to the sentence alignment cache (SQLite database)",
+    )
+
+    args = parser.parse_args()
+
+    connection = sqlite3.connect(args.cache_path)
+    num_alignments = connection.execute("SELECT COUNT(*) FROM alignments").fetchone()[0]
+    connection.close()
+    print(
+        f"{args.cache_path}: {num_alignments} sentence pair alignments, "
+        f"{os.path.getsize(args.cache_path) / 1024**2:.1f} MB"
+    )
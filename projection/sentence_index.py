@@ -0,0 +1,303 @@
+import argparse
+import mmap
+import os
+import socket
+import struct
+from typing import List, Optional
+
+import numpy as np
+
+from projection.compression import is_compressed, open_file, split_compression_extension
+
+# Sentence index format (little endian):
+#   header:  magic (8 bytes) | version (uint64) | tsv (uint64) | file size (uint64) | file mtime_ns (uint64) |
+#            num_sentences (uint64)
+#   offsets: int64[num_sentences + 1], sentence i is stored in bytes [offsets[i], offsets[i + 1]) of the file.
+# For txt and talp files a sentence is a line. For tsv files a sentence is a block of lines terminated by an empty
+# line (the empty line belongs to the sentence). For compressed files, the offsets are positions in the decompressed
+# data.
+
+MAGIC: bytes = b"SENTIDX\x00"
+VERSION: int = 1
+HEADER_FORMAT: str = "<8sQQQQQ"
+HEADER_SIZE: int = struct.calcsize(HEADER_FORMAT)
+INDEX_EXTENSION: str = ".sentences.idx"
+
+NEWLINE: int = ord("\n")
+# ASCII bytes that are not removed by str.strip(). Lines without them (and without non-ASCII bytes) are empty.
+ASCII_CONTENT = np.zeros(256, dtype=bool)
+ASCII_CONTENT[:128] = True
+ASCII_CONTENT[[ord(c) for c in " \t\n\r\x0b\x0c\x1c\x1d\x1e\x1f"]] = False
+NON_ASCII = np.zeros(256, dtype=bool)
+NON_ASCII[128:] = True
+
+
+def index_path(path: str) -> str:
+    return path + INDEX_EXTENSION
+
+
+def find_line_ends(data: mmap.mmap, block_size: int = 1 << 24) -> np.ndarray:
+    """
+    Offsets of the byte after each line end (newline) of the file. If the last line has no newline, the file size
+    is added so the last line is also included.
+    """
+    line_ends = []
+    for block_start in range(0, len(data), block_size):
+        block = np.frombuffer(
+            data,
+            dtype=np.uint8,
+            count=min(block_size, len(data) - block_start),
+            offset=block_start,
+        )
+        line_ends.append(np.flatnonzero(block == NEWLINE) + (block_start + 1))
+    line_ends = np.concatenate(line_ends) if line_ends else np.zeros(0, dtype=np.int64)
+    if len(data) and (not len(line_ends) or line_ends[-1] != len(data)):
+        line_ends = np.append(line_ends, len(data))
+    return line_ends.astype(np.int64)
+
+
+def find_empty_lines(
+    data: mmap.mmap, line_ends: np.ndarray, block_size: int = 1 << 24
+) -> np.ndarray:
+    """
+    Mask of the lines that are empty after str.strip(). We count the ASCII non-whitespace and the non-ASCII bytes
+    of each line with cumulative sums, lines with non-ASCII bytes only are decoded and checked in python
+    (unicode whitespace).
+    """
+    content_cumsum = np.zeros(len(line_ends), dtype=np.int64)
+    non_ascii_cumsum = np.zeros(len(line_ends), dtype=np.int64)
+    content_total: int = 0
+    non_ascii_total: int = 0
+    for block_start in range(0, len(data), block_size):
+        block = np.frombuffer(
+            data,
+            dtype=np.uint8,
+            count=min(block_size, len(data) - block_start),
+            offset=block_start,
+        )
+        content = np.cumsum(ASCII_CONTENT[block], dtype=np.int64)
+        non_ascii = np.cumsum(NON_ASCII[block], dtype=np.int64)
+        # Lines whose last byte is in this block
+        first = np.searchsorted(line_ends, block_start + 1, side="left")
+        last = np.searchsorted(line_ends, block_start + len(block), side="right")
+        local_ends = line_ends[first:last] - block_start - 1
+        content_cumsum[first:last] = content_total + content[local_ends]
+        non_ascii_cumsum[first:last] = non_ascii_total + non_ascii[local_ends]
+        content_total += int(content[-1])
+        non_ascii_total += int(non_ascii[-1])
+
+    content_counts = np.diff(content_cumsum, prepend=0)
+    non_ascii_counts = np.diff(non_ascii_cumsum, prepend=0)
+    empty = content_counts == 0
+    line_starts = np.concatenate(([0], line_ends[:-1]))
+    for line_no in np.flatnonzero(empty & (non_ascii_counts > 0)).tolist():
+        line = data[line_starts[line_no] : line_ends[line_no]]
+        empty[line_no] = line.decode("utf8", errors="replace").strip() == ""
+    return empty
+
+
+def sentence_offsets(
+    line_ends: np.ndarray, empty: Optional[np.ndarray] = None
+) -> np.ndarray:
+    """
+    Offsets of the sentences of a file given the end of each line. For tsv files, empty is the mask of the empty
+    lines: a sentence ends with each empty line and the lines after the last empty line are the last sentence.
+    """
+    if empty is None:
+        return np.concatenate(([0], line_ends)).astype(np.int64)
+    sentence_ends = line_ends[empty]
+    if len(line_ends) and not empty[-1]:
+        sentence_ends = np.append(sentence_ends, line_ends[-1])
+    return np.concatenate(([0], sentence_ends)).astype(np.int64)
+
+
+def build_offsets(path: str, tsv: bool) -> np.ndarray:
+    """
+    Scan the file once and return the offsets of its sentences (see the index format above).
+    """
+    if is_compressed(path):
+        return build_compressed_offsets(path, tsv=tsv)
+
+    if os.path.getsize(path) == 0:
+        return np.zeros(1, dtype=np.int64)
+
+    with open(path, "rb") as file, mmap.mmap(
+        file.fileno(), 0, access=mmap.ACCESS_READ
+    ) as data:
+        line_ends = find_line_ends(data)
+        return sentence_offsets(
+            line_ends, find_empty_lines(data, line_ends) if tsv else None
+        )
+
+
+def build_compressed_offsets(
+    path: str, tsv: bool, block_size: int = 1 << 24
+) -> np.ndarray:
+    """
+    Same as build_offsets for compressed files, that cannot be memory-mapped. The file is decompressed one block of
+    complete lines at a time.
+    """
+    line_ends: List[np.ndarray] = [np.zeros(0, dtype=np.int64)]
+    empty: List[np.ndarray] = [np.zeros(0, dtype=bool)]
+    block_start: int = 0
+    remainder: bytes = b""
+    with open_file(path, "rb") as file:
+        while True:
+            block: bytes = file.read(block_size)
+            if block:
+                block = remainder + block
+                last_newline: int = block.rfind(b"\n")
+                remainder = block[last_newline + 1 :]
+                block = block[: last_newline + 1]
+                if not block:
+                    continue
+            elif remainder:
+                # The last line does not end with a newline
+                block, remainder = remainder, b""
+            else:
+                break
+
+            block_line_ends = find_line_ends(block)
+            if tsv:
+                empty.append(find_empty_lines(block, block_line_ends))
+            line_ends.append(block_line_ends + block_start)
+            block_start += len(block)
+
+    return sentence_offsets(
+        np.concatenate(line_ends), np.concatenate(empty) if tsv else None
+    )
+
+
+class SentenceIndex:
+    """
+    Byte offset of every sentence of a tsv, txt or talp file. Gives the number of sentences in O(1) and random
+    access to any sentence. The index is built in a single pass over the file and cached in a sidecar file
+    ({path}.sentences.idx), it is rebuilt if the size or the modification time of the file change. Random access to
+    a sentence of a compressed file decompresses the file up to the sentence.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        tsv: bool = False,
+        cache: bool = True,
+        offsets: Optional[np.ndarray] = None,
+    ):
+        """
+        :param str path: Path to the file.
+        :param bool tsv: Whether the file is a tsv dataset (sentences separated by an empty line).
+        :param bool cache: Whether to load the index from the sidecar file and save it.
+        :param np.ndarray offsets: Offsets of the sentences, if they were already found while reading the file
+        (i.e. by conll2text). The file is not scanned again.
+        """
+        self.path = path
+        self.tsv = tsv
+        stat = os.stat(path)
+        if offsets is not None:
+            self.offsets = offsets.astype(np.int64)
+            if cache:
+                self.save(stat.st_size, stat.st_mtime_ns)
+            return
+        self.offsets: Optional[np.ndarray] = (
+            self.load(stat.st_size, stat.st_mtime_ns) if cache else None
+        )
+        if self.offsets is None:
+            self.offsets = build_offsets(path, tsv=tsv)
+            if cache:
+                self.save(stat.st_size, stat.st_mtime_ns)
+
+    def load(self, file_size: int, mtime_ns: int) -> Optional[np.ndarray]:
+        try:
+            with open(index_path(self.path), "rb") as index_file:
+                header = index_file.read(HEADER_SIZE)
+                if len(header) != HEADER_SIZE:
+                    return None
+                magic, version, tsv, size, mtime, num_sentences = struct.unpack(
+                    HEADER_FORMAT, header
+                )
+                if (
+                    magic != MAGIC
+                    or version != VERSION
+                    or bool(tsv) != self.tsv
+                    or size != file_size
+                    or mtime != mtime_ns
+                ):
+                    return None
+                offsets = np.fromfile(index_file, dtype="<i8")
+        except OSError:
+            return None
+        if len(offsets) != num_sentences + 1:
+            return None
+        return offsets.astype(np.int64)
+
+    def save(self, file_size: int, mtime_ns: int) -> None:
+        # The index is only a cache, if we cannot write it (i.e. read-only directory) we keep it in memory.
+        # Several processes (or machines sharing the filesystem) may build the same index, each one writes its own
+        # temporary file and atomically replaces the index.
+        tmp_path: str = (
+            f"{index_path(self.path)}.{socket.gethostname()}.{os.getpid()}.tmp"
+        )
+        try:
+            with open(tmp_path, "wb") as index_file:
+                index_file.write(
+                    struct.pack(
+                        HEADER_FORMAT,
+                        MAGIC,
+                        VERSION,
+                        int(self.tsv),
+                        file_size,
+                        mtime_ns,
+                        len(self),
+                    )
+                )
+                index_file.write(self.offsets.astype("<i8").tobytes())
+            os.replace(tmp_path, index_path(self.path))
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def offset(self, index: int) -> int:
+        """
+        Byte offset of sentence index. offset(len(self)) is the size of the file.
+        """
+        return int(self.offsets[index])
+
+    def __getitem__(self, index: int) -> str:
+        """
+        Raw text of a sentence: the line for txt and talp files, the lines of the sentence (including the
+        empty line that ends it) for tsv files.
+        """
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(
+                f"Sentence {index} out of range. {self.path} has {len(self)} sentences."
+            )
+        with open_file(self.path, "rb", offset=self.offset(index)) as file:
+            data = file.read(int(self.offsets[index + 1] - self.offsets[index]))
+        return data.decode("utf8")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Build the sentence index of tsv, txt or talp files"
+    )
+    parser.add_argument(
+        "--paths",
+        type=str,
+        required=True,
+        nargs="+",
+        help="Paths to the files. Files with the .tsv extension are indexed as tsv files (sentences separated by "
+        "an empty line), the rest as one sentence per line. Compressed files (.gz, .zst, .xz) are supported",
+    )
+
+    args = parser.parse_args()
+
+    for input_path in args.paths:
+        sentence_index = SentenceIndex(
+            input_path, tsv=split_compression_extension(input_path)[0].endswith(".tsv")
+        )
+        print(f"{input_path}: {len(sentence_index)} sentences")
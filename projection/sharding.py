@@ -0,0 +1,402 @@
+import argparse
+import json
+import os
+import shutil
+import socket
+import time
+from typing import Dict, List, Optional, Tuple
+
+from projection.alignment_store import BinaryAlignments, is_binary_alignments
+from projection.annotation_proyection import (
+    ProjectionPool,
+    get_projection_function,
+    project_alignments,
+)
+from projection.columnar import is_columnar
+from projection.compression import split_compression_extension, tmp_path
+from projection.instrumentation import get_run_report
+from projection.sentence_index import SentenceIndex
+
+# Shards are coordinated through the filesystem only. Shard k of N of {output_path} is written to
+#   {output_path}.shards/shard_{k}_of_{N}.tsv (.tsv.gz, .tsv.zst or .tsv.xz if the output file is compressed)
+# and, once the shard is complete, its manifest entry is written to
+#   {output_path}.shards/shard_{k}_of_{N}.json
+# Both files are written to a temporary path and atomically renamed, so a manifest entry always describes a
+# complete shard. The merge command checks the manifest entries and concatenates the shards in order.
+
+
+def shard_range(num_sentences: int, num_shards: int, shard_id: int) -> Tuple[int, int]:
+    """
+    Contiguous [start, end) range of sentences of a shard. The sizes of the shards differ by at most one sentence.
+    """
+    assert (
+        num_shards > 0
+    ), f"num_shards should be greater than 0. num_shards: {num_shards}"
+    assert (
+        0 <= shard_id < num_shards
+    ), f"shard_id should be in the [0, {num_shards}) range. shard_id: {shard_id}"
+    return (
+        num_sentences * shard_id // num_shards,
+        num_sentences * (shard_id + 1) // num_shards,
+    )
+
+
+def shards_dir(output_path: str) -> str:
+    return f"{output_path}.shards"
+
+
+def shard_path(output_path: str, num_shards: int, shard_id: int) -> str:
+    # The shards have the compression of the output file, compressed shards are merged by concatenating them
+    return os.path.join(
+        shards_dir(output_path),
+        f"shard_{shard_id:05d}_of_{num_shards:05d}.tsv"
+        + split_compression_extension(output_path)[1],
+    )
+
+
+def manifest_entry_path(output_path: str, num_shards: int, shard_id: int) -> str:
+    return os.path.join(
+        shards_dir(output_path), f"shard_{shard_id:05d}_of_{num_shards:05d}.json"
+    )
+
+
+def num_alignments(alignments_path: str) -> int:
+    if is_binary_alignments(alignments_path):
+        return len(BinaryAlignments(alignments_path))
+    return len(SentenceIndex(alignments_path))
+
+
+def project_shard(
+    source_dataset: str,
+    target_sentences: str,
+    alignments_path: str,
+    output_path: str,
+    num_shards: int,
+    shard_id: int,
+    batch_size: int = 10000,
+    remove_puncs: bool = True,
+    fill_gap_size: int = 1,
+    projection_pool: Optional[ProjectionPool] = None,
+    projection_engine: str = "python",
+) -> Dict:
+    """
+    Project a contiguous range of sentences of a dataset (shard shard_id of num_shards). The readers seek directly
+    to the first sentence of the shard using the sentence index of each file. The shard and its manifest entry are
+    written to the {output_path}.shards directory, use merge_shards to build the output file once every shard
+    is done.
+    :param str source_dataset: Path to the source dataset (tsv format).
+    :param str target_sentences: Path to the target sentences (txt format).
+    :param str alignments_path: Path to the alignments (talp or binary alignment file).
+    :param str output_path: Path of the merged output file.
+    :param int num_shards: Number of shards.
+    :param int shard_id: Shard to project, in the [0, num_shards) range.
+    :return: The manifest entry of the shard.
+    """
+    # Shards are merged by concatenating them, columnar files cannot be concatenated
+    assert not is_columnar(
+        output_path
+    ), f"Sharded projections are written in tsv format. output_path: {output_path}"
+    start_time: float = time.time()
+    source_index = SentenceIndex(source_dataset, tsv=True)
+    target_index = SentenceIndex(target_sentences)
+    num_sentences: int = len(source_index)
+    start, end = shard_range(num_sentences, num_shards, shard_id)
+
+    print(
+        f"Shard projection:\n"
+        f"Source dataset: {source_dataset}.\n"
+        f"Target_sentences: {target_sentences}.\n"
+        f"alignments_path: {alignments_path}.\n"
+        f"output_path: {output_path}.\n"
+        f"shard: {shard_id} of {num_shards}. Sentences [{start}, {end}) of {num_sentences}.\n"
+        f"remove_puncs: {remove_puncs}.\n"
+        f"fill_gap_size: {fill_gap_size}.\n"
+        f"projection_engine: {projection_engine}.\n"
+    )
+
+    output_shard_path: str = shard_path(output_path, num_shards, shard_id)
+    tmp_shard_path: str = tmp_path(
+        output_shard_path, f"{socket.gethostname()}.{os.getpid()}.tmp"
+    )
+
+    project_alignments(
+        source_dataset=source_dataset,
+        target_sentences=target_sentences,
+        alignments_paths=[alignments_path],
+        batch_size=batch_size,
+        output_paths=[tmp_shard_path],
+        projection_functions=[
+            get_projection_function(
+                projection_engine=projection_engine,
+                remove_puncs=remove_puncs,
+                fill_gap_size=fill_gap_size,
+                return_counters=get_run_report().enabled,
+            )
+        ],
+        alignment_ids=[0],
+        projection_pool=projection_pool,
+        start=start,
+        end=end,
+    )
+    os.replace(tmp_shard_path, output_shard_path)
+
+    manifest_entry: Dict = {
+        "shard_id": shard_id,
+        "num_shards": num_shards,
+        "start": start,
+        "end": end,
+        "num_sentences": num_sentences,
+        "inputs": {
+            "source_dataset": {
+                "size": os.path.getsize(source_dataset),
+                "sentences": num_sentences,
+            },
+            "target_sentences": {
+                "size": os.path.getsize(target_sentences),
+                "sentences": len(target_index),
+            },
+            "alignments_path": {
+                "size": os.path.getsize(alignments_path),
+                "sentences": num_alignments(alignments_path),
+            },
+        },
+        "parameters": {
+            "remove_puncs": remove_puncs,
+            "fill_gap_size": fill_gap_size,
+        },
+        "output_size": os.path.getsize(output_shard_path),
+        "hostname": socket.gethostname(),
+        "elapsed_time": time.time() - start_time,
+    }
+
+    entry_path: str = manifest_entry_path(output_path, num_shards, shard_id)
+    tmp_entry_path: str = f"{entry_path}.{socket.gethostname()}.{os.getpid()}.tmp"
+    with open(tmp_entry_path, "w", encoding="utf8") as entry_file:
+        json.dump(manifest_entry, entry_file, indent=4)
+    os.replace(tmp_entry_path, entry_path)
+
+    print(f"Shard {shard_id} of {num_shards} stored in {output_shard_path}")
+
+    return manifest_entry
+
+
+def read_manifest(output_path: str, num_shards: Optional[int] = None) -> List[Dict]:
+    """
+    Read and check the manifest entries of the shards of an output file. Raises a ValueError if a shard is missing,
+    incomplete or was projected with different inputs or parameters than the rest.
+    :param str output_path: Path of the merged output file.
+    :param int num_shards: Number of shards. By default, inferred from the manifest entries.
+    :return: The manifest entries, sorted by shard id.
+    """
+    directory: str = shards_dir(output_path)
+    if not os.path.isdir(directory):
+        raise ValueError(
+            f"No shards found for {output_path}. {directory} does not exist."
+        )
+
+    entries: List[Dict] = []
+    for filename in sorted(os.listdir(directory)):
+        if filename.startswith("shard_") and filename.endswith(".json"):
+            with open(os.path.join(directory, filename), "r", encoding="utf8") as f:
+                entries.append(json.load(f))
+
+    if num_shards is None:
+        shard_counts = {entry["num_shards"] for entry in entries}
+        if len(shard_counts) != 1:
+            raise ValueError(
+                f"Unable to infer the number of shards of {output_path}. Number of shards found in the manifest: "
+                f"{sorted(shard_counts)}. Set num_shards."
+            )
+        num_shards = shard_counts.pop()
+
+    entries = sorted(
+        [entry for entry in entries if entry["num_shards"] == num_shards],
+        key=lambda entry: entry["shard_id"],
+    )
+    missing_shards = sorted(
+        set(range(num_shards)) - {entry["shard_id"] for entry in entries}
+    )
+    if missing_shards:
+        raise ValueError(
+            f"Missing shards of {output_path}: {missing_shards} (of {num_shards} shards)."
+        )
+
+    for entry in entries:
+        for key in ("num_sentences", "inputs", "parameters"):
+            if entry[key] != entries[0][key]:
+                raise ValueError(
+                    f"Shard {entry['shard_id']} and shard 0 of {output_path} have a different {key}. "
+                    f"{entry[key]} != {entries[0][key]}."
+                )
+        if (
+            entry["shard_id"]
+            and entry["start"] != entries[entry["shard_id"] - 1]["end"]
+        ):
+            raise ValueError(
+                f"Shard {entry['shard_id']} of {output_path} starts at sentence {entry['start']}, but shard "
+                f"{entry['shard_id'] - 1} ends at sentence {entries[entry['shard_id'] - 1]['end']}."
+            )
+        output_shard_path: str = shard_path(output_path, num_shards, entry["shard_id"])
+        if (
+            not os.path.exists(output_shard_path)
+            or os.path.getsize(output_shard_path) != entry["output_size"]
+        ):
+            raise ValueError(
+                f"Shard {entry['shard_id']} of {output_path} is incomplete. {output_shard_path} should have "
+                f"{entry['output_size']} bytes."
+            )
+
+    if entries[0]["start"] != 0 or entries[-1]["end"] != entries[0]["num_sentences"]:
+        raise ValueError(
+            f"The shards of {output_path} do not cover the {entries[0]['num_sentences']} sentences of the dataset."
+        )
+
+    return entries
+
+
+def merge_shards(
+    output_path: str, num_shards: Optional[int] = None, remove_shards: bool = False
+) -> List[Dict]:
+    """
+    Concatenate the shards of an output file in order. The merged file is exactly the file that a single
+    dataset_projection run would produce.
+    :param str output_path: Path of the merged output file.
+    :param int num_shards: Number of shards. By default, inferred from the manifest entries.
+    :param bool remove_shards: Remove the shards directory after the merge.
+    :return: The manifest entries of the merged shards.
+    """
+    entries = read_manifest(output_path, num_shards)
+    num_shards = entries[0]["num_shards"]
+
+    tmp_output_path: str = f"{output_path}.{socket.gethostname()}.{os.getpid()}.tmp"
+    with open(tmp_output_path, "wb") as output_file:
+        for entry in entries:
+            with open(
+                shard_path(output_path, num_shards, entry["shard_id"]), "rb"
+            ) as shard_file:
+                shutil.copyfileobj(shard_file, output_file, length=1 << 24)
+    os.replace(tmp_output_path, output_path)
+
+    print(
+        f"Merged {num_shards} shards ({entries[0]['num_sentences']} sentences) into {output_path}"
+    )
+
+    if remove_shards:
+        shutil.rmtree(shards_dir(output_path))
+
+    return entries
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Split the projection of a dataset in shards (i.e. one per machine) and merge them"
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    project_parser = subparsers.add_parser(
+        "project", help="Project a shard of the dataset"
+    )
+    project_parser.add_argument(
+        "--source_dataset",
+        type=str,
+        required=True,
+        help="Path to the source dataset (tsv format)",
+    )
+    project_parser.add_argument(
+        "--target_sentences",
+        type=str,
+        required=True,
+        help="Path to the target sentences (txt format, one sentence per line)",
+    )
+    project_parser.add_argument(
+        "--alignments_path",
+        type=str,
+        required=True,
+        help="Path to the alignments (talp or binary alignment file)",
+    )
+    project_parser.add_argument(
+        "--output_path",
+        type=str,
+        required=True,
+        help="Path of the merged output file (tsv format). The shard is stored in the {output_path}.shards "
+        "directory, which must be in a filesystem shared by all the shards",
+    )
+    project_parser.add_argument(
+        "--num_shards",
+        type=int,
+        required=True,
+        help="Number of shards",
+    )
+    project_parser.add_argument(
+        "--shard_id",
+        type=int,
+        required=True,
+        help="Shard to project, from 0 to num_shards - 1",
+    )
+    project_parser.add_argument(
+        "--batch_size",
+        type=int,
+        default=10000,
+        help="Number of sentences read at once",
+    )
+    project_parser.add_argument(
+        "--fill_gap_size",
+        type=int,
+        default=1,
+        help="Maximum gap size to fill in the projections",
+    )
+    project_parser.add_argument(
+        "--do_not_remove_puncs",
+        action="store_true",
+        help="Allow labels to be projected into punctuation marks",
+    )
+    project_parser.add_argument(
+        "--projection_engine",
+        type=str,
+        default="python",
+        choices=["python", "numpy"],
+        help="Projection engine",
+    )
+
+    merge_parser = subparsers.add_parser(
+        "merge", help="Merge the shards of the dataset into the output file"
+    )
+    merge_parser.add_argument(
+        "--output_path",
+        type=str,
+        required=True,
+        help="Path of the merged output file (tsv format)",
+    )
+    merge_parser.add_argument(
+        "--num_shards",
+        type=int,
+        default=None,
+        help="Number of shards. By default, inferred from the shards directory",
+    )
+    merge_parser.add_argument(
+        "--remove_shards",
+        action="store_true",
+        help="Remove the shards directory after the merge",
+    )
+
+    args = parser.parse_args()
+
+    if args.command == "project":
+        project_shard(
+            source_dataset=args.source_dataset,
+            target_sentences=args.target_sentences,
+            alignments_path=args.alignments_path,
+            output_path=args.output_path,
+            num_shards=args.num_shards,
+            shard_id=args.shard_id,
+            batch_size=args.batch_size,
+            remove_puncs=not args.do_not_remove_puncs,
+            fill_gap_size=args.fill_gap_size,
+            projection_engine=args.projection_engine,
+        )
+    else:
+        merge_shards(
+            output_path=args.output_path,
+            num_shards=args.num_shards,
+            remove_shards=args.remove_shards,
+        )
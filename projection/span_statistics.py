@@ -0,0 +1,62 @@
+from collections import Counter
+from typing import Dict, List
+
+
+class SpanStatistics:
+    """
+    Count the source spans of a dataset and the spans projected into the target sentences. The statistics are
+    updated batch by batch with the output of the projection functions (the "word tag" lines, one sentence
+    per block).
+    """
+
+    def __init__(self):
+        self.num_sentences: int = 0
+        self.source_spans: Counter = Counter()
+        self.projected_spans: Counter = Counter()
+        self.projected_words: Counter = Counter()
+
+    def update(self, tags_type: List[List[str]], projections: List[str]) -> None:
+        for sentence_tags_type in tags_type:
+            self.source_spans.update(sentence_tags_type)
+
+        for projection in projections:
+            for sentence in projection.split("\n\n"):
+                if not sentence.strip():
+                    continue
+                self.num_sentences += 1
+                for line in sentence.split("\n"):
+                    tag = line.rsplit(" ", 1)[-1]
+                    if tag == "O":
+                        continue
+                    tag_type = tag[2:]
+                    self.projected_words[tag_type] += 1
+                    if tag.startswith("B-"):
+                        self.projected_spans[tag_type] += 1
+
+    def to_dict(self) -> Dict:
+        source_spans: int = sum(self.source_spans.values())
+        projected_spans: int = sum(self.projected_spans.values())
+        projected_words: int = sum(self.projected_words.values())
+        return {
+            "sentences": self.num_sentences,
+            "source_spans": source_spans,
+            "projected_spans": projected_spans,
+            "projection_rate": projected_spans / source_spans if source_spans else 0.0,
+            "average_span_length": (
+                projected_words / projected_spans if projected_spans else 0.0
+            ),
+            "types": {
+                tag_type: {
+                    "source_spans": self.source_spans[tag_type],
+                    "projected_spans": self.projected_spans[tag_type],
+                    "average_span_length": (
+                        self.projected_words[tag_type] / self.projected_spans[tag_type]
+                        if self.projected_spans[tag_type]
+                        else 0.0
+                    ),
+                }
+                for tag_type in sorted(
+                    set(self.source_spans) | set(self.projected_spans)
+                )
+            },
+        }
@@ -0,0 +1,220 @@
+import argparse
+import itertools
+import json
+import os
+from typing import Dict, List, Optional
+
+from projection.annotation_proyection import (
+    ProjectionPool,
+    get_projection_function,
+    project_alignments,
+)
+from projection.instrumentation import get_run_report
+from projection.span_statistics import SpanStatistics
+
+
+def sweep_output_path(
+    output_dir: str, output_name: str, remove_puncs: bool, fill_gap_size: int
+) -> str:
+    return os.path.join(
+        output_dir,
+        f"{output_name}.remove_puncs_{remove_puncs}.fill_gap_size_{fill_gap_size}.tsv",
+    )
+
+
+def projection_sweep(
+    source_dataset: str,
+    target_sentences: str,
+    alignments_path: str,
+    output_dir: str,
+    output_name: str,
+    remove_puncs_values: List[bool],
+    fill_gap_sizes: List[int],
+    batch_size: int = 10000,
+    projection_pool: Optional[ProjectionPool] = None,
+    projection_engine: str = "python",
+    span_statistics: bool = False,
+) -> List[Dict]:
+    """
+    Project a dataset with every combination of remove_puncs and fill_gap_size. The source dataset, the target
+    sentences and the alignments are read only once, every configuration is projected on the same batches.
+    :param str source_dataset: Path to the source tsv dataset.
+    :param str target_sentences: Path to the target sentences (one per line).
+    :param str alignments_path: Path to the alignments (talp or binary alignment file).
+    :param str output_dir: Directory where the projected datasets will be stored.
+    :param str output_name: Prefix of the output files. Each configuration is stored in
+    {output_name}.remove_puncs_{remove_puncs}.fill_gap_size_{fill_gap_size}.tsv
+    :param List[bool] remove_puncs_values: Values of remove_puncs to try.
+    :param List[int] fill_gap_sizes: Values of fill_gap_size to try.
+    :param int batch_size: Number of sentences read at once.
+    :param ProjectionPool projection_pool: Pool used to project the batches. If None, a new pool is created.
+    :param str projection_engine: Projection engine, python or numpy.
+    :param bool span_statistics: If set, compute the number of projected spans of each configuration and store them
+    in {output_name}.sweep_statistics.json
+    :return: A list with the configuration, the output path and (optionally) the span statistics of each run.
+    """
+    configurations = list(
+        itertools.product(
+            list(dict.fromkeys(remove_puncs_values)),
+            list(dict.fromkeys(fill_gap_sizes)),
+        )
+    )
+    assert configurations, "At least one remove_puncs and fill_gap_size value needed"
+
+    output_paths: List[str] = [
+        sweep_output_path(output_dir, output_name, remove_puncs, fill_gap_size)
+        for remove_puncs, fill_gap_size in configurations
+    ]
+
+    print(
+        f"Projection sweep:\n"
+        f"Source dataset: {source_dataset}.\n"
+        f"Target_sentences: {target_sentences}.\n"
+        f"alignments_path: {alignments_path}.\n"
+        f"batch_size: {batch_size}.\n"
+        f"output_dir: {output_dir}.\n"
+        f"remove_puncs_values: {remove_puncs_values}.\n"
+        f"fill_gap_sizes: {fill_gap_sizes}.\n"
+        f"projection_engine: {projection_engine}.\n"
+        f"configurations: {len(configurations)}.\n"
+    )
+
+    statistics: Optional[List[SpanStatistics]] = (
+        [SpanStatistics() for _ in configurations] if span_statistics else None
+    )
+
+    project_alignments(
+        source_dataset=source_dataset,
+        target_sentences=target_sentences,
+        alignments_paths=[alignments_path],
+        batch_size=batch_size,
+        output_paths=output_paths,
+        projection_functions=[
+            get_projection_function(
+                projection_engine=projection_engine,
+                remove_puncs=remove_puncs,
+                fill_gap_size=fill_gap_size,
+                return_counters=get_run_report().enabled,
+            )
+            for remove_puncs, fill_gap_size in configurations
+        ],
+        alignment_ids=[0] * len(configurations),
+        projection_pool=projection_pool,
+        span_statistics=statistics,
+    )
+
+    results: List[Dict] = []
+    for config_no, ((remove_puncs, fill_gap_size), output_path) in enumerate(
+        zip(configurations, output_paths)
+    ):
+        result: Dict = {
+            "remove_puncs": remove_puncs,
+            "fill_gap_size": fill_gap_size,
+            "output_path": output_path,
+        }
+        if statistics is not None:
+            result["statistics"] = statistics[config_no].to_dict()
+        results.append(result)
+
+    if statistics is not None:
+        statistics_path = os.path.join(
+            output_dir, f"{output_name}.sweep_statistics.json"
+        )
+        with open(statistics_path, "w", encoding="utf8") as statistics_file:
+            json.dump(results, statistics_file, indent=4)
+
+        print("remove_puncs\tfill_gap_size\tprojected_spans\tprojection_rate")
+        for result in results:
+            print(
+                f"{result['remove_puncs']}\t{result['fill_gap_size']}\t"
+                f"{result['statistics']['projected_spans']}\t"
+                f"{result['statistics']['projection_rate']:.4f}"
+            )
+        print(f"Span statistics stored in {statistics_path}")
+
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Project a dataset with a grid of remove_puncs and fill_gap_size values, "
+        "reading the inputs only once"
+    )
+    parser.add_argument(
+        "--source_dataset",
+        type=str,
+        required=True,
+        help="Path to the source dataset (tsv format)",
+    )
+    parser.add_argument(
+        "--target_sentences",
+        type=str,
+        required=True,
+        help="Path to the target sentences (txt format, one sentence per line)",
+    )
+    parser.add_argument(
+        "--alignments_path",
+        type=str,
+        required=True,
+        help="Path to the alignments (talp or binary alignment file)",
+    )
+    parser.add_argument(
+        "--output_dir",
+        type=str,
+        required=True,
+        help="Path to the output directory",
+    )
+    parser.add_argument(
+        "--output_name",
+        type=str,
+        required=True,
+        help="Prefix of the output files",
+    )
+    parser.add_argument(
+        "--remove_puncs",
+        type=str,
+        nargs="+",
+        default=["true", "false"],
+        choices=["true", "false"],
+        help="Values of remove_puncs to try",
+    )
+    parser.add_argument(
+        "--fill_gap_sizes",
+        type=int,
+        nargs="+",
+        default=[0, 1, 2, 3],
+        help="Values of fill_gap_size to try",
+    )
+    parser.add_argument(
+        "--batch_size",
+        type=int,
+        default=10000,
+        help="Number of sentences read at once",
+    )
+    parser.add_argument(
+        "--projection_engine",
+        type=str,
+        default="python",
+        choices=["python", "numpy"],
+        help="Projection engine",
+    )
+    parser.add_argument(
+        "--span_statistics",
+        action="store_true",
+        help="Compute the number of projected spans of each configuration",
+    )
+
+    args = parser.parse_args()
+
+    projection_sweep(
+        source_dataset=args.source_dataset,
+        target_sentences=args.target_sentences,
+        alignments_path=args.alignments_path,
+        output_dir=args.output_dir,
+        output_name=args.output_name,
+        remove_puncs_values=[value == "true" for value in args.remove_puncs],
+        fill_gap_sizes=args.fill_gap_sizes,
+        batch_size=args.batch_size,
+        projection_engine=args.projection_engine,
+        span_statistics=args.span_statistics,
+    )
@@ -0,0 +1,375 @@
+import operator
+import string
+from collections import Counter
+from typing import List, Dict, Optional, Tuple, Union
+
+import numpy as np
+
+from projection.annotation_proyection import fix_collisions
+
+puncs_chars = string.punctuation
+
+
+def is_punctuation(word: str) -> bool:
+    # Same as all([char in puncs for char in word.strip()]) but much faster
+    return word.strip().strip(puncs_chars) == ""
+
+
+def concatenate_ranges(starts: np.ndarray, lengths: np.ndarray) -> np.ndarray:
+    """
+    Concatenate the ranges [starts[i], starts[i] + lengths[i]) into a single flat array.
+    """
+    total: int = int(lengths.sum())
+    if total == 0:
+        return np.zeros(0, dtype=np.int64)
+    offsets = np.cumsum(lengths) - lengths
+    return np.repeat(starts - offsets, lengths) + np.arange(total, dtype=np.int64)
+
+
+def group_limits(is_first: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Given a boolean mask with the first element of each group, return the first and last index of each group.
+    """
+    first = np.flatnonzero(is_first)
+    last = np.append(first[1:], len(is_first))[: len(first)] - 1
+    return first, last
+
+
+def first_of_group(keys: np.ndarray) -> np.ndarray:
+    """
+    Boolean mask with the first element of each run of equal values in a sorted array.
+    """
+    mask = np.ones(len(keys), dtype=bool)
+    mask[1:] = keys[1:] != keys[:-1]
+    return mask
+
+
+class ProjectionBatch:
+    """
+    A batch of sentences represented as flat numpy arrays.
+     - Target words: flat list of words + per sentence offsets.
+     - Source tags: sentence/type-id arrays of the spans.
+     - Alignments: CSR matrix with a row per source word of each span (indptr) and the aligned target words (indices).
+    """
+
+    def __init__(
+        self,
+        sources_words: List[List[str]],
+        sources_tags_type: List[List[str]],
+        sources_tags_ids: List[List[List[int]]],
+        targets_words: List[List[str]],
+        alignments: List[Dict],
+    ):
+        self.num_sentences: int = len(sources_words)
+
+        target_lens = np.fromiter(
+            (len(words) for words in targets_words),
+            dtype=np.int64,
+            count=self.num_sentences,
+        )
+        self.target_offsets = np.concatenate(([0], np.cumsum(target_lens)))
+        self.target_words: List[str] = [
+            word for words in targets_words for word in words
+        ]
+
+        # SOURCE SPANS AND ALIGNMENTS
+        # Spans are stored as sentence/type-id arrays. The alignments of the source words that belong to a span
+        # are stored as a CSR matrix, with a row per (span, source word) member: indptr are the row offsets and
+        # indices the aligned target words (global ids, sentence offset + word id).
+        self.tag_types: List[str] = []
+        tag_type2id: Dict[str, int] = {}
+        span_sents: List[int] = []
+        span_types: List[int] = []
+        member_spans: List[int] = []
+        member_lens: List[int] = []
+        align_targets: List[int] = []
+        for sent_no, (tags_type, tags_ids, alignment_dictionary) in enumerate(
+            zip(sources_tags_type, sources_tags_ids, alignments)
+        ):
+            assert len(tags_type) == len(tags_ids)
+            for tag_type, tag_ids in zip(tags_type, tags_ids):
+                if tag_type not in tag_type2id:
+                    tag_type2id[tag_type] = len(self.tag_types)
+                    self.tag_types.append(tag_type)
+                span_no: int = len(span_sents)
+                span_sents.append(sent_no)
+                span_types.append(tag_type2id[tag_type])
+                for tag_id in tag_ids:
+                    target_ids = alignment_dictionary.get(tag_id)
+                    if target_ids:
+                        member_spans.append(span_no)
+                        member_lens.append(len(target_ids))
+                        align_targets.extend(target_ids)
+
+        self.span_sents = np.asarray(span_sents, dtype=np.int64)
+        self.span_types = np.asarray(span_types, dtype=np.int64)
+        self.member_spans = np.asarray(member_spans, dtype=np.int64)
+        member_lens = np.asarray(member_lens, dtype=np.int64)
+        self.indptr = np.concatenate(([0], np.cumsum(member_lens)))
+
+        align_targets = np.asarray(align_targets, dtype=np.int64)
+        align_sents = np.repeat(self.span_sents[self.member_spans], member_lens)
+        out_of_range = align_targets >= target_lens[align_sents]
+        if np.any(out_of_range):
+            bad = int(np.argmax(out_of_range))
+            raise IndexError(
+                f"Alignment to target word {align_targets[bad]} found, but the target sentence has "
+                f"{target_lens[align_sents[bad]]} words.\n"
+                f"source_words: {sources_words[align_sents[bad]]}\n"
+                f"target_words: {targets_words[align_sents[bad]]}\n"
+                f"alignments: {alignments[align_sents[bad]]}\n"
+            )
+        self.indices = align_targets + self.target_offsets[align_sents]
+
+    def project_spans(
+        self, remove_puncs: bool, counters: Optional[Counter] = None
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Get the (span, target word) pairs of the projected spans, sorted by span and target word with no duplicates.
+        """
+        pair_spans = np.repeat(self.member_spans, np.diff(self.indptr))
+        pair_targets = self.indices
+
+        num_targets: int = max(len(self.target_words), 1)
+        keys = np.unique(pair_spans * num_targets + pair_targets)
+        pair_spans, pair_targets = keys // num_targets, keys % num_targets
+
+        if remove_puncs and len(pair_targets):
+            unique_targets, inverse = np.unique(pair_targets, return_inverse=True)
+            punc_mask = np.fromiter(
+                (is_punctuation(self.target_words[i]) for i in unique_targets),
+                dtype=bool,
+                count=len(unique_targets),
+            )
+            keep = ~punc_mask[inverse]
+            if counters is not None:
+                counters["punctuation_removals"] += int(
+                    len(keep) - np.count_nonzero(keep)
+                )
+            pair_spans, pair_targets = pair_spans[keep], pair_targets[keep]
+
+        return pair_spans, pair_targets
+
+    @staticmethod
+    def fix_discontinuous_spans(
+        pair_spans: np.ndarray, pair_targets: np.ndarray, fill_gap_size: int
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Split each projected span in groups of consecutive words, merge the groups with small gaps and keep the
+        largest group. Returns the (span, start, end) of the resulting contiguous spans.
+        """
+        # SPLIT IN GROUPS
+        is_new_group = np.ones(len(pair_targets), dtype=bool)
+        is_new_group[1:] = (pair_spans[1:] != pair_spans[:-1]) | (
+            pair_targets[1:] != pair_targets[:-1] + 1
+        )
+        group_first, group_last = group_limits(is_new_group)
+        group_spans = pair_spans[group_first]
+        group_starts = pair_targets[group_first]
+        group_ends = pair_targets[group_last]
+
+        # MERGE GROUPS WITH GAP <= fill_gap_size
+        # A group is merged with the previous one if (group end - merged group start) <= fill_gap_size + 1.
+        # The merged group start depends on the previous merges, so we iterate over the position of the group
+        # inside the span, processing all the spans of the batch at once.
+        first_group_of_span = first_of_group(group_spans)
+        span_first_group = np.flatnonzero(first_group_of_span)
+        group_rank = np.arange(len(group_spans)) - np.repeat(
+            span_first_group, np.diff(np.append(span_first_group, len(group_spans)))
+        )
+        merged_starts = group_starts.copy()
+        for rank in range(1, int(group_rank.max()) + 1 if len(group_rank) else 0):
+            idx = np.flatnonzero(group_rank == rank)
+            prev_starts = merged_starts[idx - 1]
+            merge = group_ends[idx] - prev_starts <= (fill_gap_size + 1)
+            merged_starts[idx[merge]] = prev_starts[merge]
+
+        is_new_segment = merged_starts == group_starts
+        segment_first, segment_last = group_limits(is_new_segment)
+        segment_spans = group_spans[segment_first]
+        segment_starts = group_starts[segment_first]
+        segment_ends = group_ends[segment_last]
+
+        # GET LARGEST GROUP (the first one if there is a tie)
+        order = np.lexsort(
+            (
+                np.arange(len(segment_spans)),
+                -(segment_ends - segment_starts),
+                segment_spans,
+            )
+        )
+        largest = order[first_of_group(segment_spans[order])]
+        return segment_spans[largest], segment_starts[largest], segment_ends[largest]
+
+    def project(
+        self, remove_puncs: bool, fill_gap_size: int, counters: Optional[Counter] = None
+    ) -> np.ndarray:
+        """
+        Project the source tags. Returns, for every target word of the batch, the tag code: -1 for "O",
+        2 * type_id for "B-type" and 2 * type_id + 1 for "I-type". If counters is provided, the number of source
+        spans, dropped spans and punctuation removals are added to it.
+        """
+        pair_spans, pair_targets = self.project_spans(
+            remove_puncs=remove_puncs, counters=counters
+        )
+        spans, starts, ends = self.fix_discontinuous_spans(
+            pair_spans, pair_targets, fill_gap_size=fill_gap_size
+        )
+        sents = self.span_sents[spans]
+        types = self.span_types[spans]
+
+        # FIX COLLISIONS
+        # Spans are contiguous here. Sentences in which two consecutive spans collide are solved with the
+        # reference implementation, the rest are written directly.
+        collision = (sents[1:] == sents[:-1]) & (ends[:-1] >= starts[1:])
+        collision_sents = np.unique(sents[1:][collision])
+        in_collision = np.isin(sents, collision_sents)
+
+        collision_positions: List[int] = []
+        collision_codes: List[int] = []
+        collision_orders: List[int] = []
+        num_collision_spans: int = 0
+        # Spans are sorted by sentence
+        first_spans = np.searchsorted(sents, collision_sents, side="left").tolist()
+        last_spans = np.searchsorted(sents, collision_sents, side="right").tolist()
+        starts_list, ends_list, types_list = (
+            starts.tolist(),
+            ends.tolist(),
+            types.tolist(),
+        )
+        for first_span, last_span in zip(first_spans, last_spans):
+            target_tags_ids = [
+                list(range(start, end + 1))
+                for start, end in zip(
+                    starts_list[first_span:last_span], ends_list[first_span:last_span]
+                )
+            ]
+            target_tags_types = types_list[first_span:last_span]
+            fix_collisions(target_tags_ids, target_tags_types)
+            num_collision_spans += len(target_tags_ids)
+            for tag_no, (tag_ids, tag_type) in enumerate(
+                zip(target_tags_ids, target_tags_types)
+            ):
+                collision_positions.extend(tag_ids)
+                collision_codes.append(tag_type * 2)
+                collision_codes.extend([tag_type * 2 + 1] * (len(tag_ids) - 1))
+                collision_orders.extend([tag_no] * len(tag_ids))
+
+        starts, ends, types = (
+            starts[~in_collision],
+            ends[~in_collision],
+            types[~in_collision],
+        )
+
+        if counters is not None:
+            counters["source_spans"] += len(self.span_sents)
+            counters["dropped_spans"] += len(self.span_sents) - (
+                len(starts) + num_collision_spans
+            )
+        lengths = ends - starts + 1
+        positions = concatenate_ranges(starts, lengths)
+        codes = np.repeat(types * 2 + 1, lengths)
+        codes[np.cumsum(lengths) - lengths] -= 1
+        orders = np.repeat(np.arange(len(starts)), lengths)
+
+        positions = np.concatenate(
+            (positions, np.asarray(collision_positions, dtype=np.int64))
+        )
+        codes = np.concatenate((codes, np.asarray(collision_codes, dtype=np.int64)))
+        orders = np.concatenate((orders, np.asarray(collision_orders, dtype=np.int64)))
+
+        # WRITE TAGS
+        # If two tags write the same word, the last one wins.
+        tags = np.full(len(self.target_words), -1, dtype=np.int64)
+        writers = np.lexsort((orders, positions))
+        is_last_writer = np.ones(len(writers), dtype=bool)
+        is_last_writer[:-1] = positions[writers[1:]] != positions[writers[:-1]]
+        writers = writers[is_last_writer]
+        tags[positions[writers]] = codes[writers]
+        return tags
+
+
+def sentences_projection_vectorized(
+    sources_words: List[List[str]],
+    sources_tags_type: List[List[str]],
+    sources_tags_ids: List[List[List[int]]],
+    target_words: List[List[str]],
+    alignments: List[Dict],
+    remove_puncs: bool = True,
+    fill_gap_size: int = 1,
+    return_counters: bool = False,
+) -> Union[str, Tuple[str, Counter]]:
+    """
+    Same as projection.annotation_proyection.sentences_projection, but the whole batch is projected with numpy
+    array operations. The output (and the counters) are identical.
+    """
+
+    assert (
+        len(sources_words)
+        == len(sources_tags_type)
+        == len(sources_tags_ids)
+        == len(target_words)
+        == len(alignments)
+    ), (
+        f"len(sources_words): {len(sources_words)}. "
+        f"len(sources_tags_type): {len(sources_tags_type)}. "
+        f"len(sources_tags_ids): {len(sources_tags_ids)}. "
+        f"len(target_words): {len(target_words)}. "
+        f"len(alignments): {len(alignments)}."
+    )
+
+    counters: Optional[Counter] = Counter() if return_counters else None
+    if counters is not None:
+        counters["sentences"] += len(sources_words)
+
+    valid_sentences: List[int] = []
+    for sent_no, (source_words, target_words_) in enumerate(
+        zip(sources_words, target_words)
+    ):
+        if target_words_ and source_words:
+            valid_sentences.append(sent_no)
+        else:
+            print(
+                f"Warning, empty sentence found. source_words: {source_words}. target_words: {target_words_}"
+            )
+            if counters is not None:
+                counters["empty_sentences"] += 1
+
+    if not valid_sentences:
+        return ("", counters) if counters is not None else ""
+
+    projection_batch = ProjectionBatch(
+        sources_words=[sources_words[i] for i in valid_sentences],
+        sources_tags_type=[sources_tags_type[i] for i in valid_sentences],
+        sources_tags_ids=[sources_tags_ids[i] for i in valid_sentences],
+        targets_words=[target_words[i] for i in valid_sentences],
+        alignments=[alignments[i] for i in valid_sentences],
+    )
+
+    tags = projection_batch.project(
+        remove_puncs=remove_puncs, fill_gap_size=fill_gap_size, counters=counters
+    )
+
+    # Code c is stored in position c + 1, "O" is in position 0
+    labels: List[str] = [" O"]
+    for tag_type in projection_batch.tag_types:
+        labels.extend([f" B-{tag_type}", f" I-{tag_type}"])
+
+    lines: List[str] = list(
+        map(
+            operator.add,
+            projection_batch.target_words,
+            np.asarray(labels, dtype=object)[tags + 1],
+        )
+    )
+    offsets: List[int] = projection_batch.target_offsets.tolist()
+
+    output: str = "\n\n".join(
+        "\n".join(lines[offsets[i] : offsets[i + 1]])
+        for i in range(projection_batch.num_sentences)
+    )
+
+    if counters is not None:
+        return output, counters
+
+    return output
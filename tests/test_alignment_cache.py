@@ -0,0 +1,113 @@
+import sys
+import types
+from typing import Dict, List
+
+import pytest
+
+from annotation_projection import generate_alignments, get_alignments_path
+
+ALIGNMENT_METHODS: List[str] = ["mgiza", "fast_align", "awesome"]
+
+
+@pytest.fixture
+def aligner_calls(monkeypatch) -> Dict[str, List[List[str]]]:
+    """
+    Replace the mgiza, fast_align and awesome aligners with fakes that, like the real ones, extend the lists of
+    paths with the augmentation corpus in place. Returns the source files each aligner was trained on.
+    """
+    calls: Dict[str, List[List[str]]] = {method: [] for method in ALIGNMENT_METHODS}
+
+    def fake_aligner(alignment_method: str):
+        def generate_word_alignments(
+            source_paths,
+            target_paths,
+            source_parallel_corpus,
+            target_parallel_corpus,
+            output_names,
+            output_dir,
+            **kwargs,
+        ):
+            source_files = source_paths
+            if source_parallel_corpus is not None:
+                source_files += source_parallel_corpus
+            target_files = target_paths
+            if target_parallel_corpus is not None:
+                target_files += target_parallel_corpus
+            calls[alignment_method].append(list(source_paths))
+
+            for output_name in output_names:
+                name, dataset_split = output_name.replace(".talp", "").rsplit(".", 1)
+                with open(
+                    get_alignments_path(
+                        output_dir,
+                        name.rsplit(".", 1)[0],
+                        alignment_method,
+                        dataset_split,
+                    ),
+                    "w",
+                    encoding="utf8",
+                ) as alignments_file:
+                    alignments_file.write("0-0 1-1\n0-0\n")
+
+        return generate_word_alignments
+
+    for alignment_method in ALIGNMENT_METHODS:
+        module = types.ModuleType(f"{alignment_method}.generate_alignments")
+        setattr(
+            module,
+            f"generate_word_alignments_{alignment_method}",
+            fake_aligner(alignment_method),
+        )
+        monkeypatch.setitem(sys.modules, module.__name__, module)
+
+    return calls
+
+
+def test_augmentation_corpus_alignments_are_restored_from_the_cache(
+    tmp_path, aligner_calls
+):
+    """
+    A second run with the same datasets and augmentation corpus restores the alignments of every aligner from the
+    alignment cache, and each aligner is trained on the augmentation corpus once.
+    """
+    paths: Dict[str, str] = {}
+    for name, sentences in [
+        ("source_train", "The food was great .\nGood service\n"),
+        ("target_train", "La comida era genial .\nBuen servicio\n"),
+        ("source_augmentation", "A nice place\n"),
+        ("target_augmentation", "Un buen sitio\n"),
+    ]:
+        paths[name] = str(tmp_path / f"{name}.txt")
+        with open(paths[name], "w", encoding="utf8") as sentences_file:
+            sentences_file.write(sentences)
+
+    for run in ["first", "second"]:
+        generate_alignments(
+            source_train=paths["source_train"],
+            source_dev=None,
+            source_test=None,
+            target_train=paths["target_train"],
+            target_dev=None,
+            target_test=None,
+            source_augmentation=paths["source_augmentation"],
+            target_augmentation=paths["target_augmentation"],
+            output_dir=str(tmp_path / run),
+            output_name="en2es",
+            do_fastalign=True,
+            do_mgiza=True,
+            do_simalign=False,
+            do_awesome=True,
+            alignment_cache_dir=str(tmp_path / "cache"),
+        )
+
+    for alignment_method in ALIGNMENT_METHODS:
+        assert aligner_calls[alignment_method] == [
+            [paths["source_train"], paths["source_augmentation"]]
+        ]
+        with open(
+            get_alignments_path(
+                str(tmp_path / "second"), "en2es", alignment_method, "train"
+            ),
+            encoding="utf8",
+        ) as alignments_file:
+            assert alignments_file.read() == "0-0 1-1\n0-0\n"
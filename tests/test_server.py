@@ -0,0 +1,105 @@
+import http.client
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Tuple
+
+import pytest
+
+from SimAlign.server import (
+    ProjectionHTTPServer,
+    ProjectionRequestHandler,
+    ProjectionService,
+    parse_request,
+)
+
+
+class MonotonicAligner:
+    """
+    Aligns the i-th source word to the i-th target word, so the tests do not need a SimAlign model.
+    """
+
+    def align(
+        self, sentence_pairs: List[Tuple[List[str], List[str]]]
+    ) -> List[List[Tuple[int, int]]]:
+        return [
+            [(i, i) for i in range(min(len(source), len(target)))]
+            for source, target in sentence_pairs
+        ]
+
+
+GOOD_REQUEST: Dict = {
+    "source_tokens": ["The", "Eiffel", "Tower"],
+    "source_tags": ["O", "B-LOC", "I-LOC"],
+    "target_tokens": ["La", "Torre", "Eiffel"],
+}
+
+
+@pytest.mark.parametrize("tag", ["B", "B-X-Y", "X-LOC", "B-", ""])
+def test_parse_request_rejects_invalid_tags(tag: str):
+    body = json.dumps({**GOOD_REQUEST, "source_tags": ["O", tag, "I-LOC"]})
+    with pytest.raises(ValueError, match="Invalid source tags"):
+        parse_request(body.encode("utf8"))
+
+
+def test_invalid_request_does_not_fail_its_batch():
+    """
+    A request that cannot be projected fails on its own, the other requests of its micro-batch are projected.
+    """
+    service = ProjectionService(MonotonicAligner(), max_batch_size=3, max_wait_ms=1000)
+    # Not validated by parse_request, it fails in the projection
+    bad_request = {**GOOD_REQUEST, "source_tags": ["O", "B", "I-LOC"]}
+    with ThreadPoolExecutor(3) as executor:
+        futures = [
+            executor.submit(service.project, request, 10)
+            for request in [GOOD_REQUEST, bad_request, GOOD_REQUEST]
+        ]
+
+        for i in [0, 2]:
+            assert futures[i].result() == {
+                "target_tokens": ["La", "Torre", "Eiffel"],
+                "target_tags": ["O", "B-LOC", "I-LOC"],
+                "alignment": "0-0 1-1 2-2",
+            }
+        with pytest.raises(ValueError):
+            futures[1].result()
+
+    assert service.stats()["batch_sizes"] == {3: 1}
+    assert service.stats()["errors"] == 1
+
+
+def test_http_invalid_tags_are_client_errors():
+    service = ProjectionService(MonotonicAligner(), max_batch_size=3, max_wait_ms=100)
+    handler = type(
+        "Handler",
+        (ProjectionRequestHandler,),
+        {"service": service, "timeout_seconds": 10},
+    )
+    server = ProjectionHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    def post(request: Dict) -> Tuple[int, Dict]:
+        connection = http.client.HTTPConnection("127.0.0.1", server.server_port)
+        connection.request("POST", "/project", json.dumps(request))
+        response = connection.getresponse()
+        return response.status, json.loads(response.read())
+
+    try:
+        with ThreadPoolExecutor(3) as executor:
+            responses = list(
+                executor.map(
+                    post,
+                    [
+                        GOOD_REQUEST,
+                        {**GOOD_REQUEST, "source_tags": ["O", "B", "I-LOC"]},
+                        GOOD_REQUEST,
+                    ],
+                )
+            )
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    assert [status for status, _ in responses] == [200, 400, 200]
+    assert responses[0][1]["target_tags"] == ["O", "B-LOC", "I-LOC"]
+    assert "Invalid source tags" in responses[1][1]["error"]
@@ -0,0 +1,55 @@
+import os
+
+import pytest
+
+from projection.annotation_proyection import get_projection_function
+from projection.dataset import ProjectionDataloader
+
+REPO_DIR: str = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SOURCE_TSV: str = os.path.join(REPO_DIR, "sample/en.absa.test.tsv")
+TARGET_TXT: str = os.path.join(REPO_DIR, "sample/en2es.absa.test.txt")
+ALIGNMENTS_DIR: str = os.path.join(
+    REPO_DIR, "data/absa_datasets/automatic_projections/alignments/en2es"
+)
+
+
+@pytest.mark.parametrize(
+    "alignments_filename",
+    [
+        "DeepL.50000.simalign.test.itermax.talp",
+        "DeepL.50000.mgiza.test.grow_diag_final-and.talp",
+        "DeepL.50000.awesome.test.talp",
+    ],
+)
+@pytest.mark.parametrize("remove_puncs", [True, False])
+@pytest.mark.parametrize("fill_gap_size", [0, 1, 3])
+def test_numpy_engine_matches_python_engine(
+    alignments_filename: str, remove_puncs: bool, fill_gap_size: int
+):
+    """
+    The numpy engine projects the en2es sample exactly as the python engine, with the same counters.
+    """
+    python_projection, numpy_projection = [
+        get_projection_function(
+            projection_engine=projection_engine,
+            remove_puncs=remove_puncs,
+            fill_gap_size=fill_gap_size,
+            return_counters=True,
+        )
+        for projection_engine in ["python", "numpy"]
+    ]
+
+    num_batches: int = 0
+    for batch in ProjectionDataloader(
+        source_tsv=SOURCE_TSV,
+        target_txt=TARGET_TXT,
+        alignments_talp=os.path.join(ALIGNMENTS_DIR, alignments_filename),
+        batch_size=100,
+    ):
+        python_output, python_counters = python_projection(*batch)
+        numpy_output, numpy_counters = numpy_projection(*batch)
+        assert numpy_output == python_output
+        assert numpy_counters == python_counters
+        num_batches += 1
+
+    assert num_batches == 7
@@ -1,38 +1,193 @@
 import os
 import argparse
-import subprocess
-from shlex import quote
+from typing import List, Tuple
 
+import numpy as np
 
-def run_bash_command(command: str) -> None:
-    subprocess.run(["bash", "-c", command])
+from projection.compression import open_file
+from projection.sentence_index import SentenceIndex
+
+# The dataset is processed in blocks of bytes with numpy. A token is a run of bytes that are not whitespace, as in
+# str.split(): the ASCII whitespace and the UTF-8 encoding of the unicode whitespace characters (i.e. U+00A0).
+NEWLINE: int = ord("\n")
+SPACE: int = ord(" ")
+ASCII_WHITESPACE = np.zeros(256, dtype=bool)
+ASCII_WHITESPACE[[ord(c) for c in " \t\n\r\x0b\x0c\x1c\x1d\x1e\x1f"]] = True
+# The last unicode whitespace character is U+3000
+UNICODE_WHITESPACE: List[bytes] = [
+    c.encode("utf8") for c in map(chr, range(128, 0x3001)) if c.isspace()
+]
+UNICODE_WHITESPACE_LEADS = np.zeros(256, dtype=bool)
+UNICODE_WHITESPACE_LEADS[[c[0] for c in UNICODE_WHITESPACE]] = True
+
+
+def whitespace_mask(data: np.ndarray) -> np.ndarray:
+    """
+    Mask of the bytes of data that belong to a whitespace character.
+    """
+    # Every ASCII whitespace byte is <= 32, only the rare control bytes need the lookup table
+    whitespace = data <= SPACE
+    control = np.flatnonzero(
+        whitespace & (data != SPACE) & (data != NEWLINE) & (data != ord("\t"))
+    )
+    whitespace[control] = ASCII_WHITESPACE[data[control]]
+
+    leads = np.flatnonzero(data >= min(c[0] for c in UNICODE_WHITESPACE))
+    leads = leads[UNICODE_WHITESPACE_LEADS[data[leads]]]
+    for character in UNICODE_WHITESPACE:
+        positions = leads[
+            (data[leads] == character[0]) & (leads + len(character) <= len(data))
+        ]
+        for i in range(1, len(character)):
+            positions = positions[data[positions + i] == character[i]]
+        for i in range(len(character)):
+            whitespace[positions + i] = True
+    return whitespace
+
+
+def split_block(data: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Find the tokens of a block of lines. The block must end with a newline.
+    :return: Start of each token, end (exclusive) of each token and position of the newline of each line.
+    """
+    whitespace = whitespace_mask(data)
+    content = ~whitespace
+    token_starts = np.flatnonzero(content & np.concatenate(([True], whitespace[:-1])))
+    token_ends = np.flatnonzero(content & np.concatenate((whitespace[1:], [True]))) + 1
+    newlines = np.flatnonzero(data == NEWLINE)
+    return token_starts, token_ends, newlines
+
+
+def column_bytes(
+    data: np.ndarray,
+    token_starts: np.ndarray,
+    token_ends: np.ndarray,
+    empty_line_newlines: np.ndarray,
+) -> bytes:
+    """
+    Text of a column of the block: each token followed by a space, and a newline for each empty line.
+    """
+    # The byte after each token is whitespace (the block ends with a newline), it is kept and replaced by a space.
+    # The kept bytes are found by toggling at the start of each token and after its separator. The byte after the
+    # separator is never the start of a token of the same column, the other token of the line (or the newline) is
+    # in between.
+    toggles = np.zeros(len(data) + 1, dtype=bool)
+    toggles[token_starts] = True
+    toggles[token_ends + 1] = True
+    keep = np.logical_xor.accumulate(toggles[:-1])
+    keep[empty_line_newlines] = True
+    values = data.copy()
+    values[token_ends] = SPACE
+    return values[keep].tobytes()
 
 
 def conll2text(
-    input_path: str, sentences_output_path: str, tags_output_path: str = None
-):
+    input_path: str,
+    sentences_output_path: str,
+    tags_output_path: str = None,
+    block_size: int = 1 << 24,
+) -> int:
+    """
+    Convert a tsv dataset (one "word tag" line per word, sentences separated by an empty line) into a txt file with
+    one sentence per line, and optionally a txt file with the tags of each sentence. The dataset is read once, in
+    blocks, and each line is checked to have two columns. The sentence index of the dataset is saved too, so the
+    projection dataloader does not need to count its sentences again.
+    :param str input_path: Path to the tsv dataset. Compressed files (.gz, .zst, .xz) are supported, and the output
+    files are compressed if they have a compression extension.
+    :param str sentences_output_path: Path where the sentences will be stored in txt format (one per line).
+    :param str tags_output_path: Path where the tags will be stored in txt format (one per line).
+    :param int block_size: Number of bytes read at once.
+    :return: Number of sentences. Each empty line ends a sentence, the lines after the last empty line are the last
+    sentence (the same sentences as SentenceIndex(input_path, tsv=True)).
+    """
 
     if not os.path.exists(os.path.dirname(sentences_output_path)):
         os.makedirs(os.path.dirname(sentences_output_path))
     if tags_output_path and not os.path.exists(os.path.dirname(tags_output_path)):
         os.makedirs(os.path.dirname(tags_output_path))
 
-    command = (
-        f"cat {quote(input_path)} | awk '{{ print $1 }}' | "
-        f"awk ' /^$/ {{ print; }} /./ {{ printf(\"%s \", $0); }} ' "
-        f"> {quote(sentences_output_path)}"
-    )
+    stat = os.stat(input_path)
+    sentence_ends: List[np.ndarray] = []
+    # Offset of the current block in the dataset and number of lines before it
+    block_start: int = 0
+    # Size of the (decompressed) dataset
+    input_size: int = 0
+    num_lines: int = 0
+    # Whether the last line was a word, so the last sentence has not been ended by an empty line
+    open_sentence: bool = False
+
+    with open_file(input_path, "rb") as input_file, open_file(
+        sentences_output_path, "wb"
+    ) as sentences_file, open_file(
+        tags_output_path if tags_output_path else os.devnull, "wb"
+    ) as tags_file:
+        remainder: bytes = b""
+        while True:
+            block: bytes = input_file.read(block_size)
+            input_size += len(block)
+            if block:
+                block = remainder + block
+                last_newline: int = block.rfind(b"\n")
+                if last_newline == -1:
+                    remainder = block
+                    continue
+                remainder = block[last_newline + 1 :]
+                block = block[: last_newline + 1]
+            elif remainder:
+                # The last line does not end with a newline
+                block, remainder = remainder + b"\n", b""
+            else:
+                break
+
+            data = np.frombuffer(block, dtype=np.uint8)
+            token_starts, token_ends, newlines = split_block(data)
+            tokens_per_line = np.diff(
+                np.searchsorted(token_starts, newlines), prepend=0
+            )
+            wrong_lines = np.flatnonzero(
+                (tokens_per_line != 0) & (tokens_per_line != 2)
+            )
+            if len(wrong_lines):
+                line_no = int(wrong_lines[0])
+                line_start = int(newlines[line_no - 1]) + 1 if line_no > 0 else 0
+                line = block[line_start : newlines[line_no]].decode("utf8")
+                raise ValueError(
+                    f"Unable to split line {num_lines + line_no + 1} of {input_path}: {line!r}. "
+                    f"Expected two columns (word and tag)."
+                )
+
+            # Every non-empty line has two tokens: the word and the tag
+            empty_line_newlines = newlines[tokens_per_line == 0]
+            sentences_file.write(
+                column_bytes(
+                    data, token_starts[0::2], token_ends[0::2], empty_line_newlines
+                )
+            )
+            if tags_output_path:
+                tags_file.write(
+                    column_bytes(
+                        data, token_starts[1::2], token_ends[1::2], empty_line_newlines
+                    )
+                )
+
+            sentence_ends.append(empty_line_newlines + (block_start + 1))
+            block_start += len(block)
+            num_lines += len(newlines)
+            open_sentence = bool(tokens_per_line[-1])
 
-    run_bash_command(command)
+        if open_sentence:
+            # The dataset does not end with an empty line
+            sentences_file.write(b"\n")
+            tags_file.write(b"\n")
+            sentence_ends.append(np.array([input_size]))
 
-    if tags_output_path:
-        command = (
-            f"cat {quote(input_path)} | awk '{{ print $2 }}' | "
-            f"awk ' /^$/ {{ print; }} /./ {{ printf(\"%s \", $0); }} ' "
-            f"> {quote(tags_output_path)}"
-        )
+    # The newline added to the last line is not part of the dataset
+    offsets = np.minimum(np.concatenate([[0]] + sentence_ends), input_size)
+    offsets = offsets.astype(np.int64)
+    if os.stat(input_path).st_mtime_ns == stat.st_mtime_ns:
+        SentenceIndex(input_path, tsv=True, offsets=offsets)
 
-    run_bash_command(command)
+    return len(offsets) - 1
 
 
 if __name__ == "__main__":
@@ -60,8 +215,9 @@ if __name__ == "__main__":
 
     args = parser.parse_args()
 
-    conll2text(
+    num_sentences = conll2text(
         input_path=args.input_path,
         sentences_output_path=args.sentences_output_path,
         tags_output_path=args.tags_output_path,
     )
+    print(f"{args.input_path}: {num_sentences} sentences.")
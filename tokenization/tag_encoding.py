@@ -1,14 +1,15 @@
 from typing import TextIO, List
 import os
 import argparse
+from projection.compression import open_file, tmp_path
 
 
 def to_IOB_encoding(input_path: str, output_path: str, block_size=65536) -> None:
     # From IOB2 or BILOU
     prev_tag_b: str = "O"
     prev_tag_t: str = ""
-    input_file: TextIO = open(input_path, "r", encoding="utf-8")
-    output_file: TextIO = open(output_path, "w+", encoding="utf-8")
+    input_file: TextIO = open_file(input_path)
+    output_file: TextIO = open_file(output_path, "w+")
 
     lines: List[str] = input_file.readlines(block_size)
     line_no: int = 0
@@ -61,8 +62,8 @@ def to_IOB2_encoding(input_path: str, output_path: str, block_size=65536) -> Non
     # From IOB or BILOU
     prev_tag_b: str = "O"
     prev_tag_t: str = ""
-    input_file: TextIO = open(input_path, "r", encoding="utf-8")
-    output_file: TextIO = open(output_path, "w+", encoding="utf-8")
+    input_file: TextIO = open_file(input_path)
+    output_file: TextIO = open_file(output_path, "w+")
 
     lines: List[str] = input_file.readlines(block_size)
     line_no: int = 0
@@ -117,8 +118,8 @@ def to_BILOU_encoding(input_path: str, output_path: str, block_size=65536) -> No
     # From IOB or IOB2
     prev_word: str = ""
     prev_word_tag_tmp: str = ""
-    input_file: TextIO = open(input_path, "r", encoding="utf-8")
-    output_file: TextIO = open(output_path, "w+", encoding="utf-8")
+    input_file: TextIO = open_file(input_path)
+    output_file: TextIO = open_file(output_path, "w+")
 
     lines: List[str] = input_file.readlines(block_size)
     line_no: int = 0
@@ -256,8 +257,8 @@ def to_BILOU_encoding(input_path: str, output_path: str, block_size=65536) -> No
 
 
 def rewrite_only_spans(dataset_path: str, block_size=65536) -> None:
-    input_file: TextIO = open(dataset_path, "r", encoding="utf-8")
-    output_file: TextIO = open(f"{dataset_path}.tmp", "w+", encoding="utf-8")
+    input_file: TextIO = open_file(dataset_path)
+    output_file: TextIO = open_file(tmp_path(dataset_path), "w+")
 
     lines: List[str] = input_file.readlines(block_size)
     line_no: int = 0
@@ -300,7 +301,7 @@ def rewrite_only_spans(dataset_path: str, block_size=65536) -> None:
     output_file.close()
 
     os.remove(dataset_path)
-    os.rename(f"{dataset_path}.tmp", dataset_path)
+    os.rename(tmp_path(dataset_path), dataset_path)
 
 
 def rewrite_dataset(dataset_path: str, encoding: str, output_path=None) -> None:
@@ -309,12 +310,16 @@ def rewrite_dataset(dataset_path: str, encoding: str, output_path=None) -> None:
         os.makedirs(os.path.dirname(output_path))
 
     if encoding is not None:
+        # The temporary file has the compression of the output file
+        output_tmp_path: str = tmp_path(
+            dataset_path if output_path is None else output_path
+        )
         if encoding == "IOB":
-            to_IOB_encoding(dataset_path, f"{dataset_path}.tmp")
+            to_IOB_encoding(dataset_path, output_tmp_path)
         elif encoding == "IOB2":
-            to_IOB2_encoding(dataset_path, f"{dataset_path}.tmp")
+            to_IOB2_encoding(dataset_path, output_tmp_path)
         elif encoding == "BILOU":
-            to_BILOU_encoding(dataset_path, f"{dataset_path}.tmp")
+            to_BILOU_encoding(dataset_path, output_tmp_path)
         else:
             raise NotImplementedError(
                 f"Encoding {encoding} not supported. Supported encodings [IOB,IOB2,BILOU]"
@@ -322,9 +327,9 @@ def rewrite_dataset(dataset_path: str, encoding: str, output_path=None) -> None:
 
         if output_path is None:
             os.remove(dataset_path)
-            os.rename(f"{dataset_path}.tmp", dataset_path)
+            os.rename(output_tmp_path, dataset_path)
         else:
-            os.rename(f"{dataset_path}.tmp", output_path)
+            os.rename(output_tmp_path, output_path)
 
 
 if __name__ == "__main__":
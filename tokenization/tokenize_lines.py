@@ -1,12 +1,15 @@
 import multiprocessing as mp
 from multiprocessing.pool import Pool
-import psutil
 from functools import partial
 import math
-from typing import List, Callable, TextIO
-import spacy.tokenizer
+from typing import List, Callable, Optional, TextIO, TYPE_CHECKING
 import argparse
 from tokenization.utils import tokenize2text, get_tokenizer
+from projection.compression import open_file
+
+if TYPE_CHECKING:
+    # spacy and psutil are slow to import, they are only imported when the lines are tokenized
+    import spacy.tokenizer
 
 
 def batch(iterable, n=1) -> iter:
@@ -18,7 +21,7 @@ def batch(iterable, n=1) -> iter:
 
 
 def process_lines_thread(
-    process_function: Callable, tokenizer: spacy.tokenizer.Tokenizer, lines: List[str]
+    process_function: Callable, tokenizer: "spacy.tokenizer.Tokenizer", lines: List[str]
 ) -> List[str]:
     try:
         return [process_function(line.strip(), tokenizer) for line in lines]
@@ -33,15 +36,27 @@ def save_thread(file, data) -> None:
 def fast_tokenize_lines(
     input_path: str,
     output_path: str,
-    tokenizer: spacy.tokenizer.Tokenizer,
+    tokenizer: "spacy.tokenizer.Tokenizer",
     process_function: Callable,
-    block_size: int = int(psutil.virtual_memory()[1] * 0.001),
-    num_parallel: int = psutil.cpu_count(),
+    block_size: Optional[int] = None,
+    num_parallel: Optional[int] = None,
     skip_lines: int = 0,
 ) -> None:
-
-    input_file: TextIO = open(input_path, "r", encoding="utf-8")
-    output_file: TextIO = open(output_path, "w+", encoding="utf-8")
+    """
+    Tokenize the lines of input_path in parallel and write them to output_path.
+    :param int block_size: Number of bytes read at a time. Defaults to 0.1% of the available memory.
+    :param int num_parallel: Number of worker processes. Defaults to the number of CPUs.
+    """
+    if block_size is None or num_parallel is None:
+        import psutil
+
+        if block_size is None:
+            block_size = int(psutil.virtual_memory()[1] * 0.001)
+        if num_parallel is None:
+            num_parallel = psutil.cpu_count()
+
+    input_file: TextIO = open_file(input_path)
+    output_file: TextIO = open_file(output_path, "w+")
 
     if skip_lines:
         for _ in range(skip_lines):
@@ -1,3 +1,6 @@
+from projection.compression import open_file
+
+
 def get_tokenizer(language: str):
     from spacy.lang.en import English
     from spacy.lang.es import Spanish
@@ -62,5 +65,5 @@ def blocks(files, size=65536):
 
 
 def count_lines(input_path: str) -> int:
-    with open(input_path, "r", encoding="utf8") as f:
+    with open_file(input_path) as f:
         return sum(bl.count("\n") for bl in blocks(f))